@@ -1,4 +1,7 @@
 from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import StreamingResponse
+from typing import Dict, Any, List
+import json
 from schema import LLMResponseDTO, LLMQueryDTO
 from service import RAGModelQueryService
 import logging
@@ -23,8 +26,8 @@ async def query_llm(query: LLMQueryDTO) -> LLMResponseDTO:
     try:
         logger.info(f"Received query with ID: {query.session_id}")
 
-        # Call the RAGModelQueryService to handle the query
-        response_content = rag_query_service.query(query)
+        # Call the RAGModelQueryService to handle the query, the async pipeline keeps the event loop free while waiting
+        response_content = await rag_query_service.aquery(query)
 
         logger.info(f"Successfully processed query with ID: {query.session_id}")
         return response_content
@@ -43,4 +46,46 @@ async def query_llm(query: LLMQueryDTO) -> LLMResponseDTO:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="An unexpected error occurred while processing your request.",
-        )
\ No newline at end of file
+        )
+
+
+@router.post("/chatbot/stream")
+async def stream_llm(query: LLMQueryDTO) -> StreamingResponse:
+    """
+    Endpoint to query the language model, streaming the answer as Server-Sent Events while it is generated.
+
+    Every piece of the answer is sent as a `token` event with `{"token": "..."}`. The stream ends with a `done` event
+    holding the LLMResponseDTO of the complete answer, with `successful` false when the query failed.
+
+    Args:
+        query (LLMQueryDTO): Input query data transfer object.
+
+    Returns:
+        StreamingResponse: The `text/event-stream` of the answer.
+    """
+    logger.info(f"Received streaming query with ID: {query.session_id}")
+
+    async def stream_events():
+        async for event, data in rag_query_service.astream(query):
+            if event == "token":
+                yield f"event: token\ndata: {json.dumps({'token': data})}\n\n"
+            else:
+                logger.info(f"Finished streaming query with ID: {query.session_id}")
+                yield f"event: done\ndata: {data.model_dump_json()}\n\n"
+
+    # Proxies must not buffer the events
+    return StreamingResponse(
+        stream_events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/chatbot/cache-stats", response_model=Dict[str, Any])
+async def get_cache_stats() -> Dict[str, Any]:
+    return rag_query_service.cache_stats()
+
+
+@router.get("/chatbot/model-health", response_model=List[Dict[str, Any]])
+async def get_model_health() -> List[Dict[str, Any]]:
+    return rag_query_service.model_query_service.stats()
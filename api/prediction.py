@@ -1,10 +1,19 @@
+import hmac
+import io
+import json
 import logging
+import tempfile
 
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, Header, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
 
-from schema import PredictionDTO, BoardGameDTO, Mechanic, Domain
+from config import (PREDICTION_BATCH_MAX_SIZE, PREDICTION_BULK_CHUNK_SIZE, PREDICTION_SWEEP_MAX_VARIANTS,
+                    PREDICTION_ADMIN_TOKEN)
+from schema import PredictionDTO, BoardGameDTO, PredictionTarget, Mechanic, Domain, SweepRequestDTO, SweepResultDTO
 from service import PredictionModelService
-from typing import List
+from service.prediction.bulk_scoring import read_ndjson_rows, ascore_rows
+from service.prediction.sweep import sweep_size
+from typing import List, Dict, Any, Optional
 
 logger = logging.getLogger("app")
 
@@ -12,13 +21,15 @@ router = APIRouter()
 
 prediction_model_service = PredictionModelService()
 
-@router.post("/prediction", response_model=PredictionDTO)
-async def predict(board_game_dto: BoardGameDTO) -> PredictionDTO:
+@router.post("/prediction", response_model=PredictionDTO, response_model_exclude_none=True)
+async def predict(board_game_dto: BoardGameDTO, targets: Optional[List[PredictionTarget]] = Query(None)) -> PredictionDTO:
     """
     Endpoint to query the prediction model.
 
     Args:
         board_game_dto (BoardGameDTO): Input data transfer object.
+        targets (List[PredictionTarget]): Optional values to predict, e.g. `?targets=popularity_score`.
+            Only these models are run. Defaults to all values.
 
     Returns:
         PredictionDTO: The response from the prediction model.
@@ -26,7 +37,7 @@ async def predict(board_game_dto: BoardGameDTO) -> PredictionDTO:
     try:
         logger.info(f"Received request for prediction: {board_game_dto}")
         
-        response = prediction_model_service.predict_board_game(board_game_dto)
+        response = (await prediction_model_service.predict_board_games_async([board_game_dto], targets))[0]
         
         logger.info(f"Board game successfully predicted: {response}")
         return response
@@ -39,6 +50,125 @@ async def predict(board_game_dto: BoardGameDTO) -> PredictionDTO:
         )
 
 
+@router.post("/prediction/batch", response_model=List[PredictionDTO], response_model_exclude_none=True)
+async def predict_batch(board_game_dtos: List[BoardGameDTO],
+                        targets: Optional[List[PredictionTarget]] = Query(None)) -> List[PredictionDTO]:
+    """
+    Endpoint to query the prediction model for a batch of board games at once.
+
+    Args:
+        board_game_dtos (List[BoardGameDTO]): Input data transfer objects.
+        targets (List[PredictionTarget]): Optional values to predict. Defaults to all values.
+
+    Returns:
+        List[PredictionDTO]: The predictions, in the same order as the input.
+    """
+    if len(board_game_dtos) > PREDICTION_BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Batch size {len(board_game_dtos)} exceeds the maximum of {PREDICTION_BATCH_MAX_SIZE}.",
+        )
+
+    try:
+        logger.info(f"Received batch request for prediction: {len(board_game_dtos)} board games")
+        
+        response = await prediction_model_service.predict_board_games_async(board_game_dtos, targets)
+        
+        logger.info(f"Batch of {len(response)} board games successfully predicted")
+        return response
+    
+    except Exception as e:
+        logger.error(f"Exception raised while batch prediction: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An unexpected error occurred while processing your request.",
+        )
+
+
+@router.post("/prediction/sweep", response_model=SweepResultDTO, response_model_exclude_none=True)
+async def predict_sweep(sweep_request: SweepRequestDTO,
+                        targets: Optional[List[PredictionTarget]] = Query(None)) -> SweepResultDTO:
+    """
+    Endpoint for what-if questions: predicts a base board game and every variant generated by the axes in one call.
+
+    Axes vary a numeric field over a range, add one mechanic per variant or toggle one domain per variant. Several
+    axes are combined into every combination of their values. Variants outside the bounds of a board game are left out.
+
+    Args:
+        sweep_request (SweepRequestDTO): The base board game and the axes to vary.
+        targets (List[PredictionTarget]): Optional values to predict. Defaults to all values.
+
+    Returns:
+        SweepResultDTO: The prediction of the base board game and of every variant, with the values it changes.
+    """
+    # Counted without creating the values of the axes, and only until the maximum is exceeded
+    variants = sweep_size(sweep_request.board_game, sweep_request.axes, limit=PREDICTION_SWEEP_MAX_VARIANTS)
+    if variants > PREDICTION_SWEEP_MAX_VARIANTS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Sweep of more than {PREDICTION_SWEEP_MAX_VARIANTS} variants.",
+        )
+
+    try:
+        logger.info(f"Received sweep request for prediction: {variants} variants")
+
+        response = await prediction_model_service.sweep_async(sweep_request, targets)
+
+        logger.info(f"Sweep of {len(response.variants)} variants successfully predicted")
+        return response
+
+    except Exception as e:
+        logger.error(f"Exception raised while sweep prediction: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An unexpected error occurred while processing your request.",
+        )
+
+
+@router.post("/prediction/bulk")
+async def predict_bulk(request: Request, targets: Optional[List[PredictionTarget]] = Query(None)) -> StreamingResponse:
+    """
+    Endpoint to score an NDJSON upload of board games, one board game per line.
+
+    The upload is spooled to a temporary file, then read and predicted in chunks of PREDICTION_BULK_CHUNK_SIZE rows
+    while the results are streamed back, so uploads of any size are scored with constant memory. Every output line is
+    a JSON object with the 1-based input `row` and either the predictions or the validation `errors` of that row.
+    Invalid rows do not stop the job.
+
+    Args:
+        request (Request): The request, its body is the NDJSON upload.
+        targets (List[PredictionTarget]): Optional values to predict. Defaults to all values.
+
+    Returns:
+        StreamingResponse: The NDJSON results.
+    """
+    logger.info("Received bulk request for prediction")
+
+    # The upload is read completely before streaming starts: a streaming response listens for the client disconnect
+    # on the same receive channel as the request body
+    upload = tempfile.TemporaryFile()
+    async for chunk in request.stream():
+        upload.write(chunk)
+    upload.seek(0)
+
+    async def stream_results():
+        counts = {"result": 0, "error": 0}
+        try:
+            with io.TextIOWrapper(upload, encoding="utf-8-sig") as lines:
+                async for kind, record in ascore_rows(read_ndjson_rows(lines), prediction_model_service,
+                                                      PREDICTION_BULK_CHUNK_SIZE, targets):
+                    counts[kind] += 1
+                    yield json.dumps(record) + "\n"
+        except Exception as e:
+            # The status code has been sent already, the error is reported as the last line
+            logger.error(f"Exception raised while bulk prediction: {e}")
+            yield json.dumps({"errors": ["An unexpected error occurred while processing your request."]}) + "\n"
+            return
+        logger.info(f"Bulk request finished: {counts['result']} board games predicted, {counts['error']} invalid rows")
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+
 @router.get("/prediction/available-mechanic", response_model=List[str])
 async def get_all_available_mechanics() -> List[str]:
     return [item for item in Mechanic]
@@ -48,3 +178,54 @@ async def get_all_available_mechanics() -> List[str]:
 async def get_all_available_domains() -> List[str]:
     return [item for item in Domain]
 
+
+@router.get("/prediction/cache-stats", response_model=Dict[str, Any])
+async def get_cache_stats() -> Dict[str, Any]:
+    return prediction_model_service.cache_stats()
+
+
+@router.get("/prediction/model-version", response_model=Dict[str, Any])
+async def get_model_version() -> Dict[str, Any]:
+    """
+    Returns the served prediction model version, the version being loaded and the available versions.
+    """
+    return prediction_model_service.model_versions()
+
+
+@router.post("/prediction/model-version/{version}", response_model=Dict[str, Any], status_code=status.HTTP_202_ACCEPTED)
+async def activate_model_version(version: str, x_admin_token: Optional[str] = Header(None)) -> Dict[str, Any]:
+    """
+    Activates a prediction model version. The version is loaded and warmed up in the background,
+    requests are served by the current version until the new one is swapped in.
+    Only available when PREDICTION_ADMIN_TOKEN is set, the request must send it in the `X-Admin-Token` header.
+
+    Args:
+        version (str): The version to activate, the name of a folder in the prediction model registry.
+        x_admin_token (str): The admin token.
+
+    Returns:
+        Dict[str, Any]: The served, loading and available versions.
+    """
+    if not PREDICTION_ADMIN_TOKEN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Activating a model version over the API is disabled, point the ACTIVE file to it instead.",
+        )
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token.encode("utf-8"),
+                                                        PREDICTION_ADMIN_TOKEN.encode("utf-8")):
+        logger.warning(f"Rejected activation of prediction model version {version}: invalid admin token")
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid admin token.")
+
+    try:
+        prediction_model_service.activate_version(version)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    except Exception as e:
+        logger.error(f"Exception raised while activating prediction model version {version}: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An unexpected error occurred while processing your request.",
+        )
+
+    logger.info(f"Activating prediction model version {version}")
+    return prediction_model_service.model_versions()
@@ -0,0 +1,125 @@
+"""
+Compares the chunking of the rulebooks: the previous fixed splitter (250 characters with 50 characters of overlap)
+and the StructureAwareChunker with the configured chunk sizes (CHUNK_MAX_TOKENS, CHUNK_MAX_TOKENS_PER_CORPUS).
+
+Reports the amount of chunks per splitter and the amount of embedding calls, one per chunk before and one per
+unique chunk text with the content hash deduplication of the EmbeddingWriter.
+
+By default the documents in DOCS_PATH are split. Without documents, synthetic rulebooks are generated: a classic and
+a belgium edition per language that share most of their sections, like the real rulebooks.
+
+Usage:
+    python -m benchmarks.chunking_benchmark
+    python -m benchmarks.chunking_benchmark --docs data/docs
+"""
+import argparse
+import json
+import os
+import random
+from typing import Any, Dict, List
+
+from langchain.schema.document import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from config import DOCS_PATH
+from service.rag.context.chroma import (SUPPORTED_EXTENSIONS, extract_metadata_from_filename, load_from_pdf,
+                                        load_from_txt, split_documents)
+from service.rag.context.embedding_writer import content_hash
+from service.rag.context.prompt_builder import estimate_tokens
+
+WORDS = ("player bank property house hotel rent dice double jail card money square board turn auction mortgage "
+         "street station tax owner pays receives moves passes lands buys sells builds").split()
+
+
+def legacy_split(documents: List[Document]) -> List[Document]:
+    return RecursiveCharacterTextSplitter(
+        chunk_size=250,
+        chunk_overlap=50,
+        length_function=len,
+        is_separator_regex=False,
+    ).split_documents(documents)
+
+
+def load_directory(path: str) -> List[Document]:
+    documents = []
+    for file_name in sorted(os.listdir(path)):
+        if not file_name.endswith(SUPPORTED_EXTENSIONS):
+            continue
+        file_path = os.path.join(path, file_name)
+        loaded = load_from_pdf(file_path) if file_name.endswith(".pdf") else load_from_txt(file_path)
+        game_mode, language = extract_metadata_from_filename(file_name)
+        for doc in loaded:
+            doc.metadata.update(game_mode=game_mode, language=language)
+        documents.extend(loaded)
+    return documents
+
+
+def synthetic_rulebooks(sections: int, shared: float, rng: random.Random) -> List[Document]:
+    """
+    Returns a classic and a belgium rulebook per language, the belgium edition keeps `shared` of the classic sections.
+    """
+    def sentence() -> str:
+        return " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 20))).capitalize() + "."
+
+    documents = []
+    for language in ("en", "nl"):
+        classic = [
+            f"{' '.join(rng.choice(WORDS) for _ in range(2)).upper()}\n"
+            + "\n\n".join(" ".join(sentence() for _ in range(rng.randint(2, 5))) for _ in range(rng.randint(1, 3)))
+            for _ in range(sections)
+        ]
+        belgium = [section if rng.random() < shared else f"{section.splitlines()[0]}\n{sentence()} {sentence()}"
+                   for section in classic]
+        for game_mode, rulebook in (("classic", classic), ("belgium", belgium)):
+            documents.append(Document(
+                page_content="\n".join(rulebook),
+                metadata={"source": f"rules_{game_mode}_{language}.txt", "game_mode": game_mode, "language": language},
+            ))
+    return documents
+
+
+def describe(name: str, chunks: List[Document], deduplicated: bool) -> Dict[str, Any]:
+    tokens = [estimate_tokens(chunk.page_content) for chunk in chunks]
+    return {
+        "splitter": name,
+        "chunks": len(chunks),
+        "embedding_calls": len({content_hash(chunk.page_content) for chunk in chunks}) if deduplicated else len(chunks),
+        "average_tokens": sum(tokens) / len(tokens) if tokens else 0.0,
+        "max_tokens": max(tokens, default=0),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", default=DOCS_PATH, help="Directory with the rulebooks.")
+    parser.add_argument("--sections", type=int, default=60, help="Sections per synthetic rulebook.")
+    parser.add_argument("--shared", type=float, default=0.8, help="Share of sections the synthetic editions share.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Optional path to write the results as JSON.")
+    args = parser.parse_args()
+
+    documents = load_directory(args.docs) if os.path.isdir(args.docs) else []
+    source = args.docs
+    if not documents:
+        documents = synthetic_rulebooks(args.sections, args.shared, random.Random(args.seed))
+        source = "synthetic rulebooks"
+
+    # Before the content hash deduplication every chunk was embedded
+    before = describe("fixed 250/50", legacy_split(documents), deduplicated=False)
+    after = describe("structure-aware", split_documents(documents), deduplicated=True)
+
+    print(f"{len(documents)} documents ({source})")
+    print(f"{'splitter':<16} {'chunks':>8} {'embed calls':>12} {'avg tokens':>11} {'max tokens':>11}")
+    for result in (before, after):
+        print(f"{result['splitter']:<16} {result['chunks']:>8} {result['embedding_calls']:>12} "
+              f"{result['average_tokens']:>11.1f} {result['max_tokens']:>11}")
+    print(f"chunks: -{1 - after['chunks'] / before['chunks']:.1%}, "
+          f"embedding calls: -{1 - after['embedding_calls'] / before['embedding_calls']:.1%}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({"config": vars(args), "results": [before, after]}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
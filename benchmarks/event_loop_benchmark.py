@@ -0,0 +1,111 @@
+"""
+Measures `/prediction` latency while chatbot calls are in flight on the same worker.
+
+The chatbot is simulated by an endpoint that blocks for `--chat-latency` seconds, either directly on the event loop
+(how `query_llm` used to call the RAG pipeline) or through the RAG thread pool. Predictions run through the real
+prediction router and artifacts.
+
+Usage:
+    python -m benchmarks.event_loop_benchmark --chat-concurrency 8 --chat-latency 1.0 --predictions 200
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Dict, Any, List
+
+import httpx
+from fastapi import FastAPI
+
+from benchmarks.payloads import load_prediction_payloads, vary_payloads, percentile
+from service.executors import run_in_rag_executor, shutdown_executors
+
+
+MODES = ["blocking", "offloaded"]
+
+
+def build_app(mode: str, chat_latency: float) -> FastAPI:
+    # Imported here rather than at the top level: spawned prediction workers run this module again and must not build
+    # another prediction service
+    from api import prediction
+
+    app = FastAPI()
+    app.include_router(prediction.router)
+
+    @app.post("/chatbot")
+    async def simulated_chatbot() -> Dict[str, bool]:
+        if mode == "blocking":
+            time.sleep(chat_latency)
+        else:
+            await run_in_rag_executor(time.sleep, chat_latency)
+        return {"successful": True}
+
+    return app
+
+
+async def run_mode(mode: str, args: argparse.Namespace, payloads: List[Dict[str, Any]]) -> Dict[str, Any]:
+    transport = httpx.ASGITransport(app=build_app(mode, args.chat_latency))
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        # Warm up the prediction pool and the cache-free path
+        await client.post("/prediction", json=payloads[0])
+
+        done = asyncio.Event()
+        chat_calls = 0
+
+        async def chat_user() -> None:
+            nonlocal chat_calls
+            while not done.is_set():
+                await client.post("/chatbot")
+                chat_calls += 1
+                # The in-process transport never yields on its own, a real socket would
+                await asyncio.sleep(0)
+
+        users = [asyncio.create_task(chat_user()) for _ in range(args.chat_concurrency)]
+        await asyncio.sleep(0)
+
+        latencies = []
+        for payload in vary_payloads(payloads, args.predictions):
+            start = time.perf_counter()
+            response = await client.post("/prediction", json=payload)
+            latencies.append((time.perf_counter() - start) * 1000)
+            response.raise_for_status()
+
+        done.set()
+        await asyncio.gather(*users)
+
+    return {
+        "mode": mode,
+        "predictions": len(latencies),
+        "chat_calls": chat_calls,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": max(latencies),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chat-concurrency", type=int, default=8, help="Concurrent simulated chatbot users.")
+    parser.add_argument("--chat-latency", type=float, default=1.0, help="Seconds a simulated chatbot call blocks.")
+    parser.add_argument("--predictions", type=int, default=200, help="Sequential prediction calls to time.")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--output", help="Optional path to write the results as JSON.")
+    args = parser.parse_args()
+
+    payloads = load_prediction_payloads()
+    results = [asyncio.run(run_mode(mode, args, payloads)) for mode in args.modes]
+    shutdown_executors()
+
+    print(f"{'mode':<10} {'chat calls':>10} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'max ms':>10}")
+    for result in results:
+        print(f"{result['mode']:<10} {result['chat_calls']:>10} {result['p50_ms']:>10.2f} "
+              f"{result['p95_ms']:>10.2f} {result['p99_ms']:>10.2f} {result['max_ms']:>10.2f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({"config": vars(args), "results": results}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
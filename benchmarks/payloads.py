@@ -0,0 +1,61 @@
+import json
+import os
+import re
+from typing import List, Dict, Any
+
+
+HTTP_PAYLOADS_PATH = f"testing{os.sep}prediction_model.http"
+
+
+def load_prediction_payloads(path: str = HTTP_PAYLOADS_PATH) -> List[Dict[str, Any]]:
+    """
+    Extracts the JSON bodies of the single `POST /prediction` requests in an .http file.
+
+    Args:
+        path (str): Path to the .http file.
+
+    Returns:
+        List[Dict[str, Any]]: The board game payloads, in file order.
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        content = file.read()
+
+    payloads = []
+    for request in content.split("###"):
+        if not re.search(r"^POST \S+/prediction\s*$", request, flags=re.MULTILINE):
+            continue
+        body_start = re.search(r"^\{", request, flags=re.MULTILINE).start()
+        body = request[body_start:request.rindex("}") + 1]
+        payloads.append(json.loads(body))
+    return payloads
+
+
+def vary_payloads(payloads: List[Dict[str, Any]], count: int) -> List[Dict[str, Any]]:
+    """
+    Returns `count` payloads cycling through `payloads`, every one a different board game: the minimum age, players,
+    play time and year are the digits of the index, so up to 8 million payloads are unique. The prediction service
+    deduplicates the board games of a batch, so repeated payloads would hide the model latency even without the cache.
+    """
+    varied = []
+    for i in range(count):
+        payload = dict(payloads[i % len(payloads)])
+        payload["min_age"] = 2 + i % 20
+        payload["min_players"] = 1 + (i // 20) % 8
+        payload["max_players"] = payload["min_players"] + 8
+        payload["play_time"] = 1 + (i // 160) % 659
+        payload["year_published"] = 1950 + (i // (160 * 659)) % 80
+        varied.append(payload)
+    return varied
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """
+    Returns the `pct` percentile of the values using linear interpolation.
+    """
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
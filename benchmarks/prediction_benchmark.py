@@ -0,0 +1,234 @@
+"""
+Benchmarks the prediction stack against the active version of the real prediction artifacts.
+
+Times, for every batch size:
+- `transform`: FeatureTransfomer.transform_many (`transform` for a single board game).
+- `model:<target>`: every model of BoardGamePredictor on an encoded batch.
+- `service`: PredictionModelService.predict_board_games (`predict_board_game` for a single board game).
+- `http`: POST /prediction (single board game) or /prediction/batch in-process, for every concurrency level.
+
+Board games are taken from testing/prediction_model.http and varied so the prediction cache does not hide the model
+latency, the cache is disabled unless `--cache` is given. Results are written as JSON and can be compared between
+commits:
+
+Usage:
+    python -m benchmarks.prediction_benchmark --output baseline.json
+    python -m benchmarks.prediction_benchmark --output current.json --compare baseline.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List
+
+import httpx
+import numpy as np
+import sklearn
+from fastapi import FastAPI
+
+from benchmarks.payloads import load_prediction_payloads, vary_payloads, percentile
+from config import PREDICTION_EXECUTOR, PREDICTION_POOL_SIZE, PREDICTION_ARTIFACTS_MMAP_MODE
+from schema import BoardGameDTO, PredictionTarget
+from service.executors import shutdown_executors
+
+
+def summarize(name: str, batch_size: int, concurrency: int, latencies_ms: List[float]) -> Dict[str, Any]:
+    mean_ms = sum(latencies_ms) / len(latencies_ms)
+    return {
+        "name": name,
+        "batch_size": batch_size,
+        "concurrency": concurrency,
+        "calls": len(latencies_ms),
+        "mean_ms": mean_ms,
+        "p50_ms": percentile(latencies_ms, 50),
+        "p95_ms": percentile(latencies_ms, 95),
+        "p99_ms": percentile(latencies_ms, 99),
+        "rows_per_s": batch_size * concurrency * 1000 / mean_ms if mean_ms > 0 else float("inf"),
+    }
+
+
+def time_calls(func: Callable[[], Any], repeat: int, warmup: int) -> List[float]:
+    for _ in range(warmup):
+        func()
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def run_in_process(args: argparse.Namespace, dtos: List[BoardGameDTO]) -> List[Dict[str, Any]]:
+    """
+    Times the transformer, every model and the service, without HTTP.
+    """
+    from api import prediction
+
+    service = prediction.prediction_model_service
+    bundle = service.registry.active
+    transformer, predictor = bundle.transformer, bundle.predictor
+    results = []
+
+    for batch_size in args.batch_sizes:
+        batch = dtos[:batch_size]
+        repeat = max(args.min_repeat, args.rows // batch_size)
+
+        if batch_size == 1:
+            transform = lambda: transformer.transform(batch[0])
+            predict = lambda: service.predict_board_game(batch[0])
+        else:
+            transform = lambda: transformer.transform_many(batch)
+            predict = lambda: service.predict_board_games(batch)
+
+        results.append(summarize("transform", batch_size, 1, time_calls(transform, repeat, args.warmup)))
+
+        features = transformer.transform_many(batch)
+        for target, model in predictor.models.items():
+            latencies = time_calls(lambda: model.predict(features), repeat, args.warmup)
+            results.append(summarize(f"model:{target.value}", batch_size, 1, latencies))
+
+        results.append(summarize("service", batch_size, 1, time_calls(predict, repeat, args.warmup)))
+
+    return results
+
+
+async def run_http(args: argparse.Namespace, payloads: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Times the prediction endpoints in-process, with `concurrency` clients sending requests at the same time.
+    """
+    from api import prediction
+
+    app = FastAPI()
+    app.include_router(prediction.router)
+    results = []
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+
+        async def call(batch: List[Dict[str, Any]]) -> float:
+            start = time.perf_counter()
+            if len(batch) == 1:
+                response = await client.post("/prediction", json=batch[0])
+            else:
+                response = await client.post("/prediction/batch", json=batch)
+            response.raise_for_status()
+            return (time.perf_counter() - start) * 1000
+
+        for batch_size in args.batch_sizes:
+            batch = payloads[:batch_size]
+            for concurrency in args.concurrency:
+                repeat = max(args.min_repeat, args.rows // (batch_size * concurrency))
+                for _ in range(args.warmup):
+                    await asyncio.gather(*(call(batch) for _ in range(concurrency)))
+
+                latencies = []
+                for _ in range(repeat):
+                    latencies.extend(await asyncio.gather(*(call(batch) for _ in range(concurrency))))
+                results.append(summarize("http", batch_size, concurrency, latencies))
+
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results: List[Dict[str, Any]], baseline_path: str, threshold: float) -> bool:
+    """
+    Prints the p50 latency of every case next to the baseline.
+
+    Returns:
+        bool: Whether a case is more than `threshold` percent slower than the baseline.
+    """
+    with open(baseline_path, "r", encoding="utf-8") as file:
+        baseline = json.load(file)
+
+    case = lambda result: (result["name"], result["batch_size"], result["concurrency"])
+    baseline_results = {case(result): result for result in baseline["results"]}
+
+    print(f"\nCompared to {baseline_path} (commit {baseline['meta'].get('commit')}):")
+    print(f"{'case':<40} {'base p50 ms':>12} {'p50 ms':>10} {'change':>9}")
+    regressed = False
+    for result in results:
+        base = baseline_results.get(case(result))
+        if base is None:
+            continue
+        change = (result["p50_ms"] - base["p50_ms"]) / base["p50_ms"] * 100 if base["p50_ms"] > 0 else 0.0
+        flag = " !" if change > threshold else ""
+        regressed |= change > threshold
+        name = f"{result['name']} b={result['batch_size']} c={result['concurrency']}"
+        print(f"{name:<40} {base['p50_ms']:>12.3f} {result['p50_ms']:>10.3f} {change:>+8.1f}%{flag}")
+    return regressed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 10, 100, 1000])
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16], help="Concurrent HTTP clients.")
+    parser.add_argument("--rows", type=int, default=2000, help="Rows to predict per case, spread over the calls.")
+    parser.add_argument("--min-repeat", type=int, default=5, help="Minimum timed calls per case.")
+    parser.add_argument("--warmup", type=int, default=2, help="Untimed calls before every case.")
+    parser.add_argument("--skip-http", action="store_true", help="Only run the in-process benchmarks.")
+    parser.add_argument("--cache", action="store_true", help="Keep the prediction cache enabled.")
+    parser.add_argument("--output", help="Optional path to write the results as JSON.")
+    parser.add_argument("--compare", help="Results JSON of a previous run to compare against.")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="Percentage a p50 latency may grow before --compare reports a regression.")
+    args = parser.parse_args()
+
+    # Imported here rather than at the top level: spawned prediction workers run this module again and must not build
+    # another prediction service
+    from api import prediction
+    service = prediction.prediction_model_service
+    if not args.cache:
+        service.cache.max_size = 0
+        service.cache.clear()
+
+    payloads = vary_payloads(load_prediction_payloads(), max(args.batch_sizes))
+    dtos = [BoardGameDTO(**payload) for payload in payloads]
+
+    results = run_in_process(args, dtos)
+    if not args.skip_http:
+        results += asyncio.run(run_http(args, payloads))
+    shutdown_executors()
+
+    # Every row of a batch is a different board game, so the service runs the models on all of them
+    unique = len({json.dumps(payload, sort_keys=True) for payload in payloads})
+    print(f"{unique} unique board games of {len(payloads)}, prediction cache {'on' if args.cache else 'off'}")
+    print(f"{'case':<40} {'calls':>6} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'rows/s':>12}")
+    for result in results:
+        name = f"{result['name']} b={result['batch_size']} c={result['concurrency']}"
+        print(f"{name:<40} {result['calls']:>6} {result['p50_ms']:>10.3f} {result['p95_ms']:>10.3f} "
+              f"{result['p99_ms']:>10.3f} {result['rows_per_s']:>12.0f}")
+
+    meta = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "model_version": service.registry.active.version,
+        "targets": [target.value for target in PredictionTarget],
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "sklearn": sklearn.__version__,
+        "platform": platform.platform(),
+        "prediction_executor": PREDICTION_EXECUTOR,
+        "prediction_pool_size": PREDICTION_POOL_SIZE,
+        "mmap_mode": PREDICTION_ARTIFACTS_MMAP_MODE,
+        "config": vars(args),
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({"meta": meta, "results": results}, file, indent=2)
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
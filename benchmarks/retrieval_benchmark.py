@@ -0,0 +1,147 @@
+"""
+Compares the retrieval engines: the Chroma search with a `$and` metadata filter and the in-memory VectorIndex.
+
+By default a synthetic corpus of `--chunks` random embeddings spread over the game mode and language partitions is
+written to a temporary Chroma database, so no embedding API is called. With `--chroma-path` an existing database
+is benchmarked instead, queried with its own chunk embeddings plus noise.
+
+Reports the p50/p95 latency of a k-nearest query per engine and the overlap of the results with the exact
+float32 search (Chroma uses an approximate HNSW index).
+
+Usage:
+    python -m benchmarks.retrieval_benchmark --chunks 2000 --queries 500
+    python -m benchmarks.retrieval_benchmark --chroma-path data/chroma
+"""
+import argparse
+import json
+import tempfile
+import time
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from langchain_chroma import Chroma
+from langchain_core.embeddings import Embeddings
+
+from benchmarks.payloads import percentile
+from schema import SupportedGameMode, SupportedLanguage
+from service.rag.context.vector_index import VectorIndex
+
+PARTITIONS = [(game_mode.name, language.name) for game_mode in SupportedGameMode for language in SupportedLanguage]
+
+
+class FixedEmbeddings(Embeddings):
+    """
+    Returns precomputed vectors, keyed by text.
+    """
+
+    def __init__(self, vectors: Dict[str, List[float]]):
+        self.vectors = vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.vectors[text] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.vectors[text]
+
+
+def build_synthetic_chroma(path: str, chunks: int, dimensions: int, rng: np.random.Generator) -> Chroma:
+    texts, metadatas, vectors = [], [], {}
+    for i in range(chunks):
+        game_mode, language = PARTITIONS[i % len(PARTITIONS)]
+        text = f"chunk {i}"
+        texts.append(text)
+        metadatas.append({"id": f"synthetic:{i}", "game_mode": game_mode, "language": language})
+        vectors[text] = rng.standard_normal(dimensions).tolist()
+
+    db = Chroma(persist_directory=path, embedding_function=FixedEmbeddings(vectors))
+    for start in range(0, chunks, 1000):
+        db.add_texts(texts[start:start + 1000], metadatas[start:start + 1000],
+                     ids=[metadata["id"] for metadata in metadatas[start:start + 1000]])
+    return db
+
+
+def sample_queries(index: VectorIndex, count: int, rng: np.random.Generator) -> List[Tuple[Tuple[str, str], List[float]]]:
+    """
+    Returns queries near random chunks of random partitions.
+    """
+    keys = list(index.partitions.keys())
+    queries = []
+    for _ in range(count):
+        key = keys[rng.integers(len(keys))]
+        matrix = index.partitions[key].matrix
+        row = matrix[rng.integers(len(matrix))].astype(np.float32)
+        queries.append((key, (row + rng.standard_normal(row.shape[0]) * row.std() * 0.5).tolist()))
+    return queries
+
+
+def time_engine(search, queries, warmup: int) -> Tuple[List[float], List[List[str]]]:
+    for key, embedding in queries[:warmup]:
+        search(key, embedding)
+    latencies, ids = [], []
+    for key, embedding in queries:
+        start = time.perf_counter()
+        results = search(key, embedding)
+        latencies.append((time.perf_counter() - start) * 1000)
+        ids.append([doc.metadata.get("id") for doc, _distance in results])
+    return latencies, ids
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chroma-path", help="Existing Chroma database to benchmark instead of a synthetic one.")
+    parser.add_argument("--chunks", type=int, default=2000, help="Chunks of the synthetic corpus.")
+    parser.add_argument("--dimensions", type=int, default=768, help="Embedding size of the synthetic corpus.")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Optional path to write the results as JSON.")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    if args.chroma_path:
+        db = Chroma(persist_directory=args.chroma_path)
+    else:
+        db = build_synthetic_chroma(tempfile.mkdtemp(prefix="retrieval_benchmark_"), args.chunks, args.dimensions, rng)
+
+    exact = VectorIndex.from_chroma(db, "float32")
+    queries = sample_queries(exact, args.queries, rng)
+
+    def chroma_search(key, embedding):
+        where = {"$and": [{"game_mode": key[0]}, {"language": key[1]}]}
+        return db.similarity_search_by_vector_with_relevance_scores(embedding, filter=where, k=args.k)
+
+    engines = {
+        "chroma": chroma_search,
+        "numpy-float32": lambda key, embedding: exact.search(embedding, key[0], key[1], k=args.k),
+    }
+    half = VectorIndex.from_chroma(db, "float16")
+    engines["numpy-float16"] = lambda key, embedding: half.search(embedding, key[0], key[1], k=args.k)
+
+    results: List[Dict[str, Any]] = []
+    _, exact_ids = time_engine(engines["numpy-float32"], queries, 0)
+    for name, search in engines.items():
+        latencies, ids = time_engine(search, queries, args.warmup)
+        overlap = np.mean([len(set(a) & set(b)) / max(len(b), 1) for a, b in zip(ids, exact_ids)])
+        results.append({
+            "engine": name,
+            "queries": len(queries),
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "mean_ms": sum(latencies) / len(latencies),
+            "overlap_with_exact": float(overlap),
+        })
+
+    print(f"{len(exact)} chunks in {len(exact.partitions)} partitions, k={args.k}")
+    print(f"{'engine':<16} {'p50 ms':>10} {'p95 ms':>10} {'mean ms':>10} {'overlap':>9}")
+    for result in results:
+        print(f"{result['engine']:<16} {result['p50_ms']:>10.3f} {result['p95_ms']:>10.3f} "
+              f"{result['mean_ms']:>10.3f} {result['overlap_with_exact']:>9.3f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({"config": vars(args), "results": results}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
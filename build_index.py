@@ -0,0 +1,69 @@
+"""
+Builds a versioned, immutable snapshot of the RAG index, served with RAG_INDEX_SOURCE=snapshot.
+
+The documents are synced from the GCS bucket and ingested into the Chroma database in CHROMA_PATH, the build
+workspace, incrementally like on a startup with RAG_INDEX_SOURCE=chroma. The chunks, their vectors and the BM25 index
+are then written as a new version in RAG_INDEX_PATH, see `IndexSnapshot`. When a version with the same chunks and
+embedding model exists, built from the same documents, no new version is written.
+
+Usage:
+    python build_index.py --activate
+    python build_index.py --skip-download --version v7 --output /mnt/artifacts/rag_index
+"""
+import argparse
+import sys
+import time
+
+from langchain_chroma import Chroma
+
+from config import CHROMA_PATH, CHROMA_RESET, RAG_INDEX_PATH, RETRIEVAL_INDEX_DTYPE, setup_logging
+from service.rag.context.chroma import build_lexical_index, init_chroma, read_manifest
+from service.rag.context.embedding import embedding_model_id, get_embedding_function
+from service.rag.context.google_bucket import download_files_from_gcs
+from service.rag.context.index_snapshot import find_version, next_version, write_active_version, write_snapshot
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default=RAG_INDEX_PATH, help="Snapshot folder. Defaults to RAG_INDEX_PATH.")
+    parser.add_argument("--version", help="Name of the new version. Defaults to the next v<number>.")
+    parser.add_argument("--dtype", choices=["float32", "float16"], default=RETRIEVAL_INDEX_DTYPE,
+                        help="Type of the stored vectors. Defaults to RETRIEVAL_INDEX_DTYPE.")
+    parser.add_argument("--skip-download", action="store_true", help="Ingest the local documents without syncing GCS.")
+    parser.add_argument("--reset", action="store_true", default=CHROMA_RESET, help="Rebuild the workspace from scratch.")
+    parser.add_argument("--force", action="store_true", help="Write a new version even when the chunks did not change.")
+    parser.add_argument("--activate", action="store_true", help="Point the ACTIVE file to the built version.")
+    args = parser.parse_args()
+
+    setup_logging()
+    start = time.perf_counter()
+
+    if not args.skip_download:
+        download_files_from_gcs()
+    init_chroma(args.reset)
+
+    db = Chroma(persist_directory=CHROMA_PATH, embedding_function=get_embedding_function())
+    lexical_index = build_lexical_index(db)
+    corpus_version = lexical_index.version
+    model_id = embedding_model_id()
+    documents = {name: entry["sha256"] for name, entry in read_manifest().items()}
+
+    version = None if args.force else find_version(args.output, corpus_version, model_id, documents)
+    if version is not None:
+        print(f"RAG index {version} already contains these chunks, no new version written", file=sys.stderr)
+    else:
+        version = args.version or next_version(args.output)
+        path = write_snapshot(
+            db, lexical_index, args.output, version, corpus_version, model_id, args.dtype,
+            extra={"documents": documents},
+        )
+        print(f"Wrote RAG index {version} of {len(lexical_index)} chunks to {path} "
+              f"in {time.perf_counter() - start:.1f} s", file=sys.stderr)
+
+    if args.activate:
+        write_active_version(args.output, version)
+        print(f"Activated RAG index {version}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
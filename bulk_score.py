@@ -0,0 +1,61 @@
+"""
+Scores a CSV or NDJSON dataset of board games with the prediction models.
+
+The input is read, validated and predicted in chunks, so datasets of any size are scored with constant memory.
+Results are written as NDJSON, rows that fail validation are written to a separate error stream.
+
+Usage:
+    python bulk_score.py research/data/BGG_Data_Set.csv --output scores.ndjson --errors errors.ndjson
+    cat games.ndjson | python bulk_score.py - --format ndjson --targets average_rating > scores.ndjson
+"""
+import argparse
+import json
+import sys
+import time
+
+from config import PREDICTION_BULK_CHUNK_SIZE
+from schema import PredictionTarget
+from service import PredictionModelService
+from service.prediction.bulk_scoring import read_csv_rows, read_ndjson_rows, score_rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="Path to the CSV or NDJSON file, or - for stdin.")
+    parser.add_argument("--format", choices=["csv", "ndjson"], help="Input format. Defaults to the file extension.")
+    parser.add_argument("--delimiter", help="CSV column delimiter. Detected from the header by default.")
+    parser.add_argument("--output", help="Path of the NDJSON results. Defaults to stdout.")
+    parser.add_argument("--errors", help="Path of the NDJSON validation errors. Defaults to stderr.")
+    parser.add_argument("--targets", nargs="+", choices=[target.value for target in PredictionTarget],
+                        help="Values to predict. Defaults to all values.")
+    parser.add_argument("--chunk-size", type=int, default=PREDICTION_BULK_CHUNK_SIZE, help="Rows predicted at once.")
+    args = parser.parse_args()
+
+    input_format = args.format or ("csv" if args.input.lower().endswith(".csv") else "ndjson")
+    targets = [PredictionTarget(target) for target in args.targets] if args.targets else None
+
+    input_file = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8-sig", newline="")
+    output_file = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    errors_file = open(args.errors, "w", encoding="utf-8") if args.errors else sys.stderr
+
+    rows = read_csv_rows(input_file, args.delimiter) if input_format == "csv" else read_ndjson_rows(input_file)
+    prediction_model_service = PredictionModelService()
+
+    start = time.perf_counter()
+    counts = {"result": 0, "error": 0}
+    try:
+        for kind, record in score_rows(rows, prediction_model_service, args.chunk_size, targets):
+            counts[kind] += 1
+            (output_file if kind == "result" else errors_file).write(json.dumps(record) + "\n")
+    finally:
+        for file in (input_file, output_file, errors_file):
+            if file not in (sys.stdin, sys.stdout, sys.stderr):
+                file.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"Scored {counts['result']} rows, {counts['error']} invalid rows, in {elapsed:.1f} s "
+          f"({(counts['result'] + counts['error']) / max(elapsed, 1e-9):.0f} rows/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -17,23 +17,109 @@ UVICORN_HOST = os.getenv("UVICORN_HOST", "0.0.0.0")
 # Path configuration
 CHROMA_PATH = f"{DATA_PATH}{os.sep}chroma"
 DOCS_PATH = f"{DATA_PATH}{os.sep}docs"
-CHROMA_RESET = bool(os.getenv("CRHOMA_RESET", "false"))
+# CRHOMA_RESET is the previous, misspelled name of the variable
+CHROMA_RESET = os.getenv("CHROMA_RESET", os.getenv("CRHOMA_RESET", "false")).lower() == "true"
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", os.cpu_count() or 1))
+# Chunk size in estimated tokens, CHUNK_MAX_TOKENS_PER_CORPUS overrides it per game mode or game mode and language,
+# e.g. "belgium=150,classic_nl=250"
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", 200))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", 20))
+CHUNK_MAX_TOKENS_PER_CORPUS = {
+    corpus.strip(): int(size)
+    for corpus, _, size in (entry.partition("=") for entry in os.getenv("CHUNK_MAX_TOKENS_PER_CORPUS", "").split(","))
+    if corpus.strip() and size.strip()
+}
+INGEST_EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", 64))
+INGEST_EMBED_CONCURRENCY = int(os.getenv("INGEST_EMBED_CONCURRENCY", 4))
+INGEST_EMBED_RATE = float(os.getenv("INGEST_EMBED_RATE", 10))
+INGEST_EMBED_RETRIES = int(os.getenv("INGEST_EMBED_RETRIES", 5))
+INGEST_EMBED_BACKOFF = float(os.getenv("INGEST_EMBED_BACKOFF", 1))
 
 # Google Cloud configuration
 GOOGLE_PROJECT_ID = os.getenv("GOOGLE_PROJECT_ID", "integratieproject-2-442110")
 
 GCS_BUCKET_NAME=os.getenv("GCS_BUCKET_NAME", "team-20-monopoly-ip2-media-bucket")
 GCS_DOCS_PATH = os.getenv("GCS_DOCS_PATH", "monopoly-user-guides")
+GCS_SYNC_WORKERS = int(os.getenv("GCS_SYNC_WORKERS", 8))
 
 # Gemini AI configuration
 GEMINI_EMBED_MODEL = os.getenv("GEMINI_EMBEDDING_MODEL", "models/embedding-001")
 GEMINI_LLM_MODEL = os.getenv("GEMINI_LLM_MODEL", "gemini-1.5-flash-latest")
 GEMINI_KEY_ID = os.getenv("GOOGLE_GEMINI_KEY_ID", "GEMINI_API_KEY")
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", 30))
+
+# Embedding backend: gemini (remote) or local (sentence-transformers on the host)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "gemini").lower()
+LOCAL_EMBED_MODEL = os.getenv("LOCAL_EMBED_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+LOCAL_EMBED_RUNTIME = os.getenv("LOCAL_EMBED_RUNTIME", "torch").lower()
+LOCAL_EMBED_ONNX_FILE = os.getenv("LOCAL_EMBED_ONNX_FILE", "")
+LOCAL_EMBED_BATCH_SIZE = int(os.getenv("LOCAL_EMBED_BATCH_SIZE", 64))
+LOCAL_EMBED_DEVICE = os.getenv("LOCAL_EMBED_DEVICE", "cpu")
+
+# Embedding cache
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 10000))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", f"{DATA_PATH}{os.sep}embedding_cache.db")
+EMBEDDING_CACHE_MAX_QUERY_ROWS = int(os.getenv("EMBEDDING_CACHE_MAX_QUERY_ROWS", 50000))
+EMBEDDING_CACHE_MAX_DOCUMENT_ROWS = int(os.getenv("EMBEDDING_CACHE_MAX_DOCUMENT_ROWS", 50000))
+
+# Semantic answer cache
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", 1000))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", 86400))
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", 0.95))
+CHROMA_CORPUS_CHECK_INTERVAL = float(os.getenv("CHROMA_CORPUS_CHECK_INTERVAL", 60))
+
+# Retrieval engine: chroma, or numpy for an in-memory index of the Chroma embeddings
+RETRIEVAL_ENGINE = os.getenv("RETRIEVAL_ENGINE", "chroma").lower()
+RETRIEVAL_INDEX_DTYPE = os.getenv("RETRIEVAL_INDEX_DTYPE", "float32").lower()
+# Hybrid retrieval: BM25 results fused with the vector results, and keyword-only retrieval for confident matches
+RETRIEVAL_HYBRID = os.getenv("RETRIEVAL_HYBRID", "true").lower() == "true"
+RETRIEVAL_RRF_K = int(os.getenv("RETRIEVAL_RRF_K", 60))
+LEXICAL_FAST_PATH_CONFIDENCE = float(os.getenv("LEXICAL_FAST_PATH_CONFIDENCE", 1))
+
+# Prompt assembly
+PROMPT_MAX_TOKENS = int(os.getenv("PROMPT_MAX_TOKENS", 3000))
+PROMPT_HISTORY_TURNS = int(os.getenv("PROMPT_HISTORY_TURNS", 4))
+PROMPT_MAX_CHUNK_DISTANCE = float(os.getenv("PROMPT_MAX_CHUNK_DISTANCE")) if os.getenv("PROMPT_MAX_CHUNK_DISTANCE") else None
+PROMPT_SUMMARIZE_HISTORY = os.getenv("PROMPT_SUMMARIZE_HISTORY", "true").lower() == "true"
 
 # Mistral AI configuration
 MISTRAL_KEY_ID = os.getenv("MISTRAL_KEY_ID", "MISTRAL_API_KEY")
 MISTRAL_LLM_MODEL = os.getenv("MISTRAL_LLM_MODEL", "open-mistral-7b")
 
+# LLM dispatching
+LLM_MODEL_DEADLINE = float(os.getenv("LLM_MODEL_DEADLINE", 20))
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", 3))
+LLM_EWMA_ALPHA = float(os.getenv("LLM_EWMA_ALPHA", 0.2))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", 3))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", 30))
+
 # Artifacts for Prediction Model
 ARTIFACTS_PATH = os.getenv("ARTIFACTS_PATH", "artifacts")
-PREDICTION_ARTIFACTS_PATH = os.getenv("PREDICTION_ARTIFACTS_PATH", f"{ARTIFACTS_PATH}{os.sep}prediction_model")
\ No newline at end of file
+PREDICTION_ARTIFACTS_PATH = os.getenv("PREDICTION_ARTIFACTS_PATH", f"{ARTIFACTS_PATH}{os.sep}prediction_model")
+PREDICTION_ARTIFACTS_MMAP_MODE = os.getenv("PREDICTION_ARTIFACTS_MMAP_MODE", "r").lower() or None
+PREDICTION_ARTIFACTS_MMAP_MODE = None if PREDICTION_ARTIFACTS_MMAP_MODE == "none" else PREDICTION_ARTIFACTS_MMAP_MODE
+PREDICTION_BATCH_MAX_SIZE = int(os.getenv("PREDICTION_BATCH_MAX_SIZE", 10000))
+PREDICTION_BULK_CHUNK_SIZE = int(os.getenv("PREDICTION_BULK_CHUNK_SIZE", 1000))
+PREDICTION_SWEEP_MAX_VARIANTS = int(os.getenv("PREDICTION_SWEEP_MAX_VARIANTS", 10000))
+PREDICTION_PARALLEL_MIN_ROWS = int(os.getenv("PREDICTION_PARALLEL_MIN_ROWS", 1000))
+PREDICTION_COMPILED_ENCODER = os.getenv("PREDICTION_COMPILED_ENCODER", "true").lower() == "true"
+
+# Prediction cache
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", 10000))
+PREDICTION_CACHE_TTL = float(os.getenv("PREDICTION_CACHE_TTL", 3600))
+PREDICTION_ARTIFACTS_CHECK_INTERVAL = float(os.getenv("PREDICTION_ARTIFACTS_CHECK_INTERVAL", 30))
+# Token required to activate a prediction model version over the API, empty disables the endpoint
+PREDICTION_ADMIN_TOKEN = os.getenv("PREDICTION_ADMIN_TOKEN", "")
+
+# Prebuilt RAG index snapshots, see build_index.py: chroma ingests the documents on startup, snapshot serves a snapshot
+RAG_INDEX_SOURCE = os.getenv("RAG_INDEX_SOURCE", "chroma").lower()
+RAG_INDEX_PATH = os.getenv("RAG_INDEX_PATH", f"{ARTIFACTS_PATH}{os.sep}rag_index")
+RAG_INDEX_VERSION = os.getenv("RAG_INDEX_VERSION", "")
+RAG_INDEX_MMAP_MODE = os.getenv("RAG_INDEX_MMAP_MODE", "r").lower() or None
+RAG_INDEX_MMAP_MODE = None if RAG_INDEX_MMAP_MODE == "none" else RAG_INDEX_MMAP_MODE
+
+# Executors for blocking work
+RAG_THREAD_POOL_SIZE = int(os.getenv("RAG_THREAD_POOL_SIZE", 32))
+PREDICTION_EXECUTOR = os.getenv("PREDICTION_EXECUTOR", "thread").lower()
+PREDICTION_POOL_SIZE = int(os.getenv("PREDICTION_POOL_SIZE", os.cpu_count() or 1))
+PREDICTION_PROCESS_START_METHOD = os.getenv("PREDICTION_PROCESS_START_METHOD", "spawn")
\ No newline at end of file
@@ -1,8 +1,8 @@
 import uvicorn
 from fastapi import FastAPI
-from api import chatbot, prediction
 from config import UVICORN_PORT, UVICORN_HOST, setup_logging, LOGGING_CONFIG
 from db import init_db
+from service.executors import shutdown_executors
 
 
 def setup_app() -> None:
@@ -12,12 +12,18 @@ def setup_app() -> None:
 
 
 if __name__ == "__main__":
+    # The routers build the services when they are imported, which syncs and ingests the documents and loads the
+    # models. Spawned worker processes (ingestion, prediction) run this file again as __mp_main__, so the routers are
+    # only imported here, never at the top level.
+    from api import chatbot, prediction
+
     setup_app()
     init_db()
 
     app = FastAPI()
     app.include_router(chatbot.router)
     app.include_router(prediction.router)
+    app.add_event_handler("shutdown", shutdown_executors)
 
 
     uvicorn.run(
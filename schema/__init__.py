@@ -1,3 +1,5 @@
 from .models import ChatHistory
 from .llm_dto import LLMResponseDTO, LLMQueryDTO, SupportedGameMode, SupportedLanguage
-from .prediction_dto import BoardGameDTO, PredictionDTO, Mechanic, Domain
+from .prediction_dto import (BoardGameDTO, PredictionDTO, PredictionTarget, Mechanic, Domain, SweepField, RangeAxisDTO,
+                             AddMechanicAxisDTO, ToggleDomainAxisDTO, SweepAxisDTO, SweepRequestDTO, SweepVariantDTO,
+                             SweepResultDTO)
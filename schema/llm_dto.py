@@ -22,3 +22,5 @@ class LLMResponseDTO(BaseModel):
     session_id: UUID
     successful: bool
     llm_response: str
+    # Whether the answer was reused from a previously answered, similar question
+    cached: bool = False
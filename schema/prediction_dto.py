@@ -1,12 +1,23 @@
 from enum import Enum
+from typing import Optional, List, Dict, Any, Literal, Union, Annotated
 
-from pydantic import BaseModel, Field, model_validator, validator, field_validator
+from pydantic import BaseModel, ConfigDict, Field, model_validator, validator, field_validator
+
+
+class PredictionTarget(str, Enum):
+    average_complexity = "average_complexity"
+    average_rating = "average_rating"
+    popularity_score = "popularity_score"
 
 
 class PredictionDTO(BaseModel):
-    average_complexity: float = Field(..., ge=0, le=5)
-    average_rating: float = Field(..., ge=0, le=10)
-    popularity_score: float = Field(..., ge=0, le=10)
+    # `model_version` is a field, not a pydantic attribute
+    model_config = ConfigDict(protected_namespaces=())
+
+    average_complexity: Optional[float] = Field(None, ge=0, le=5)
+    average_rating: Optional[float] = Field(None, ge=0, le=10)
+    popularity_score: Optional[float] = Field(None, ge=0, le=10)
+    model_version: Optional[str] = None
 
 
 class Domain(str, Enum):
@@ -220,4 +231,102 @@ class BoardGameDTO(BaseModel):
         min_players = info.data.get("min_players")  # Access `min_players` from the model's context
         if min_players is not None and max_players < min_players:
             raise ValueError("max_players must be greater than or equal to min_players")
-        return max_players
\ No newline at end of file
+        return max_players
+
+
+def board_game_field_bounds(field: str) -> tuple:
+    """
+    Returns the inclusive (lower, upper) bounds of a numeric BoardGameDTO field, None when unbounded.
+    """
+    lower, upper = None, None
+    for constraint in BoardGameDTO.model_fields[field].metadata:
+        if getattr(constraint, "ge", None) is not None:
+            lower = constraint.ge
+        if getattr(constraint, "gt", None) is not None:
+            lower = constraint.gt + 1
+        if getattr(constraint, "le", None) is not None:
+            upper = constraint.le
+        if getattr(constraint, "lt", None) is not None:
+            upper = constraint.lt - 1
+    return lower, upper
+
+
+class SweepField(str, Enum):
+    year_published = "year_published"
+    min_players = "min_players"
+    max_players = "max_players"
+    play_time = "play_time"
+    min_age = "min_age"
+
+
+class RangeAxisDTO(BaseModel):
+    """Varies a numeric field from `start` to `stop` (inclusive) in steps of `step`."""
+    kind: Literal["range"]
+    field: SweepField
+    start: int
+    stop: int
+    step: int = Field(1, gt=0)
+
+    @model_validator(mode="after")
+    def validate_range(self):
+        if self.stop < self.start:
+            raise ValueError("stop must be greater than or equal to start")
+
+        # Clamp to the bounds of the field, keeping the values on the grid of `start` and `step`
+        lower, upper = board_game_field_bounds(self.field.value)
+        if lower is not None and self.start < lower:
+            self.start += -(-(lower - self.start) // self.step) * self.step
+        if upper is not None and self.stop > upper:
+            self.stop = upper
+        if self.stop < self.start:
+            raise ValueError(f"range of {self.field.value} lies outside its bounds [{lower}, {upper}]")
+        return self
+
+    @property
+    def key(self) -> str:
+        return self.field.value
+
+
+class AddMechanicAxisDTO(BaseModel):
+    """Adds one mechanic per variant. Defaults to every mechanic the board game does not have yet."""
+    kind: Literal["add_mechanic"]
+    mechanics: Optional[List[Mechanic]] = None
+
+    @property
+    def key(self) -> str:
+        return self.kind
+
+
+class ToggleDomainAxisDTO(BaseModel):
+    """Adds or removes one domain per variant. Defaults to every domain."""
+    kind: Literal["toggle_domain"]
+    domains: Optional[List[Domain]] = None
+
+    @property
+    def key(self) -> str:
+        return self.kind
+
+
+SweepAxisDTO = Annotated[Union[RangeAxisDTO, AddMechanicAxisDTO, ToggleDomainAxisDTO], Field(discriminator="kind")]
+
+
+class SweepRequestDTO(BaseModel):
+    board_game: BoardGameDTO
+    axes: List[SweepAxisDTO] = Field(..., min_length=1)
+
+    @field_validator("axes")
+    def validate_unique_axes(cls, axes):
+        keys = [axis.key for axis in axes]
+        if len(set(keys)) != len(keys):
+            raise ValueError("every field, add_mechanic and toggle_domain can only be swept by one axis")
+        return axes
+
+
+class SweepVariantDTO(BaseModel):
+    changes: Dict[str, Any]
+    prediction: PredictionDTO
+
+
+class SweepResultDTO(BaseModel):
+    base: PredictionDTO
+    variants: List[SweepVariantDTO]
@@ -0,0 +1,115 @@
+import asyncio
+import functools
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional, TypeVar
+
+from config import RAG_THREAD_POOL_SIZE, PREDICTION_EXECUTOR, PREDICTION_POOL_SIZE, PREDICTION_PROCESS_START_METHOD
+
+logger = logging.getLogger("app")
+
+T = TypeVar("T")
+
+_lock = threading.Lock()
+_rag_executor: Optional[ThreadPoolExecutor] = None
+_prediction_executor: Optional[Executor] = None
+
+
+def get_rag_executor() -> ThreadPoolExecutor:
+    """
+    Returns the thread pool used for I/O-bound RAG work (Chroma search, SQLite, LLM HTTP calls).
+    """
+    global _rag_executor
+    with _lock:
+        if _rag_executor is None:
+            _rag_executor = ThreadPoolExecutor(max_workers=RAG_THREAD_POOL_SIZE, thread_name_prefix="rag")
+            logger.info(f"Started RAG thread pool with {RAG_THREAD_POOL_SIZE} workers.")
+        return _rag_executor
+
+
+def get_prediction_executor(initializer: Optional[Callable[[], None]] = None) -> Executor:
+    """
+    Returns the executor used for CPU-bound prediction work. Depending on PREDICTION_EXECUTOR this is a thread pool,
+    or a process pool so inference does not compete with the event loop for the GIL. Every worker process imports the
+    service package and loads the models, so it costs its own copy of the models and a slower start. Spawned workers
+    also run the top level of the entry script again, so the entry script must only build the application under
+    `if __name__ == "__main__"`, like `main.py`.
+    Worker processes are started with PREDICTION_PROCESS_START_METHOD, `spawn` by default because forking a process
+    that already runs gRPC threads (Google Cloud clients) can deadlock the child.
+
+    Args:
+        initializer (Callable): Called once in every worker process, e.g. to load the models.
+            Only used when the process pool is created.
+    """
+    global _prediction_executor
+    with _lock:
+        if _prediction_executor is None:
+            if PREDICTION_EXECUTOR == "process":
+                _prediction_executor = ProcessPoolExecutor(
+                    max_workers=PREDICTION_POOL_SIZE,
+                    mp_context=multiprocessing.get_context(PREDICTION_PROCESS_START_METHOD),
+                    initializer=initializer,
+                )
+            else:
+                _prediction_executor = ThreadPoolExecutor(max_workers=PREDICTION_POOL_SIZE, thread_name_prefix="prediction")
+            logger.info(f"Started prediction {PREDICTION_EXECUTOR} pool with {PREDICTION_POOL_SIZE} workers.")
+        return _prediction_executor
+
+
+def uses_prediction_process_pool() -> bool:
+    return PREDICTION_EXECUTOR == "process"
+
+
+async def run_in_rag_executor(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Runs a blocking RAG call in the RAG thread pool without blocking the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_rag_executor(), functools.partial(func, *args, **kwargs))
+
+
+async def run_in_prediction_executor(func: Callable[..., T], *args: Any,
+                                     initializer: Optional[Callable[[], None]] = None) -> T:
+    """
+    Runs a CPU-bound prediction call in the prediction pool without blocking the event loop.
+    When the process pool is used, `func` and its arguments must be picklable. When a worker process died, the call
+    fails and the broken pool is replaced by a new one on the next call.
+    """
+    loop = asyncio.get_running_loop()
+    executor = get_prediction_executor(initializer)
+    try:
+        return await loop.run_in_executor(executor, functools.partial(func, *args))
+    except BrokenProcessPool:
+        _discard_prediction_executor(executor)
+        raise
+
+
+def _discard_prediction_executor(executor: Executor) -> None:
+    """
+    Drops a broken prediction pool, unless another call already replaced it.
+    """
+    global _prediction_executor
+    with _lock:
+        if _prediction_executor is not executor:
+            return
+        _prediction_executor = None
+    logger.error("A prediction worker process died, the prediction process pool will be restarted.")
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_executors() -> None:
+    """
+    Shuts down both pools, waiting for running tasks to finish.
+    """
+    global _rag_executor, _prediction_executor
+    with _lock:
+        if _rag_executor is not None:
+            _rag_executor.shutdown(wait=True)
+            _rag_executor = None
+        if _prediction_executor is not None:
+            _prediction_executor.shutdown(wait=True)
+            _prediction_executor = None
+    logger.info("Executors shut down.")
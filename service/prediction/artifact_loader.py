@@ -0,0 +1,101 @@
+import importlib
+import logging
+import os
+import resource
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, List, Optional
+
+import joblib
+
+logger = logging.getLogger("app")
+
+
+@dataclass(frozen=True)
+class ArtifactLoadReport:
+    path: str
+    size_bytes: int
+    load_seconds: float
+    rss_delta_bytes: int
+    mmap_mode: Optional[str]
+
+
+# Reports of every artifact loaded by this process, in load order
+ARTIFACT_LOAD_REPORTS: List[ArtifactLoadReport] = []
+
+# Packages the classes of the artifacts are unpickled from, imported before the first artifact is measured
+UNPICKLING_DEPENDENCIES = ("scipy.sparse", "sklearn.base", "sklearn.preprocessing", "sklearn.svm", "sklearn.ensemble",
+                           "sklearn.linear_model")
+
+_dependencies_imported = False
+_dependencies_lock = threading.Lock()
+
+
+def get_resident_memory() -> int:
+    """
+    Returns the resident set size of the current process in bytes.
+    """
+    try:
+        with open("/proc/self/statm", "r") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # No procfs (e.g. macOS): fall back to the peak RSS, reported in bytes on macOS and in KB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def import_unpickling_dependencies() -> None:
+    """
+    Imports UNPICKLING_DEPENDENCIES once per process and logs their cost on its own line, otherwise the first artifact
+    loaded would be charged the import of scikit-learn and SciPy.
+    """
+    global _dependencies_imported
+    with _dependencies_lock:
+        if _dependencies_imported:
+            return
+        rss_before = get_resident_memory()
+        start = time.perf_counter()
+        for module in UNPICKLING_DEPENDENCIES:
+            importlib.import_module(module)
+        _dependencies_imported = True
+    logger.info(
+        f"Imported the unpickling dependencies of the artifacts in {(time.perf_counter() - start) * 1000:.1f} ms, "
+        f"resident memory +{(get_resident_memory() - rss_before) / 1024:.1f} KiB"
+    )
+
+
+def load_artifact(path: str, mmap_mode: Optional[str] = None) -> Any:
+    """
+    Loads a joblib artifact and logs its load time and the resident memory it added to the process.
+
+    With `mmap_mode` ('r' or 'c') the NumPy arrays inside the artifact are memory-mapped instead of read into the
+    process. Read-only mappings are backed by the page cache, so every worker loading the same file shares a single
+    copy of the arrays and only the pages that are touched are read from disk.
+
+    Args:
+        path (str): Path to the joblib file. Memory mapping requires an uncompressed dump.
+        mmap_mode (str): None, 'r' or 'c', see `joblib.load`.
+
+    Returns:
+        Any: The loaded object.
+    """
+    import_unpickling_dependencies()
+
+    rss_before = get_resident_memory()
+    start = time.perf_counter()
+
+    artifact = joblib.load(path, mmap_mode=mmap_mode)
+
+    report = ArtifactLoadReport(
+        path=path,
+        size_bytes=os.path.getsize(path),
+        load_seconds=time.perf_counter() - start,
+        rss_delta_bytes=get_resident_memory() - rss_before,
+        mmap_mode=mmap_mode,
+    )
+    ARTIFACT_LOAD_REPORTS.append(report)
+    logger.info(
+        f"Loaded artifact {os.path.basename(path)} ({report.size_bytes / 1024:.1f} KiB, mmap_mode={mmap_mode}) "
+        f"in {report.load_seconds * 1000:.1f} ms, resident memory +{report.rss_delta_bytes / 1024:.1f} KiB"
+    )
+    return artifact
@@ -1,33 +1,103 @@
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Dict, Any
 
-import joblib
 import pandas as pd
 
-from schema import PredictionDTO
+from schema import PredictionDTO, PredictionTarget
+from service.prediction.artifact_loader import load_artifact
+
+
+ALL_TARGETS = list(PredictionTarget)
+
+
+def normalize_targets(targets: Optional[List[PredictionTarget]]) -> tuple[PredictionTarget, ...]:
+    """
+    Deduplicates the requested targets and puts them in a fixed order. No targets means all targets.
+    """
+    if not targets:
+        return tuple(ALL_TARGETS)
+    return tuple(target for target in ALL_TARGETS if target in targets)
 
 
 class BoardGamePredictor:
 
-    def __init__(self, artifacts_path: str):
+    def __init__(self, artifacts_path: str, parallel_min_rows: int = 1000, mmap_mode: Optional[str] = None):
         # Prediction Models
-        self.rating_average_mdl = joblib.load(f'{artifacts_path}{os.sep}Rating_Average_Model.pkl')
-        self.complexity_average_mdl = joblib.load(f'{artifacts_path}{os.sep}Complexity_Average_Model.pkl')
-        self.popularity_score_mdl = joblib.load(f'{artifacts_path}{os.sep}Popularity_Score_Model.pkl')
+        self.rating_average_mdl = load_artifact(f'{artifacts_path}{os.sep}Rating_Average_Model.pkl', mmap_mode)
+        self.complexity_average_mdl = load_artifact(f'{artifacts_path}{os.sep}Complexity_Average_Model.pkl', mmap_mode)
+        self.popularity_score_mdl = load_artifact(f'{artifacts_path}{os.sep}Popularity_Score_Model.pkl', mmap_mode)
+
+        self.models: Dict[PredictionTarget, Any] = {
+            PredictionTarget.average_complexity: self.complexity_average_mdl,
+            PredictionTarget.average_rating: self.rating_average_mdl,
+            PredictionTarget.popularity_score: self.popularity_score_mdl,
+        }
+
+        # Batches of at least this many rows run the requested models concurrently on this pool, shut down by `close`
+        self.parallel_min_rows = parallel_min_rows
+        self._pool: Optional[ThreadPoolExecutor] = ThreadPoolExecutor(max_workers=len(self.models),
+                                                                      thread_name_prefix="predictor")
+        self._pool_lock = threading.Lock()
 
 
-    def predict(self, features_df: pd.DataFrame) -> PredictionDTO:
+    def predict(self, features_df: pd.DataFrame, targets: Optional[List[PredictionTarget]] = None) -> PredictionDTO:
         """
         Predicts the average complexity, average rating, and popularity score of a board game using the provided features.
 
         Args:
             features_df (pd.DataFrame): A DataFrame containing the features of the board game for prediction.
-        
+            targets (List[PredictionTarget]): The values to predict. Only the models of these targets are run,
+                the other values are left empty. Defaults to all targets.
+
         Returns:
             PredictionDTO: An object that contains the predicted values for the board game's average complexity, average rating,
             and popularity score.
         """
-        return PredictionDTO(
-            average_complexity=self.complexity_average_mdl.predict(features_df),
-            average_rating=self.rating_average_mdl.predict(features_df),
-            popularity_score=self.popularity_score_mdl.predict(features_df),
-        )
\ No newline at end of file
+        return self.predict_many(features_df, targets)[0]
+
+
+    def predict_many(self, features_df: pd.DataFrame, targets: Optional[List[PredictionTarget]] = None,
+                     model_version: Optional[str] = None) -> List[PredictionDTO]:
+        """
+        Predicts the requested targets for every row of the provided features. Each model is called once for the whole
+        batch. When several targets are requested for a batch of at least `parallel_min_rows` rows, the models run
+        concurrently (the sklearn models release the GIL while predicting).
+
+        Args:
+            features_df (pd.DataFrame): A DataFrame containing one row of features per board game.
+            targets (List[PredictionTarget]): The values to predict. Defaults to all targets.
+            model_version (str): The model version reported with every prediction.
+
+        Returns:
+            List[PredictionDTO]: The predictions, in the same order as the rows of `features_df`.
+        """
+        targets = normalize_targets(targets)
+
+        futures = {}
+        if len(targets) > 1 and len(features_df) >= self.parallel_min_rows:
+            with self._pool_lock:
+                # A closed predictor still finishes the requests that started on it, sequentially
+                if self._pool is not None:
+                    futures = {target: self._pool.submit(self.models[target].predict, features_df) for target in targets}
+        if futures:
+            values = {target: future.result() for target, future in futures.items()}
+        else:
+            values = {target: self.models[target].predict(features_df) for target in targets}
+
+        return [
+            PredictionDTO(model_version=model_version, **{target.value: float(values[target][row]) for target in targets})
+            for row in range(len(features_df))
+        ]
+
+
+    def close(self) -> None:
+        """
+        Shuts down the thread pool of the predictor once its running predictions are done, e.g. when its model version
+        is no longer served.
+        """
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False)
@@ -0,0 +1,167 @@
+import csv
+import json
+import logging
+from itertools import islice
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from pydantic import ValidationError
+
+from schema import BoardGameDTO, PredictionDTO, PredictionTarget
+
+logger = logging.getLogger("app")
+
+
+# Columns copied from the input to every result, so results can be joined back to the input
+PASSTHROUGH_FIELDS = ("id", "name")
+LIST_FIELDS = ("mechanics", "domains")
+INT_FIELDS = ("year_published", "min_players", "max_players", "play_time", "min_age")
+
+# A row is its 1-based row number in the input and its raw fields
+Row = Tuple[int, Dict[str, Any]]
+
+
+def normalize_field_name(name: str) -> str:
+    """
+    Maps a column header to a `BoardGameDTO` field name, e.g. `Year Published` to `year_published`.
+    """
+    return name.strip().lstrip("\ufeff").lower().replace(" ", "_")
+
+
+def read_csv_rows(file: TextIO, delimiter: Optional[str] = None) -> Iterator[Row]:
+    """
+    Lazily reads the rows of a CSV file, such as the BGG dataset.
+    Mechanics and domains are comma-separated lists inside a single column. Integer columns are parsed
+    when they hold an integer and left as text otherwise, so validation reports them.
+
+    Args:
+        file (TextIO): The CSV file.
+        delimiter (str): The column delimiter. Detected from the header when not given.
+
+    Yields:
+        Row: The row number and the fields of every row.
+    """
+    if delimiter is None:
+        header = file.readline()
+        delimiter = csv.Sniffer().sniff(header, delimiters=",;\t|").delimiter
+        file = _prepend(header, file)
+
+    reader = csv.reader(file, delimiter=delimiter)
+    fields = [normalize_field_name(name) for name in next(reader, [])]
+
+    for row_number, values in enumerate(reader, start=1):
+        row = dict(zip(fields, values))
+        for field in LIST_FIELDS:
+            if isinstance(row.get(field), str):
+                row[field] = [value.strip() for value in row[field].split(",") if value.strip()]
+        for field in INT_FIELDS:
+            if isinstance(row.get(field), str) and row[field].strip().lstrip("-").isdigit():
+                row[field] = int(row[field])
+        yield row_number, row
+
+
+def read_ndjson_rows(lines: Iterable[str]) -> Iterator[Row]:
+    """
+    Lazily reads newline-delimited JSON objects, one board game per line. Blank lines are skipped.
+    A line that is not a JSON object is yielded as a row without fields, so it is reported as invalid.
+
+    Yields:
+        Row: The line number and the fields of every line.
+    """
+    for row_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            row = {"_error": f"Invalid JSON: {e}"}
+        yield row_number, row if isinstance(row, dict) else {"_error": "Expected a JSON object"}
+
+
+def chunked(rows: Iterable[Row], size: int) -> Iterator[List[Row]]:
+    iterator = iter(rows)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def validate_chunk(chunk: List[Row]) -> Tuple[List[Tuple[Row, BoardGameDTO]], List[Dict[str, Any]]]:
+    """
+    Validates the rows of a chunk into board games.
+
+    Returns:
+        Tuple: The valid rows with their board game, and an error record for every invalid row.
+    """
+    valid, errors = [], []
+    for row_number, row in chunk:
+        if "_error" in row:
+            errors.append(_record(row_number, row, errors=[row["_error"]]))
+            continue
+        try:
+            valid.append(((row_number, row), BoardGameDTO.model_validate(row)))
+        except ValidationError as e:
+            errors.append(_record(row_number, row, errors=[
+                f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors()
+            ]))
+        except TypeError as e:
+            # Raised by field validators that compare values of the wrong type
+            errors.append(_record(row_number, row, errors=[str(e)]))
+    return valid, errors
+
+
+def result_records(valid: List[Tuple[Row, BoardGameDTO]], predictions: List[PredictionDTO]) -> List[Dict[str, Any]]:
+    return [
+        _record(row_number, row, **prediction.model_dump(exclude_none=True))
+        for ((row_number, row), _), prediction in zip(valid, predictions)
+    ]
+
+
+def score_rows(rows: Iterable[Row], prediction_model_service, chunk_size: int,
+               targets: Optional[List[PredictionTarget]] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Scores rows chunk by chunk. Every chunk is validated, encoded and predicted as one batch, so memory use
+    depends on the chunk size and not on the size of the input.
+
+    Args:
+        rows (Iterable[Row]): The rows to score, e.g. from `read_csv_rows` or `read_ndjson_rows`.
+        prediction_model_service (PredictionModelService): The service that predicts the board games.
+        chunk_size (int): The amount of rows predicted at once.
+        targets (List[PredictionTarget]): The values to predict. Defaults to all values.
+
+    Yields:
+        Tuple[str, Dict[str, Any]]: `("result", record)` for every scored row and `("error", record)`
+        for every row that failed validation, per chunk in input order.
+    """
+    for chunk in chunked(rows, chunk_size):
+        valid, errors = validate_chunk(chunk)
+        for error in errors:
+            yield "error", error
+        if valid:
+            predictions = prediction_model_service.predict_board_games([dto for _, dto in valid], targets)
+            for record in result_records(valid, predictions):
+                yield "result", record
+
+
+async def ascore_rows(rows: Iterable[Row], prediction_model_service, chunk_size: int,
+                      targets: Optional[List[PredictionTarget]] = None) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Same as `score_rows`, but the chunks are predicted in the prediction executor so the event loop stays free.
+    """
+    for chunk in chunked(rows, chunk_size):
+        valid, errors = validate_chunk(chunk)
+        for error in errors:
+            yield "error", error
+        if valid:
+            predictions = await prediction_model_service.predict_board_games_async([dto for _, dto in valid], targets)
+            for record in result_records(valid, predictions):
+                yield "result", record
+
+
+def _record(row_number: int, row: Dict[str, Any], **values: Any) -> Dict[str, Any]:
+    record = {"row": row_number}
+    record.update({field: row[field] for field in PASSTHROUGH_FIELDS if field in row})
+    record.update(values)
+    return record
+
+
+def _prepend(line: str, file: TextIO) -> Iterator[str]:
+    yield line
+    yield from file
@@ -0,0 +1,152 @@
+from typing import Dict, List, Any
+
+import numpy as np
+import pandas as pd
+
+from schema import BoardGameDTO
+
+
+YEAR_PUBLISHED_BINS_COLUMN = "Year Published Bins"
+MIN_PLAYERS_COLUMN = "Min Players"
+MAX_PLAYERS_COLUMN = "Max Players"
+PLAY_TIME_BINS_COLUMN = "Play Time Bins"
+MIN_AGE_COLUMN = "Min Age"
+AMOUNT_OF_MECHANICS_COLUMN = "Amount_of_Mechanics"
+
+BASE_COLUMNS = [
+    YEAR_PUBLISHED_BINS_COLUMN,
+    MIN_PLAYERS_COLUMN,
+    MAX_PLAYERS_COLUMN,
+    PLAY_TIME_BINS_COLUMN,
+    MIN_AGE_COLUMN,
+    AMOUNT_OF_MECHANICS_COLUMN,
+]
+
+
+class CompiledFeatureEncoder:
+    """
+    A NumPy implementation of the FeatureTransfomer pipeline, compiled once from the loaded artifacts:
+    - The bin edges are kept as arrays and applied with `np.searchsorted`.
+    - The fitted scaler is reduced to mean and scale arrays.
+    - The MultiLabelBinarizers and the mechanic cluster mapping are reduced to column-index maps.
+
+    Encoded features are written straight into a preallocated float matrix using the column order the models were
+    trained on.
+    """
+
+    def __init__(self, decade_bins: List[int], play_time_bins: List[int], mechanic_cluster_mapping: Dict[str, int],
+                 domains_mlb: Any, clusters_mlb: Any, scaler: Any):
+        # Column layout
+        self.columns = (
+            BASE_COLUMNS
+            + [f"Domains_{class_name}" for class_name in domains_mlb.classes_]
+            + [f"Clusters_{class_name}" for class_name in clusters_mlb.classes_]
+        )
+        self.column_index = {column: i for i, column in enumerate(self.columns)}
+
+        # Bins
+        self.decade_edges = np.asarray(decade_bins, dtype=np.float64)
+        self.play_time_edges = np.asarray(play_time_bins, dtype=np.float64)
+
+        # Scaler, in the column order the scaler was fitted on
+        scaled_columns = list(getattr(scaler, "feature_names_in_", [
+            MIN_PLAYERS_COLUMN, MAX_PLAYERS_COLUMN, MIN_AGE_COLUMN, AMOUNT_OF_MECHANICS_COLUMN
+        ]))
+        self.scaled_column_indices = np.asarray([self.column_index[column] for column in scaled_columns])
+        n_scaled = len(scaled_columns)
+        self.scaler_mean = (
+            np.asarray(scaler.mean_, dtype=np.float64) if getattr(scaler, "with_mean", True) and scaler.mean_ is not None
+            else np.zeros(n_scaled)
+        )
+        self.scaler_scale = (
+            np.asarray(scaler.scale_, dtype=np.float64) if getattr(scaler, "with_std", True) and scaler.scale_ is not None
+            else np.ones(n_scaled)
+        )
+
+        # Domains and mechanic clusters
+        self.domain_columns: Dict[str, int] = {
+            str(class_name): self.column_index[f"Domains_{class_name}"] for class_name in domains_mlb.classes_
+        }
+        cluster_columns = {
+            class_name.item() if hasattr(class_name, "item") else class_name: self.column_index[f"Clusters_{class_name}"]
+            for class_name in clusters_mlb.classes_
+        }
+        self.mechanic_columns: Dict[str, int] = {
+            mechanic: cluster_columns[cluster]
+            for mechanic, cluster in mechanic_cluster_mapping.items()
+            if cluster in cluster_columns
+        }
+
+
+    @staticmethod
+    def bin_codes(values: np.ndarray, edges: np.ndarray) -> np.ndarray:
+        """
+        Returns the bin code of every value, matching `pd.cut(values, bins=edges).codes`: bins are right-inclusive and
+        values outside of the edges get code -1.
+        """
+        codes = np.searchsorted(edges, values, side="left") - 1
+        codes[(values <= edges[0]) | (values > edges[-1])] = -1
+        return codes
+
+
+    def scale(self, raw: np.ndarray, column: str) -> np.ndarray:
+        """
+        Scales raw values of a single scaled column with the fitted scaler parameters.
+        """
+        position = int(np.flatnonzero(self.scaled_column_indices == self.column_index[column])[0])
+        return (raw - self.scaler_mean[position]) / self.scaler_scale[position]
+
+
+    def encode_many(self, dtos: List[BoardGameDTO]) -> np.ndarray:
+        """
+        Encodes a list of board games into a float feature matrix with one row per board game.
+
+        Args:
+            dtos (List[BoardGameDTO]): The board games to encode.
+
+        Returns:
+            np.ndarray: A matrix of shape (len(dtos), len(self.columns)).
+        """
+        features = np.zeros((len(dtos), len(self.columns)), dtype=np.float64)
+        if len(dtos) == 0:
+            return features
+
+        raw = np.array(
+            [(dto.year_published, dto.min_players, dto.max_players, dto.play_time, dto.min_age, len(dto.mechanics))
+             for dto in dtos],
+            dtype=np.float64,
+        )
+        features[:, :len(BASE_COLUMNS)] = raw
+
+        # Binning
+        features[:, 0] = self.bin_codes(raw[:, 0], self.decade_edges)
+        features[:, 3] = self.bin_codes(raw[:, 3], self.play_time_edges)
+
+        # Scaling
+        features[:, self.scaled_column_indices] -= self.scaler_mean
+        features[:, self.scaled_column_indices] /= self.scaler_scale
+
+        # Domains and clusters
+        rows, cols = [], []
+        for row, dto in enumerate(dtos):
+            for domain in dto.domains:
+                col = self.domain_columns.get(domain)
+                if col is not None:
+                    rows.append(row)
+                    cols.append(col)
+            for mechanic in dto.mechanics:
+                col = self.mechanic_columns.get(mechanic)
+                if col is not None:
+                    rows.append(row)
+                    cols.append(col)
+        features[rows, cols] = 1.0
+
+        return features
+
+
+    def to_frame(self, features: np.ndarray) -> pd.DataFrame:
+        """
+        Wraps an encoded feature matrix in a DataFrame with the feature names the models were fitted with, without
+        copying the data.
+        """
+        return pd.DataFrame(features, columns=self.columns, copy=False)
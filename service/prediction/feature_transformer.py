@@ -1,12 +1,17 @@
 import json
+import logging
 import os
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 
-import joblib
+import numpy as np
 import pandas as pd
 
-from schema import BoardGameDTO, Mechanic
+from schema import BoardGameDTO, Mechanic, Domain
+from service.prediction.artifact_loader import load_artifact
+from service.prediction.feature_encoder import CompiledFeatureEncoder
+
+logger = logging.getLogger("app")
 
 
 class FeatureTransfomer:
@@ -16,9 +21,13 @@ class FeatureTransfomer:
     - Mapping mechanics to relevant clusters.
     - MultiLabelBinarizer transformations for domains and clusters.
     - Feature scaling using a pre-trained scaler.
+    
+    Unless disabled, the transformations run on a CompiledFeatureEncoder built from the same artifacts. The encoder is
+    checked at startup against the original per-row pandas transformation and is only used when both produce identical
+    features.
     """
 
-    def __init__(self, artifacts_path: str):
+    def __init__(self, artifacts_path: str, use_compiled_encoder: bool = True, mmap_mode: Optional[str] = None):
         try:
             transfs = self._load_json(artifacts_path, "data_transformation.json")
             # Bins
@@ -32,15 +41,85 @@ class FeatureTransfomer:
             self.mechanic_cluster_mapping = transfs.get("mechanic_cluster_mapping")
         
             # MultiLabelBinarizers
-            self.domains_mlb = joblib.load(f'{artifacts_path}{os.sep}Domains_MLB.pkl')
-            self.clusters_mlb = joblib.load(f'{artifacts_path}{os.sep}Clusters_MLB.pkl')
+            self.domains_mlb = load_artifact(f'{artifacts_path}{os.sep}Domains_MLB.pkl', mmap_mode)
+            self.clusters_mlb = load_artifact(f'{artifacts_path}{os.sep}Clusters_MLB.pkl', mmap_mode)
         
             # Normalisation Scaler
-            self.scaler = joblib.load(f'{artifacts_path}{os.sep}Scaler.pkl')
+            self.scaler = load_artifact(f'{artifacts_path}{os.sep}Scaler.pkl', mmap_mode)
             
         except FileNotFoundError as e:
             raise FileNotFoundError(f"One or more transformation or model files could not be found at the path: {artifacts_path}. Error: {str(e)}")
 
+        self.encoder = self._compile_encoder() if use_compiled_encoder else None
+
+
+    def _compile_encoder(self) -> Optional[CompiledFeatureEncoder]:
+        """
+        Builds the CompiledFeatureEncoder and verifies it against the original per-row pandas transformation, which
+        the batched pandas implementation is verified against as well.
+        Returns None, so the pandas implementation stays in use, when the outputs differ.
+        """
+        try:
+            encoder = CompiledFeatureEncoder(
+                decade_bins=self.decade_bins,
+                play_time_bins=self.play_time_bins,
+                mechanic_cluster_mapping=self.mechanic_cluster_mapping,
+                domains_mlb=self.domains_mlb,
+                clusters_mlb=self.clusters_mlb,
+                scaler=self.scaler,
+            )
+            probes = self._parity_probes()
+            expected = pd.concat([self._transform_row_pandas(probe) for probe in probes], ignore_index=True)
+            actual = encoder.encode_many(probes)
+
+            batched = self._transform_many_pandas(probes)
+            if list(batched.columns) != list(expected.columns) or not np.array_equal(
+                    batched.to_numpy(dtype=np.float64), expected.to_numpy(dtype=np.float64)):
+                logger.error("Batched pandas transformation differs from the per-row transformation.")
+
+            if list(expected.columns) != encoder.columns:
+                logger.error(f"Compiled feature encoder column mismatch: {encoder.columns} != {list(expected.columns)}")
+                return None
+            if not np.array_equal(expected.to_numpy(dtype=np.float64), actual):
+                logger.error("Compiled feature encoder output differs from the pandas transformation, using pandas.")
+                return None
+    
+            logger.info(f"Compiled feature encoder verified against {len(probes)} parity probes.")
+            return encoder
+        except Exception as e:
+            logger.error(f"Failed to compile feature encoder, using pandas: {e}")
+            return None
+
+
+    def _parity_probes(self) -> List[BoardGameDTO]:
+        """
+        Board games covering every bin edge, every domain and every mechanic, used to verify the compiled encoder.
+        """
+        years = sorted({year for edge in self.decade_bins for year in (edge, edge + 1) if -3600 <= year < 2030})
+        play_times = sorted({play_time for edge in self.play_time_bins for play_time in (edge, edge + 1) if 0 < play_time < 660})
+        mechanics = list(Mechanic)
+        domains = list(Domain)
+        
+        probes = []
+        for i in range(max(len(years), len(play_times), len(mechanics), len(domains))):
+            min_players = 1 + i % 8
+            probes.append(BoardGameDTO(
+                year_published=years[i % len(years)],
+                min_players=min_players,
+                max_players=min_players + i % 20,
+                play_time=play_times[i % len(play_times)],
+                min_age=2 + i % 20,
+                mechanics=[mechanics[i % len(mechanics)], mechanics[(3 * i) % len(mechanics)]],
+                domains=[domains[i % len(domains)]],
+            ))
+        probes.append(BoardGameDTO(
+            year_published=2000, min_players=2, max_players=4, play_time=60, min_age=10, mechanics=mechanics, domains=domains
+        ))
+        probes.append(BoardGameDTO(
+            year_published=2000, min_players=2, max_players=4, play_time=60, min_age=10, mechanics=[], domains=[]
+        ))
+        return probes
+
 
     @staticmethod
     def _load_json(folder_path: str, file_name: str) -> Dict[str, Any]:
@@ -60,11 +139,55 @@ class FeatureTransfomer:
         return pd.cut([value], bins=bins, labels=labels).astype('category').codes[0]
     
     
+    @staticmethod
+    def _bin_many(values: List[int], bins: list[int], labels: list[str]) -> np.ndarray:
+        return np.asarray(pd.cut(values, bins=bins, labels=labels).astype('category').codes)
+    
+    
     @staticmethod
     def _map_to_cluster(mechanics: list[Mechanic], clusters: Dict[str, int]) -> list[list[int]]:
         return [[clusters.get(mechanic) for mechanic in mechanics]]
     
     
+    def canonical_keys(self, dtos: List[BoardGameDTO]) -> List[tuple]:
+        """
+        Returns a hashable key per board game that only contains what the models actually see, so that board games
+        with identical features share a key:
+        - `year_published` and `play_time` are reduced to their bin codes.
+        - Mechanics and domains are sorted and deduplicated. The amount of mechanics is kept separately, because
+          the `Amount_of_Mechanics` feature counts duplicates.
+        
+        Args:
+            dtos (List[BoardGameDTO]): The board games to create keys for.
+        
+        Returns:
+            List[tuple]: The canonical keys, in the same order as `dtos`.
+        """
+        if len(dtos) == 0:
+            return []
+        
+        year_codes = CompiledFeatureEncoder.bin_codes(
+            np.array([dto.year_published for dto in dtos], dtype=np.float64), np.asarray(self.decade_bins, dtype=np.float64)
+        )
+        play_time_codes = CompiledFeatureEncoder.bin_codes(
+            np.array([dto.play_time for dto in dtos], dtype=np.float64), np.asarray(self.play_time_bins, dtype=np.float64)
+        )
+        
+        return [
+            (
+                int(year_code),
+                dto.min_players,
+                dto.max_players,
+                int(play_time_code),
+                dto.min_age,
+                len(dto.mechanics),
+                tuple(sorted(set(dto.mechanics))),
+                tuple(sorted(set(dto.domains))),
+            )
+            for dto, year_code, play_time_code in zip(dtos, year_codes, play_time_codes)
+        ]
+    
+    
     def transform(self, dto: BoardGameDTO) -> pd.DataFrame:
         """
         Transforms the provided BoardGameDTO object into a pandas DataFrame suitable for prediction by applying various 
@@ -89,6 +212,33 @@ class FeatureTransfomer:
         Raises:
             ValueError: If the input DTO is missing required attributes or contains invalid data types.
         """
+        return self.transform_many([dto])
+    
+    
+    def transform_many(self, dtos: List[BoardGameDTO]) -> pd.DataFrame:
+        """
+        Transforms a list of BoardGameDTO objects into a single feature DataFrame with one row per board game.
+        
+        The same transformations as `transform` are applied, but every step (binning, scaling and MLB encoding)
+        runs once over the whole batch instead of once per board game.
+        
+        Args:
+            dtos (List[BoardGameDTO]): The board games to transform. The row order of the result matches this list.
+        
+        Returns:
+            pd.DataFrame: A DataFrame with one row per board game, using the same columns as `transform`.
+        """
+        if self.encoder is not None:
+            return self.encoder.to_frame(self.encoder.encode_many(dtos))
+        
+        return self._transform_many_pandas(dtos)
+    
+    
+    def _transform_row_pandas(self, dto: BoardGameDTO) -> pd.DataFrame:
+        """
+        The original per-row pandas transformation, kept unchanged as the reference the other implementations are
+        verified against.
+        """
         # Binning
         year_bin = self._bin(dto.year_published, self.decade_bins, self.decade_labels)
         play_time_bin = self._bin(dto.play_time, self.play_time_bins, self.play_time_labels)
@@ -106,16 +256,54 @@ class FeatureTransfomer:
         # Scaling
         to_scale_columns = ["Min Players", "Max Players", "Min Age", "Amount_of_Mechanics"]
         prediction_df[to_scale_columns] = self.scaler.transform(prediction_df[to_scale_columns])
-    
+
         # Domains
         domains_enc = self.domains_mlb.transform([dto.domains])
         for i, class_name in enumerate(self.domains_mlb.classes_):
             prediction_df[f"Domains_{class_name}"] = domains_enc[:, i].tolist()
-    
+
         # Clusters
         clusters = self._map_to_cluster(dto.mechanics, self.mechanic_cluster_mapping)
         clusters_enc = self.clusters_mlb.transform(clusters)
         for i, class_name in enumerate(self.clusters_mlb.classes_):
             prediction_df[f"Clusters_{class_name}"] = clusters_enc[:, i].tolist()
-    
+
         return prediction_df
+
+
+    def _transform_many_pandas(self, dtos: List[BoardGameDTO]) -> pd.DataFrame:
+        """
+        The pandas implementation of `transform_many`, also used as reference for the compiled encoder.
+        """
+        # Binning
+        year_bins = self._bin_many([dto.year_published for dto in dtos], self.decade_bins, self.decade_labels)
+        play_time_bins = self._bin_many([dto.play_time for dto in dtos], self.play_time_bins, self.play_time_labels)
+
+        # Creating Dict
+        prediction_df = pd.DataFrame({
+            "Year Published Bins": year_bins,
+            "Min Players": [dto.min_players for dto in dtos],
+            "Max Players": [dto.max_players for dto in dtos],
+            "Play Time Bins": play_time_bins,
+            "Min Age": [dto.min_age for dto in dtos],
+            "Amount_of_Mechanics": [len(dto.mechanics) for dto in dtos]
+        })
+
+        # Scaling
+        to_scale_columns = ["Min Players", "Max Players", "Min Age", "Amount_of_Mechanics"]
+        prediction_df[to_scale_columns] = self.scaler.transform(prediction_df[to_scale_columns])
+    
+        # Domains
+        domains_enc = self.domains_mlb.transform([dto.domains for dto in dtos])
+        domains_df = pd.DataFrame(
+            domains_enc, columns=[f"Domains_{class_name}" for class_name in self.domains_mlb.classes_]
+        )
+    
+        # Clusters
+        clusters = [self._map_to_cluster(dto.mechanics, self.mechanic_cluster_mapping)[0] for dto in dtos]
+        clusters_enc = self.clusters_mlb.transform(clusters)
+        clusters_df = pd.DataFrame(
+            clusters_enc, columns=[f"Clusters_{class_name}" for class_name in self.clusters_mlb.classes_]
+        )
+    
+        return pd.concat([prediction_df, domains_df, clusters_df], axis=1)
@@ -0,0 +1,285 @@
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+
+from schema import BoardGameDTO, PredictionTarget
+from service.prediction.board_game_predictor import BoardGamePredictor
+from service.prediction.feature_transformer import FeatureTransfomer
+
+logger = logging.getLogger("app")
+
+
+ACTIVE_VERSION_FILE = "ACTIVE"
+DEFAULT_VERSION = "default"
+VERSION_MARKER_FILE = "data_transformation.json"
+
+# Board game used to warm up a freshly loaded version before it serves requests
+SMOKE_TEST_BOARD_GAME = BoardGameDTO(
+    year_published=2015,
+    min_players=2,
+    max_players=4,
+    play_time=60,
+    min_age=10,
+    mechanics=["Hand Management", "Dice Rolling"],
+    domains=["Strategy Games"],
+)
+
+
+@dataclass(frozen=True)
+class PredictionModelBundle:
+    """
+    Everything needed to serve one version of the prediction models. Bundles are never modified, a new version
+    is served by swapping the whole bundle.
+    """
+    version: str
+    path: str
+    transformer: FeatureTransfomer
+    predictor: BoardGamePredictor
+
+    def close(self) -> None:
+        """
+        Releases the threads of the bundle once it is no longer served. Requests still running on it finish.
+        """
+        self.predictor.close()
+
+
+def get_version_fingerprint(path: str) -> Tuple:
+    """
+    Returns the name, size and modification time of every artifact in a version folder.
+    """
+    with os.scandir(path) as entries:
+        return tuple(sorted(
+            (entry.name, entry.stat().st_size, entry.stat().st_mtime_ns) for entry in entries
+            if entry.is_file() and entry.name != ACTIVE_VERSION_FILE and not entry.name.startswith(".")
+        ))
+
+
+class PredictionModelRegistry:
+    """
+    A registry of versioned prediction artifacts.
+
+    Every version is a subfolder of the registry folder containing the artifacts, e.g. `artifacts/prediction_model/v2`.
+    The `ACTIVE` file names the version to serve. A registry folder without version subfolders is served as a
+    single version named `default`.
+
+    New versions are loaded and warmed up with a smoke prediction in a background thread and then swapped in
+    atomically. Requests keep the bundle they started with, so in-flight requests finish on the old version.
+    Versions are meant to be immutable, but artifacts replaced inside the served version folder are detected by their
+    size and modification time and the version is reloaded the same way.
+    """
+
+    def __init__(self, root_path: str, bundle_factory: Callable[[str, str], PredictionModelBundle],
+                 on_swap: Optional[Callable[[PredictionModelBundle], None]] = None):
+        """
+        Args:
+            root_path (str): The registry folder.
+            bundle_factory (Callable): Creates the bundle of a version from its version name and folder.
+            on_swap (Callable): Called with the new bundle after it has been swapped in.
+        """
+        self.root_path = root_path
+        self.bundle_factory = bundle_factory
+        self.on_swap = on_swap
+
+        self._lock = threading.Lock()
+        self._loading_version: Optional[str] = None
+        self._failed_version: Optional[str] = None
+        self._failed_fingerprint: Optional[Tuple] = None
+        self._last_error: Optional[str] = None
+
+        version = self.read_active_version()
+        self._active_fingerprint = get_version_fingerprint(self.version_path(version))
+        self._active = self.load(version)
+        logger.info(f"Serving prediction model version {self._active.version}")
+
+
+    @property
+    def active(self) -> PredictionModelBundle:
+        return self._active
+
+
+    @property
+    def loading_version(self) -> Optional[str]:
+        return self._loading_version
+
+
+    @property
+    def last_error(self) -> Optional[str]:
+        return self._last_error
+
+
+    def list_versions(self) -> List[str]:
+        """
+        Returns the available versions in natural sort order, e.g. v2 before v10.
+        """
+        versions = [
+            entry.name for entry in os.scandir(self.root_path)
+            if entry.is_dir() and os.path.isfile(os.path.join(entry.path, VERSION_MARKER_FILE))
+        ]
+        if not versions and os.path.isfile(os.path.join(self.root_path, VERSION_MARKER_FILE)):
+            return [DEFAULT_VERSION]
+        return sorted(versions, key=lambda v: [int(p) if p.isdigit() else p for p in re.split(r"(\d+)", v)])
+
+
+    def version_path(self, version: str) -> str:
+        if version == DEFAULT_VERSION and not os.path.isdir(os.path.join(self.root_path, DEFAULT_VERSION)):
+            return self.root_path
+        if os.sep in version or (os.altsep and os.altsep in version) or version in (".", ".."):
+            raise ValueError(f"Invalid prediction model version: {version}")
+        return os.path.join(self.root_path, version)
+
+
+    def read_active_version(self) -> str:
+        """
+        Returns the version named in the ACTIVE file, or the newest available version when there is no ACTIVE file.
+        """
+        active_file = os.path.join(self.root_path, ACTIVE_VERSION_FILE)
+        if os.path.isfile(active_file):
+            with open(active_file, "r", encoding="utf-8") as file:
+                version = file.read().strip()
+            if version:
+                return version
+
+        versions = self.list_versions()
+        if not versions:
+            raise FileNotFoundError(f"No prediction model versions found in {self.root_path}")
+        return versions[-1]
+
+
+    def write_active_version(self, version: str) -> None:
+        """
+        Atomically points the ACTIVE file to the version, so every worker serving this registry picks it up.
+        """
+        if version not in self.list_versions():
+            raise ValueError(f"Unknown prediction model version: {version}")
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.root_path, prefix=f".{ACTIVE_VERSION_FILE}.")
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            file.write(f"{version}\n")
+        os.replace(tmp_path, os.path.join(self.root_path, ACTIVE_VERSION_FILE))
+
+
+    def load(self, version: str) -> PredictionModelBundle:
+        """
+        Loads a version and warms it up with a smoke prediction.
+
+        Raises:
+            FileNotFoundError: If the version or one of its artifacts does not exist.
+            ValueError: If the smoke prediction fails.
+        """
+        start = time.perf_counter()
+        bundle = self.bundle_factory(version, self.version_path(version))
+
+        try:
+            features = bundle.transformer.transform(SMOKE_TEST_BOARD_GAME)
+            bundle.predictor.predict(features, list(PredictionTarget))
+        except Exception as e:
+            bundle.close()
+            raise ValueError(f"Smoke prediction failed for prediction model version {version}: {e}")
+
+        logger.info(f"Loaded and warmed up prediction model version {version} in {(time.perf_counter() - start) * 1000:.1f} ms")
+        return bundle
+
+
+    def activate(self, version: str, background: bool = True, reload: bool = False) -> Optional[threading.Thread]:
+        """
+        Loads a version and swaps it in once it is warm. Nothing happens when the version is already active or loading.
+        When another version is requested while loading, only the most recently requested version is swapped in.
+
+        Args:
+            version (str): The version to activate.
+            background (bool): Load the version in a background thread instead of the calling thread.
+            reload (bool): Load the version again when it is already active, e.g. after its artifacts changed.
+
+        Returns:
+            threading.Thread: The loading thread when loading in the background, otherwise None.
+        """
+        with self._lock:
+            if version == self._loading_version:
+                return None
+            if version == self._active.version and not reload:
+                # Cancels a pending swap to another version
+                self._loading_version = None
+                return None
+            self._loading_version = version
+
+        if not background:
+            self._load_and_swap(version)
+            return None
+
+        thread = threading.Thread(target=self._load_and_swap, args=(version,), name=f"model-load-{version}", daemon=True)
+        thread.start()
+        return thread
+
+
+    def _load_and_swap(self, version: str) -> None:
+        fingerprint: Optional[Tuple] = None
+        try:
+            # Taken before loading, so artifacts that change while loading trigger another reload
+            fingerprint = get_version_fingerprint(self.version_path(version))
+            bundle = self.load(version)
+        except Exception as e:
+            logger.error(f"Failed to activate prediction model version {version}, keeping {self._active.version}: {e}")
+            with self._lock:
+                if self._loading_version == version:
+                    self._loading_version = None
+                self._failed_version = version
+                self._failed_fingerprint = fingerprint
+                self._last_error = str(e)
+            return
+
+        with self._lock:
+            if self._loading_version != version:
+                logger.info(f"Discarding prediction model version {version}, version {self._loading_version} was requested since")
+                bundle.close()
+                return
+            previous = self._active
+            self._active = bundle
+            self._active_fingerprint = fingerprint
+            self._loading_version = None
+            self._failed_version = None
+            self._failed_fingerprint = None
+            self._last_error = None
+
+        logger.info(f"Swapped prediction model version {previous.version} for {bundle.version}")
+        previous.close()
+        if self.on_swap is not None:
+            self.on_swap(bundle)
+
+
+    def check_for_update(self) -> None:
+        """
+        Activates the version named in the ACTIVE file in the background when it differs from the served version.
+        """
+        try:
+            version = self.read_active_version()
+        except Exception as e:
+            logger.error(f"Failed to read the active prediction model version: {e}")
+            return
+
+        # A version that failed to load is not retried on every check, only when activated explicitly
+        if version != self._active.version and version != self._failed_version:
+            self.activate(version)
+        elif version == self._active.version:
+            self.check_for_changes()
+
+
+    def check_for_changes(self, background: bool = True) -> None:
+        """
+        Reloads the served version when its artifacts were replaced in place. Artifacts that failed to load are not
+        retried until they change again.
+        """
+        version = self._active.version
+        try:
+            fingerprint = get_version_fingerprint(self.version_path(version))
+        except Exception as e:
+            logger.error(f"Failed to check prediction model version {version} for changes: {e}")
+            return
+
+        if fingerprint != self._active_fingerprint and fingerprint != self._failed_fingerprint:
+            logger.info(f"Artifacts of prediction model version {version} changed in place, reloading it")
+            self.activate(version, background=background, reload=True)
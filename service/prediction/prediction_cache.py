@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+from schema import PredictionDTO
+
+
+class PredictionCache:
+    """
+    A bounded, thread-safe LRU cache with a time-to-live for prediction results.
+
+    Entries are evicted when they are older than `ttl_seconds` or, once `max_size` entries are stored,
+    when they are the least recently used. A `max_size` of 0 disables the cache.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+
+        self._entries: OrderedDict[Hashable, tuple[float, PredictionDTO]] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.clears = 0
+
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+
+    def get(self, key: Hashable) -> Optional[PredictionDTO]:
+        """
+        Returns the cached prediction for the key, or None when it is missing or expired.
+        """
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, prediction = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return prediction
+
+
+    def put(self, key: Hashable, prediction: PredictionDTO) -> None:
+        """
+        Stores a prediction, evicting the least recently used entry when the cache is full.
+        """
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, prediction)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+
+    def clear(self) -> None:
+        """
+        Removes all entries, e.g. after the model artifacts changed.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.clears += 1
+
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "clears": self.clears,
+            }
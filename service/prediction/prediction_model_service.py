@@ -1,17 +1,263 @@
 import logging
-from config import PREDICTION_ARTIFACTS_PATH
+import threading
+import time
+from typing import List, Dict, Any, Optional
 
-from schema import BoardGameDTO, PredictionDTO
-from service.prediction.board_game_predictor import BoardGamePredictor
+import numpy as np
+
+from config import (PREDICTION_ARTIFACTS_PATH, PREDICTION_COMPILED_ENCODER, PREDICTION_CACHE_SIZE,
+                    PREDICTION_CACHE_TTL, PREDICTION_ARTIFACTS_CHECK_INTERVAL, PREDICTION_PARALLEL_MIN_ROWS,
+                    PREDICTION_ARTIFACTS_MMAP_MODE)
+
+from schema import BoardGameDTO, PredictionDTO, PredictionTarget, SweepRequestDTO, SweepResultDTO, SweepVariantDTO
+from service.prediction.artifact_loader import ARTIFACT_LOAD_REPORTS, get_resident_memory
+from service.prediction.board_game_predictor import BoardGamePredictor, normalize_targets
 from service.prediction.feature_transformer import FeatureTransfomer
+from service.prediction.model_registry import PredictionModelBundle, PredictionModelRegistry
+from service.prediction.prediction_cache import PredictionCache
+from service.prediction.sweep import SweepGrid
+from service.executors import run_in_prediction_executor, uses_prediction_process_pool
 
 logger = logging.getLogger("app")
 
+
+def load_model_bundle(version: str, artifacts_path: str) -> PredictionModelBundle:
+    """
+    Loads the feature transformer and the models of one prediction model version.
+    """
+    start, rss_before, reports_before = time.perf_counter(), get_resident_memory(), len(ARTIFACT_LOAD_REPORTS)
+    bundle = PredictionModelBundle(
+        version=version,
+        path=artifacts_path,
+        transformer=FeatureTransfomer(
+            artifacts_path,
+            use_compiled_encoder=PREDICTION_COMPILED_ENCODER,
+            mmap_mode=PREDICTION_ARTIFACTS_MMAP_MODE,
+        ),
+        predictor=BoardGamePredictor(
+            artifacts_path,
+            parallel_min_rows=PREDICTION_PARALLEL_MIN_ROWS,
+            mmap_mode=PREDICTION_ARTIFACTS_MMAP_MODE,
+        ),
+    )
+    logger.info(
+        f"Loaded {len(ARTIFACT_LOAD_REPORTS) - reports_before} prediction artifacts from {artifacts_path} "
+        f"in {(time.perf_counter() - start) * 1000:.1f} ms, resident memory "
+        f"+{(get_resident_memory() - rss_before) / 1024 / 1024:.1f} MiB (mmap_mode={PREDICTION_ARTIFACTS_MMAP_MODE})"
+    )
+    return bundle
+
+
 class PredictionModelService:
-    def __init__(self):
-        self.transformer = FeatureTransfomer(PREDICTION_ARTIFACTS_PATH)
-        self.predictor = BoardGamePredictor(PREDICTION_ARTIFACTS_PATH)
-        
-    def predict_board_game(self, board_game_dto: BoardGameDTO) -> PredictionDTO:
-        encoded = self.transformer.transform(board_game_dto)
-        return self.predictor.predict(encoded)
\ No newline at end of file
+    def __init__(self, cache_size: int = PREDICTION_CACHE_SIZE):
+        self.cache = PredictionCache(max_size=cache_size, ttl_seconds=PREDICTION_CACHE_TTL)
+        self.registry = PredictionModelRegistry(
+            PREDICTION_ARTIFACTS_PATH, load_model_bundle, on_swap=lambda bundle: self.cache.clear()
+        )
+        self._check_lock = threading.Lock()
+        self._last_version_check = time.monotonic()
+
+    def _check_for_new_version(self) -> None:
+        """
+        Starts loading the version named in the ACTIVE file when it changed. The file is checked at most once every
+        PREDICTION_ARTIFACTS_CHECK_INTERVAL seconds, requests keep being served by the current version while the
+        new one loads.
+        """
+        if time.monotonic() - self._last_version_check < PREDICTION_ARTIFACTS_CHECK_INTERVAL:
+            return
+
+        with self._check_lock:
+            if time.monotonic() - self._last_version_check < PREDICTION_ARTIFACTS_CHECK_INTERVAL:
+                return
+            self._last_version_check = time.monotonic()
+            self.registry.check_for_update()
+
+    def predict_board_game(self, board_game_dto: BoardGameDTO,
+                           targets: Optional[List[PredictionTarget]] = None) -> PredictionDTO:
+        return self.predict_board_games([board_game_dto], targets)[0]
+
+    def predict_board_games(self, board_game_dtos: List[BoardGameDTO],
+                            targets: Optional[List[PredictionTarget]] = None) -> List[PredictionDTO]:
+        """
+        Predicts a batch of board games with a single feature matrix and one call per model.
+        Only the models of the requested targets are run, by default all of them.
+        Board games with a cached prediction, or with the same features as another board game in the batch,
+        are only predicted once.
+        """
+        targets = normalize_targets(targets)
+        bundle = self.registry.active
+        keys, predictions, to_predict = self._lookup(bundle, board_game_dtos, targets)
+
+        if to_predict:
+            self._store(to_predict.keys(), _predict_uncached(bundle, list(to_predict.values()), targets), predictions)
+
+        return [predictions[key] for key in keys]
+
+    async def predict_board_games_async(self, board_game_dtos: List[BoardGameDTO],
+                                        targets: Optional[List[PredictionTarget]] = None) -> List[PredictionDTO]:
+        """
+        Same as `predict_board_games`, but the cache misses are predicted in the prediction executor
+        so the event loop stays free while the models run.
+        """
+        targets = normalize_targets(targets)
+        bundle = self.registry.active
+        keys, predictions, to_predict = self._lookup(bundle, board_game_dtos, targets)
+
+        if to_predict:
+            if uses_prediction_process_pool():
+                results = await run_in_prediction_executor(
+                    _predict_in_worker, list(to_predict.values()), targets, bundle.version,
+                    initializer=_init_prediction_worker,
+                )
+            else:
+                results = await run_in_prediction_executor(_predict_uncached, bundle, list(to_predict.values()), targets)
+            self._store(to_predict.keys(), results, predictions)
+
+        return [predictions[key] for key in keys]
+
+    def sweep(self, sweep_request: SweepRequestDTO,
+              targets: Optional[List[PredictionTarget]] = None) -> SweepResultDTO:
+        """
+        Predicts the base board game and every variant of a what-if sweep with one call per model.
+        Sweeps are not cached, the variants are encoded straight into a feature matrix.
+        """
+        self._check_for_new_version()
+        return _sweep(self.registry.active, sweep_request, normalize_targets(targets))
+
+    async def sweep_async(self, sweep_request: SweepRequestDTO,
+                          targets: Optional[List[PredictionTarget]] = None) -> SweepResultDTO:
+        """
+        Same as `sweep`, but the sweep runs in the prediction executor so the event loop stays free.
+        """
+        self._check_for_new_version()
+        targets = normalize_targets(targets)
+        bundle = self.registry.active
+
+        if uses_prediction_process_pool():
+            return await run_in_prediction_executor(
+                _sweep_in_worker, sweep_request, targets, bundle.version, initializer=_init_prediction_worker
+            )
+        return await run_in_prediction_executor(_sweep, bundle, sweep_request, targets)
+
+    def _lookup(self, bundle: PredictionModelBundle, board_game_dtos: List[BoardGameDTO],
+                targets: tuple) -> tuple[list, dict, dict]:
+        """
+        Splits the board games into cached predictions and unique board games that still have to be predicted.
+        Cache keys include the model version, so a prediction of a previous version is never returned.
+        """
+        if len(board_game_dtos) == 0:
+            return [], {}, {}
+
+        self._check_for_new_version()
+
+        keys = [(bundle.version, key, targets) for key in bundle.transformer.canonical_keys(board_game_dtos)]
+        predictions = {}
+        to_predict = {}
+        for key, dto in zip(keys, board_game_dtos):
+            if key in predictions or key in to_predict:
+                continue
+            cached = self.cache.get(key)
+            if cached is not None:
+                predictions[key] = cached
+            else:
+                to_predict[key] = dto
+
+        return keys, predictions, to_predict
+
+    def _store(self, keys, results: List[PredictionDTO], predictions: dict) -> None:
+        for key, prediction in zip(keys, results):
+            predictions[key] = prediction
+            self.cache.put(key, prediction)
+
+    def get_bundle(self, version: str) -> PredictionModelBundle:
+        """
+        Returns the bundle of a version, loading and activating it in the calling thread when another version is served.
+
+        Raises:
+            RuntimeError: If the version could not be loaded.
+        """
+        if self.registry.active.version != version:
+            self.registry.activate(version, background=False)
+        elif time.monotonic() - self._last_version_check >= PREDICTION_ARTIFACTS_CHECK_INTERVAL:
+            # Workers follow the version of the parent process, but pick up artifacts replaced in place themselves
+            self._last_version_check = time.monotonic()
+            self.registry.check_for_changes(background=False)
+
+        bundle = self.registry.active
+        if bundle.version != version:
+            raise RuntimeError(f"Prediction model version {version} could not be loaded: {self.registry.last_error}")
+        return bundle
+
+    def activate_version(self, version: str) -> None:
+        """
+        Points the ACTIVE file to a version and starts loading it in the background.
+        Other workers serving the same registry pick the new version up on their next check.
+
+        Raises:
+            ValueError: If the version does not exist.
+        """
+        self.registry.write_active_version(version)
+        self.registry.activate(version)
+
+    def model_versions(self) -> Dict[str, Any]:
+        return {
+            "active": self.registry.active.version,
+            "loading": self.registry.loading_version,
+            "available": self.registry.list_versions(),
+            "last_error": self.registry.last_error,
+        }
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return self.cache.stats()
+
+
+def _predict_uncached(bundle: PredictionModelBundle, board_game_dtos: List[BoardGameDTO],
+                      targets: tuple) -> List[PredictionDTO]:
+    encoded = bundle.transformer.transform_many(board_game_dtos)
+    return bundle.predictor.predict_many(encoded, list(targets), model_version=bundle.version)
+
+
+def _sweep(bundle: PredictionModelBundle, sweep_request: SweepRequestDTO, targets: tuple) -> SweepResultDTO:
+    grid = SweepGrid(sweep_request.board_game, sweep_request.axes)
+    transformer = bundle.transformer
+
+    if transformer.encoder is not None:
+        base = transformer.encoder.encode_many([sweep_request.board_game])
+        features = transformer.encoder.to_frame(np.vstack([base, grid.encode(transformer.encoder)]))
+    else:
+        features = transformer.transform_many([sweep_request.board_game] + grid.to_dtos())
+
+    predictions = bundle.predictor.predict_many(features, list(targets), model_version=bundle.version)
+    return SweepResultDTO(
+        base=predictions[0],
+        variants=[
+            SweepVariantDTO(changes=changes, prediction=prediction)
+            for changes, prediction in zip(grid.changes(), predictions[1:])
+        ],
+    )
+
+
+# Model instance of a prediction worker process, created by the process pool initializer.
+_worker_service: Optional[PredictionModelService] = None
+
+
+def _init_prediction_worker() -> None:
+    global _worker_service
+    _worker_service = PredictionModelService(cache_size=0)
+
+
+def _predict_in_worker(board_game_dtos: List[BoardGameDTO], targets: tuple, version: str) -> List[PredictionDTO]:
+    """
+    Predicts board games inside a prediction worker process, with the model version the request was started on.
+    Workers do not watch the ACTIVE file themselves, they follow the version of the parent process.
+    The cache lives in the parent process.
+    """
+    if _worker_service is None:
+        _init_prediction_worker()
+    return _predict_uncached(_worker_service.get_bundle(version), board_game_dtos, targets)
+
+
+def _sweep_in_worker(sweep_request: SweepRequestDTO, targets: tuple, version: str) -> SweepResultDTO:
+    if _worker_service is None:
+        _init_prediction_worker()
+    return _sweep(_worker_service.get_bundle(version), sweep_request, targets)
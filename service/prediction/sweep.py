@@ -0,0 +1,176 @@
+import operator
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+
+from schema import (BoardGameDTO, Mechanic, Domain, SweepAxisDTO, RangeAxisDTO, AddMechanicAxisDTO,
+                    ToggleDomainAxisDTO)
+from service.prediction.feature_encoder import (CompiledFeatureEncoder, YEAR_PUBLISHED_BINS_COLUMN, MIN_PLAYERS_COLUMN,
+                                                MAX_PLAYERS_COLUMN, PLAY_TIME_BINS_COLUMN, MIN_AGE_COLUMN,
+                                                AMOUNT_OF_MECHANICS_COLUMN)
+
+
+NUMERIC_FIELDS = ["year_published", "min_players", "max_players", "play_time", "min_age"]
+SCALED_FIELDS = {
+    "min_players": MIN_PLAYERS_COLUMN,
+    "max_players": MAX_PLAYERS_COLUMN,
+    "min_age": MIN_AGE_COLUMN,
+    "mechanic_count": AMOUNT_OF_MECHANICS_COLUMN,
+}
+BOUND_OPERATORS = {"ge": operator.ge, "gt": operator.gt, "le": operator.le, "lt": operator.lt}
+
+
+def axis_levels(base: BoardGameDTO, axis: SweepAxisDTO) -> list:
+    """
+    Returns the values an axis takes, before the values that are invalid for the board game are removed.
+    """
+    if isinstance(axis, RangeAxisDTO):
+        return list(range(axis.start, axis.stop + 1, axis.step))
+    if isinstance(axis, AddMechanicAxisDTO):
+        mechanics = axis.mechanics if axis.mechanics is not None else list(Mechanic)
+        return [mechanic for mechanic in dict.fromkeys(mechanics) if mechanic not in base.mechanics]
+    if isinstance(axis, ToggleDomainAxisDTO):
+        return list(dict.fromkeys(axis.domains if axis.domains is not None else list(Domain)))
+    raise ValueError(f"Unsupported sweep axis: {axis}")
+
+
+def axis_size(base: BoardGameDTO, axis: SweepAxisDTO) -> int:
+    """
+    Returns the amount of values an axis takes, without creating them.
+    """
+    if isinstance(axis, RangeAxisDTO):
+        return len(range(axis.start, axis.stop + 1, axis.step))
+    return len(axis_levels(base, axis))
+
+
+def sweep_size(base: BoardGameDTO, axes: List[SweepAxisDTO], limit: Optional[int] = None) -> int:
+    """
+    Returns the amount of variants a sweep generates at most. With a `limit`, counting stops as soon as the product
+    exceeds it, the returned size is then only known to be larger than the limit.
+    """
+    size = 1
+    for axis in axes:
+        size *= axis_size(base, axis)
+        if limit is not None and size > limit:
+            return size
+    return size
+
+
+class SweepGrid:
+    """
+    The variants of a what-if sweep: the cartesian product of the values of every axis applied to a base board game.
+
+    The grid is kept as arrays, one level index per axis and one raw value per numeric feature for every variant, so
+    the variants can be encoded straight into a feature matrix without creating a BoardGameDTO per variant.
+    Numeric values outside the bounds of BoardGameDTO and variants with more minimum than maximum players are left out.
+    """
+
+    def __init__(self, base: BoardGameDTO, axes: List[SweepAxisDTO]):
+        self.base = base
+        self.axes = axes
+        self.levels = [self._valid_levels(axis) for axis in axes]
+
+        # One column per variant, one row per axis
+        level_index = np.indices([len(levels) for levels in self.levels]).reshape(len(axes), -1)
+
+        self.raw: Dict[str, np.ndarray] = {
+            field: np.full(level_index.shape[1], getattr(base, field), dtype=np.float64) for field in NUMERIC_FIELDS
+        }
+        self.raw["mechanic_count"] = np.full(level_index.shape[1], len(base.mechanics), dtype=np.float64)
+        for axis, levels, index in zip(axes, self.levels, level_index):
+            if isinstance(axis, RangeAxisDTO):
+                self.raw[axis.field.value] = np.asarray(levels, dtype=np.float64)[index]
+            elif isinstance(axis, AddMechanicAxisDTO):
+                self.raw["mechanic_count"] += 1
+
+        valid = self.raw["min_players"] <= self.raw["max_players"]
+        self.level_index = level_index[:, valid]
+        self.raw = {field: values[valid] for field, values in self.raw.items()}
+
+
+    def __len__(self) -> int:
+        return self.level_index.shape[1]
+
+
+    def _valid_levels(self, axis: SweepAxisDTO) -> list:
+        levels = axis_levels(self.base, axis)
+        if not isinstance(axis, RangeAxisDTO):
+            return levels
+
+        values = np.asarray(levels)
+        valid = np.ones(len(values), dtype=bool)
+        for constraint in BoardGameDTO.model_fields[axis.field.value].metadata:
+            for name, compare in BOUND_OPERATORS.items():
+                bound = getattr(constraint, name, None)
+                if bound is not None:
+                    valid &= compare(values, bound)
+        return values[valid].tolist()
+
+
+    def _variants(self) -> Iterator[tuple]:
+        """
+        Yields the value of every axis for every variant.
+        """
+        return zip(*[[levels[i] for i in index] for levels, index in zip(self.levels, self.level_index)])
+
+
+    def changes(self) -> List[Dict[str, Any]]:
+        """
+        Returns the values that differ from the base board game for every variant, keyed by axis.
+        """
+        return [
+            {axis.key: getattr(value, "value", value) for axis, value in zip(self.axes, variant)}
+            for variant in self._variants()
+        ]
+
+
+    def to_dtos(self) -> List[BoardGameDTO]:
+        """
+        Returns a board game per variant. Only needed when no compiled encoder is available.
+        """
+        dtos = []
+        for variant in self._variants():
+            update = {"mechanics": list(self.base.mechanics), "domains": list(self.base.domains)}
+            for axis, value in zip(self.axes, variant):
+                if isinstance(axis, RangeAxisDTO):
+                    update[axis.field.value] = value
+                elif isinstance(axis, AddMechanicAxisDTO):
+                    update["mechanics"].append(value)
+                elif value in update["domains"]:
+                    update["domains"] = [domain for domain in update["domains"] if domain != value]
+                else:
+                    update["domains"].append(value)
+            dtos.append(self.base.model_copy(update=update))
+        return dtos
+
+
+    def encode(self, encoder: CompiledFeatureEncoder) -> np.ndarray:
+        """
+        Encodes every variant into a feature matrix. The base board game is encoded once and every axis only rewrites
+        the columns it changes, for all variants at once.
+
+        Returns:
+            np.ndarray: A matrix of shape (len(self), len(encoder.columns)), identical to encoding `to_dtos()`.
+        """
+        base_row = encoder.encode_many([self.base])[0]
+        features = np.tile(base_row, (len(self), 1))
+        rows = np.arange(len(self))
+
+        # Numeric features, re-encoded from the raw values of every variant
+        features[:, encoder.column_index[YEAR_PUBLISHED_BINS_COLUMN]] = encoder.bin_codes(self.raw["year_published"], encoder.decade_edges)
+        features[:, encoder.column_index[PLAY_TIME_BINS_COLUMN]] = encoder.bin_codes(self.raw["play_time"], encoder.play_time_edges)
+        for field, column in SCALED_FIELDS.items():
+            features[:, encoder.column_index[column]] = encoder.scale(self.raw[field], column)
+
+        # Mechanic clusters and domains
+        for axis, levels, index in zip(self.axes, self.levels, self.level_index):
+            if isinstance(axis, AddMechanicAxisDTO):
+                columns = np.asarray([encoder.mechanic_columns.get(mechanic, -1) for mechanic in levels], dtype=np.int64)[index]
+                known = columns >= 0
+                features[rows[known], columns[known]] = 1.0
+            elif isinstance(axis, ToggleDomainAxisDTO):
+                columns = np.asarray([encoder.domain_columns.get(domain, -1) for domain in levels], dtype=np.int64)[index]
+                known = columns >= 0
+                features[rows[known], columns[known]] = 1.0 - base_row[columns[known]]
+
+        return features
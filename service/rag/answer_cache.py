@@ -0,0 +1,178 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+
+@dataclass
+class CachedAnswer:
+    embedding: np.ndarray
+    chunk_ids: frozenset
+    answer: str
+    expires_at: float
+
+
+class SemanticAnswerCache:
+    """
+    A bounded, thread-safe cache of chatbot answers, looked up by question embedding instead of question text.
+
+    Answers are partitioned, e.g. per game mode and language. A question hits an answer of its partition when the
+    cosine similarity of both questions is at least `threshold` and both retrieved exactly the same context chunks,
+    so a paraphrase only reuses an answer that was generated from the same context.
+
+    Entries expire after `ttl_seconds`. Once `max_size` answers are stored the least recently used one is evicted.
+    All answers are dropped when the corpus version changes. A `max_size` of 0 disables the cache.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float, threshold: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+
+        self._entries: OrderedDict[Tuple[Hashable, int], CachedAnswer] = OrderedDict()
+        self._partitions: Dict[Hashable, Dict[int, CachedAnswer]] = {}
+        # Stacked embeddings per partition, rebuilt on the first lookup after the partition changed
+        self._matrices: Dict[Hashable, Tuple[List[int], np.ndarray]] = {}
+        self._next_id = 0
+        self._corpus_version: Optional[str] = None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+
+    def check_corpus_version(self, corpus_version: str) -> None:
+        """
+        Drops every answer when the corpus changed since the answers were cached.
+        """
+        with self._lock:
+            if self._corpus_version is not None and corpus_version != self._corpus_version:
+                self._clear()
+                self.invalidations += 1
+            self._corpus_version = corpus_version
+
+
+    def get(self, partition: Hashable, embedding: List[float], chunk_ids: List[str]) -> Optional[str]:
+        """
+        Returns the answer of the most similar cached question of the partition that retrieved the same chunks,
+        or None when no cached question is similar enough.
+        """
+        if not self.enabled:
+            return None
+
+        query = self._normalize(embedding)
+        chunk_ids = frozenset(chunk_ids)
+        now = time.monotonic()
+
+        with self._lock:
+            ids, matrix = self._matrix(partition)
+            if ids:
+                similarities = matrix @ query
+                for position in np.argsort(-similarities):
+                    if similarities[position] < self.threshold:
+                        break
+                    entry = self._partitions[partition][ids[position]]
+                    if entry.expires_at < now or entry.chunk_ids != chunk_ids:
+                        continue
+                    self._entries.move_to_end((partition, ids[position]))
+                    self.hits += 1
+                    return entry.answer
+
+            self.misses += 1
+            return None
+
+
+    def put(self, partition: Hashable, embedding: List[float], chunk_ids: List[str], answer: str) -> None:
+        if not self.enabled:
+            return
+
+        entry = CachedAnswer(
+            embedding=self._normalize(embedding),
+            chunk_ids=frozenset(chunk_ids),
+            answer=answer,
+            expires_at=time.monotonic() + self.ttl_seconds,
+        )
+        with self._lock:
+            self._evict_expired()
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[(partition, entry_id)] = entry
+            self._partitions.setdefault(partition, {})[entry_id] = entry
+            self._matrices.pop(partition, None)
+
+            while len(self._entries) > self.max_size:
+                (evicted_partition, evicted_id), _ = self._entries.popitem(last=False)
+                self._remove(evicted_partition, evicted_id)
+                self.evictions += 1
+
+
+    def _matrix(self, partition: Hashable) -> Tuple[List[int], np.ndarray]:
+        if partition not in self._matrices:
+            entries = self._partitions.get(partition, {})
+            ids = list(entries.keys())
+            matrix = np.stack([entries[i].embedding for i in ids]) if ids else np.empty((0, 0), dtype=np.float32)
+            self._matrices[partition] = (ids, matrix)
+        return self._matrices[partition]
+
+
+    def _remove(self, partition: Hashable, entry_id: int) -> None:
+        entries = self._partitions.get(partition, {})
+        entries.pop(entry_id, None)
+        if not entries:
+            self._partitions.pop(partition, None)
+        self._matrices.pop(partition, None)
+
+
+    def _evict_expired(self) -> None:
+        now = time.monotonic()
+        expired = [key for key, entry in self._entries.items() if entry.expires_at < now]
+        for partition, entry_id in expired:
+            del self._entries[(partition, entry_id)]
+            self._remove(partition, entry_id)
+            self.evictions += 1
+
+
+    def _clear(self) -> None:
+        self._entries.clear()
+        self._partitions.clear()
+        self._matrices.clear()
+
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clear()
+
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "threshold": self.threshold,
+                "partitions": len(self._partitions),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
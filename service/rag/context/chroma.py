@@ -1,17 +1,42 @@
 from langchain_community.document_loaders import PyPDFLoader, TextLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain.schema.document import Document
 from langchain_chroma import Chroma
-from service.rag.context.embedding import get_embedding_function
+from service.rag.context.embedding import get_embedding_function, embedding_model_id
+from service.rag.context.embedding_writer import EmbeddingWriter, TokenBucket, WriteReport, content_hash
+from service.rag.context.lexical_index import LexicalIndex
+from service.rag.context.chunker import StructureAwareChunker
+import hashlib
+import json
+import multiprocessing
 import os
 import shutil
 import logging
-from config import CHROMA_PATH, DOCS_PATH
-from typing import List
+import time
+from concurrent.futures import ProcessPoolExecutor
+from config import (CHROMA_PATH, DOCS_PATH, INGEST_WORKERS, INGEST_EMBED_BATCH_SIZE, INGEST_EMBED_CONCURRENCY,
+                    INGEST_EMBED_RATE, INGEST_EMBED_RETRIES, INGEST_EMBED_BACKOFF, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS,
+                    CHUNK_MAX_TOKENS_PER_CORPUS)
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
 import re
 
 logger = logging.getLogger("app")
 
+# File in CHROMA_PATH naming the embedding model the database was built with
+EMBEDDING_MODEL_FILE = "EMBEDDING_MODEL"
+# File in CHROMA_PATH with the content hash and chunk IDs of every ingested document
+MANIFEST_FILE = "ingestion_manifest.json"
+# File in CHROMA_PATH with the chunk IDs written so far of the document being ingested
+CHECKPOINT_FILE = "ingestion_checkpoint.json"
+# File in CHROMA_PATH with the BM25 index of the chunks, see LexicalIndex
+LEXICAL_INDEX_FILE = "lexical_index.json"
+
+SUPPORTED_EXTENSIONS = (".pdf", ".txt", ".md")
+# Recorded per document in the manifest, bumped when the chunker splits differently
+CHUNKER_VERSION = "structure-v1"
+
+# Shared by every ingestion, so the rate limit of the embedding API holds across documents
+EMBED_RATE_LIMITER = TokenBucket(INGEST_EMBED_RATE)
+
 
 def init_chroma(reset: bool) -> None:
     """
@@ -23,41 +48,300 @@ def init_chroma(reset: bool) -> None:
     Returns:
         None
     """
+    model_id = embedding_model_id()
+    built_with = read_embedding_model()
     if reset:
         logger.info("Clearing Database")
         clear_database()
+    elif built_with is not None and built_with != model_id:
+        # Vectors of another embedding model can not be compared with the questions, the database is rebuilt
+        logger.info(f"Clearing Database, it was built with embedding model {built_with} instead of {model_id}")
+        clear_database()
+
+    # Update the data store with the new, changed and removed documents
+    ingest_documents()
+    write_embedding_model(model_id)
+    build_lexical_index()
+
+
+def corpus_fingerprint(db: Chroma) -> str:
+    """
+    Returns a fingerprint of the chunks in the database, which changes whenever chunks are added, removed or edited:
+    the ID of every chunk with the `content_hash` of its text. An edited document keeps the IDs of its chunks, so the
+    IDs alone do not change with its text.
+    """
+    items = db.get(include=["metadatas"])
+    hashes = {chunk_id: (metadata or {}).get("content_hash") for chunk_id, metadata in zip(items["ids"], items["metadatas"])}
+
+    # Chunks written before their content hash was stored are hashed from their text
+    unhashed = [chunk_id for chunk_id, text_hash in hashes.items() if text_hash is None]
+    if unhashed:
+        texts = db.get(ids=unhashed, include=["documents"])
+        hashes.update((chunk_id, content_hash(text or "")) for chunk_id, text in zip(texts["ids"], texts["documents"]))
+
+    return hashlib.sha256("\n".join(f"{chunk_id} {hashes[chunk_id]}" for chunk_id in sorted(hashes)).encode("utf-8")).hexdigest()
+
+
+def build_lexical_index(db: Optional[Chroma] = None) -> LexicalIndex:
+    """
+    Builds the BM25 index of the chunks in the Chroma database and stores it in CHROMA_PATH,
+    unless the stored index already covers the current chunks.
+    """
+    if db is None:
+        db = Chroma(persist_directory=CHROMA_PATH, embedding_function=get_embedding_function())
+    version = corpus_fingerprint(db)
+
+    path = os.path.join(CHROMA_PATH, LEXICAL_INDEX_FILE)
+    index = LexicalIndex.load(path)
+    if index is not None and index.version == version:
+        return index
+
+    index = LexicalIndex.from_chroma(db, version)
+    os.makedirs(CHROMA_PATH, exist_ok=True)
+    index.save(path)
+    return index
+
+
+def load_lexical_index() -> Optional[LexicalIndex]:
+    """
+    Returns the BM25 index stored by `build_lexical_index`, None when there is none.
+    """
+    return LexicalIndex.load(os.path.join(CHROMA_PATH, LEXICAL_INDEX_FILE))
+
+
+def ingest_documents() -> None:
+    """
+    Brings the Chroma database in line with the documents in DOCS_PATH, using the ingestion manifest:
+    - New and changed documents are loaded, split and embedded.
+    - The chunks of changed and removed documents are deleted.
+    - Unchanged documents only cost a hash of their content.
+    - Documents split with other chunk settings count as changed.
+
+    Chunks are written in batches, see `add_to_chroma`. The batches written of the document being ingested are
+    checkpointed, so an ingestion that stopped halfway a document continues after its last written batch.
+
+    Returns:
+        None
+    """
+    manifest = read_manifest()
+    hashes = hash_documents()
+    checkpoint = read_checkpoint()
+
+    changed = [file_name for file_name, digest in hashes.items()
+               if manifest.get(file_name, {}).get("sha256") != digest
+               or manifest[file_name].get("chunker") != chunker_id(file_name)]
+    removed = [file_name for file_name in manifest if file_name not in hashes]
+    logger.info(f"Documents: {len(hashes) - len(changed)} unchanged, {len(changed)} new or changed, {len(removed)} removed")
+    if not changed and not removed:
+        return
+
+    db = Chroma(persist_directory=CHROMA_PATH, embedding_function=get_embedding_function())
+
+    # Remove the chunks of the previous version of every changed or removed document
+    stale_ids = []
+    for file_name in changed + removed:
+        if file_name in manifest:
+            stale_ids.extend(manifest[file_name]["chunk_ids"])
+        else:
+            # Ingested before the manifest existed, or partially ingested: the checkpointed chunks are kept
+            kept = checkpointed_ids(checkpoint, file_name, hashes.get(file_name))
+            ids = db.get(where={"source": os.path.join(DOCS_PATH, file_name)}, include=[])["ids"]
+            stale_ids.extend(chunk_id for chunk_id in ids if chunk_id not in kept)
+    if stale_ids:
+        logger.info(f"Deleting outdated chunks: {len(stale_ids)}")
+        db.delete(ids=stale_ids)
+    for file_name in changed + removed:
+        manifest.pop(file_name, None)
+    write_manifest(manifest)
+
+    # Add the chunks of every new or changed document, the manifest is updated per document.
+    # Documents are parsed and split in worker processes while the previous ones are embedded.
+    start = time.perf_counter()
+    total = WriteReport()
+    for file_name, chunks in iter_split_documents(changed):
+        chunks = calculate_chunk_ids(chunks)
+        if len(chunks) == 0:
+            # Not recorded, so the document is tried again on the next start
+            logger.warning(f"No chunks loaded from {file_name}")
+            continue
+
+        committed = checkpointed_ids(checkpoint, file_name, hashes[file_name])
+        checkpoint = {"file_name": file_name, "sha256": hashes[file_name], "chunk_ids": sorted(committed)}
+
+        def commit(chunk_ids: List[str]) -> None:
+            checkpoint["chunk_ids"].extend(chunk_ids)
+            write_checkpoint(checkpoint)
+
+        total.add(add_to_chroma(chunks, db, on_commit=commit))
+        manifest[file_name] = {
+            "sha256": hashes[file_name],
+            "chunker": chunker_id(file_name),
+            "chunk_ids": [chunk.metadata["id"] for chunk in chunks],
+        }
+        write_manifest(manifest)
+        write_checkpoint(None)
+
+    seconds = time.perf_counter() - start
+    logger.info(
+        f"Ingested {total.chunks} chunks in {seconds:.1f}s ({total.chunks / seconds if seconds > 0 else 0.0:.1f} chunks/s), "
+        f"{total.skipped} already written, {total.batches} batches, {total.retries} retries, "
+        f"{total.embedded} texts embedded, {total.reused} chunks reused an embedding of identical text"
+    )
+
+
+def load_and_split_document(file_name: str) -> List[Document]:
+    """
+    Loads one document and splits it into chunks. Runs in the ingestion worker processes.
+    """
+    return split_documents(load_document(file_name))
+
+
+def iter_split_documents(file_names: List[str], workers: int = INGEST_WORKERS) -> Iterator[Tuple[str, List[Document]]]:
+    """
+    Loads and splits documents in a pool of `workers` processes, the CPU-bound part of the ingestion.
+    Every worker imports the application once when it starts, which pays off for PDFs but not for a few small text
+    files: with one worker or one document they are split in the calling process.
+
+    Yields:
+        Tuple[str, List[Document]]: Every file name with its chunks, in the order of `file_names`, so the chunk IDs
+        of `calculate_chunk_ids` do not depend on which worker finished first.
+    """
+    # Never from within a worker process: an entry point that ingests on import would otherwise spawn pools recursively
+    if workers <= 1 or len(file_names) <= 1 or multiprocessing.current_process().name != "MainProcess":
+        for file_name in file_names:
+            yield file_name, load_and_split_document(file_name)
+        return
+
+    # Spawned rather than forked, forking a process that already runs gRPC threads (Google Cloud clients) can deadlock
+    with ProcessPoolExecutor(max_workers=min(workers, len(file_names)),
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        yield from zip(file_names, pool.map(load_and_split_document, file_names))
+
+
+def hash_documents() -> Dict[str, str]:
+    """
+    Returns the SHA-256 of the content of every supported document in DOCS_PATH, by file name.
+    """
+    hashes = {}
+    try:
+        for file_name in sorted(os.listdir(DOCS_PATH)):
+            if not file_name.endswith(SUPPORTED_EXTENSIONS):
+                continue
+            digest = hashlib.sha256()
+            with open(os.path.join(DOCS_PATH, file_name), "rb") as file:
+                for block in iter(lambda: file.read(1024 * 1024), b""):
+                    digest.update(block)
+            hashes[file_name] = digest.hexdigest()
+    except FileNotFoundError as e:
+        logger.error(f"Documents directory not found: {e}")
+    return hashes
+
+
+def read_manifest() -> Dict[str, Dict]:
+    """
+    Returns the ingestion manifest: the content hash and chunk IDs of every ingested document, by file name.
+    """
+    try:
+        with open(os.path.join(CHROMA_PATH, MANIFEST_FILE), "r", encoding="utf-8") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+    except json.JSONDecodeError as e:
+        logger.error(f"Ingestion manifest is corrupt, every document is ingested again: {e}")
+        return {}
+
+
+def write_manifest(manifest: Dict[str, Dict]) -> None:
+    """
+    Writes the ingestion manifest, replacing the previous one at once so it is never half written.
+    """
+    os.makedirs(CHROMA_PATH, exist_ok=True)
+    path = os.path.join(CHROMA_PATH, MANIFEST_FILE)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(f"{path}.tmp", path)
+
+
+def read_checkpoint() -> Optional[Dict]:
+    """
+    Returns the ingestion checkpoint: the file name, content hash and written chunk IDs of the document that was
+    being ingested, None when the last ingestion finished.
+    """
+    try:
+        with open(os.path.join(CHROMA_PATH, CHECKPOINT_FILE), "r", encoding="utf-8") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+    except json.JSONDecodeError as e:
+        logger.error(f"Ingestion checkpoint is corrupt, the document is ingested again: {e}")
+        return None
 
-    # Create (or update) the data store.
-    documents = load_documents()
-    chunks = split_documents(documents)
-    add_to_chroma(chunks)
 
+def write_checkpoint(checkpoint: Optional[Dict]) -> None:
+    """
+    Writes the ingestion checkpoint at once, or removes it when None.
+    """
+    path = os.path.join(CHROMA_PATH, CHECKPOINT_FILE)
+    if checkpoint is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    os.makedirs(CHROMA_PATH, exist_ok=True)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+        json.dump(checkpoint, file)
+    os.replace(f"{path}.tmp", path)
+
+
+def checkpointed_ids(checkpoint: Optional[Dict], file_name: str, digest: Optional[str]) -> Set[str]:
+    """
+    Returns the chunk IDs written of this version of the document, empty when the checkpoint is of another document.
+    """
+    if checkpoint is None or checkpoint.get("file_name") != file_name or checkpoint.get("sha256") != digest:
+        return set()
+    return set(checkpoint.get("chunk_ids", []))
 
-def load_documents() -> List[Document]:
+
+def read_embedding_model() -> Optional[str]:
+    """
+    Returns the embedding model the Chroma database was built with.
+    A database built before the model was recorded was built with the Gemini embeddings.
+
+    Returns:
+        Optional[str]: The embedding model identifier, None if there is no database.
+    """
+    if not os.path.exists(CHROMA_PATH):
+        return None
+    try:
+        with open(os.path.join(CHROMA_PATH, EMBEDDING_MODEL_FILE), "r", encoding="utf-8") as file:
+            return file.read().strip()
+    except FileNotFoundError:
+        return embedding_model_id("gemini")
+
+
+def write_embedding_model(model_id: str) -> None:
+    """
+    Records the embedding model the Chroma database was built with.
+    """
+    os.makedirs(CHROMA_PATH, exist_ok=True)
+    with open(os.path.join(CHROMA_PATH, EMBEDDING_MODEL_FILE), "w", encoding="utf-8") as file:
+        file.write(model_id)
+
+
+def load_documents(file_names: Optional[List[str]] = None) -> List[Document]:
     """
     Loads documents from the local directory, handling both PDF and TXT formats.
 
+    Args:
+        file_names (List[str]): The documents to load, by default every document in DOCS_PATH.
+
     Returns:
         list: A list of document contents.
     """
     documents = []
     try:
-        for file_name in os.listdir(DOCS_PATH):
-            file_path = os.path.join(DOCS_PATH, file_name)
-            if file_name.endswith('.pdf'):
-                loaded_docs = load_from_pdf(file_path)
-            elif file_name.endswith('.txt') or file_name.endswith('.md'):
-                loaded_docs = load_from_txt(file_path)
-            else:
-                continue
+        for file_name in file_names if file_names is not None else os.listdir(DOCS_PATH):
+            documents.extend(load_document(file_name))
 
-            for doc in loaded_docs:
-                game_mode, language = extract_metadata_from_filename(file_name)
-                doc.metadata["game_mode"] = game_mode
-                doc.metadata["language"] = language
-
-            documents.extend(loaded_docs)
-            
     except FileNotFoundError as e:
         logger.error(f"Documents directory not found: {e}")
     except Exception as e:
@@ -66,6 +350,32 @@ def load_documents() -> List[Document]:
     return documents
 
 
+def load_document(file_name: str) -> List[Document]:
+    """
+    Loads one document from the local directory, with its game mode and language from the file name.
+
+    Args:
+        file_name (str): The file name of the document in DOCS_PATH.
+
+    Returns:
+        list: The pages or sections of the document, empty for unsupported files.
+    """
+    file_path = os.path.join(DOCS_PATH, file_name)
+    if file_name.endswith('.pdf'):
+        loaded_docs = load_from_pdf(file_path)
+    elif file_name.endswith('.txt') or file_name.endswith('.md'):
+        loaded_docs = load_from_txt(file_path)
+    else:
+        return []
+
+    for doc in loaded_docs:
+        game_mode, language = extract_metadata_from_filename(file_name)
+        doc.metadata["game_mode"] = game_mode
+        doc.metadata["language"] = language
+
+    return loaded_docs
+
+
 def load_from_pdf(file_path: str) -> List[Document]:
     """
     Loads content from a PDF file.
@@ -126,9 +436,26 @@ def extract_metadata_from_filename(file_name: str) -> tuple:
         return "unknown", "unknown"  # Return default values if the format doesn't match
 
 
+def chunk_max_tokens(game_mode: str, language: str) -> int:
+    """
+    Returns the chunk size of a corpus: CHUNK_MAX_TOKENS_PER_CORPUS of `{game_mode}_{language}` or `{game_mode}`,
+    else CHUNK_MAX_TOKENS.
+    """
+    return CHUNK_MAX_TOKENS_PER_CORPUS.get(
+        f"{game_mode}_{language}", CHUNK_MAX_TOKENS_PER_CORPUS.get(game_mode, CHUNK_MAX_TOKENS)
+    )
+
+
+def chunker_id(file_name: str) -> str:
+    """
+    Returns the chunker and chunk settings a document is split with, recorded in the ingestion manifest.
+    """
+    return f"{CHUNKER_VERSION}:{chunk_max_tokens(*extract_metadata_from_filename(file_name))}:{CHUNK_OVERLAP_TOKENS}"
+
+
 def split_documents(documents: List[Document]) -> list[Document]:
     """
-    Splits documents into smaller chunks for processing.
+    Splits documents into smaller chunks for processing, with the chunk size of their corpus, see `StructureAwareChunker`.
 
     Args:
         documents (list): A list of document contents.
@@ -137,41 +464,41 @@ def split_documents(documents: List[Document]) -> list[Document]:
         list: A list of document chunks.
     """
     try:
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=250,
-            chunk_overlap=50,
-            length_function=len,
-            is_separator_regex=False,
-        )
-        return text_splitter.split_documents(documents)
+        chunks = []
+        for doc in documents:
+            max_tokens = chunk_max_tokens(doc.metadata.get("game_mode"), doc.metadata.get("language"))
+            chunks.extend(StructureAwareChunker(max_tokens, CHUNK_OVERLAP_TOKENS).split_documents([doc]))
+        return chunks
     except Exception as e:
         logger.error(f"Error splitting documents: {e}")
         return []
 
 
-def add_to_chroma(chunks: list[Document]) -> None:
+def add_to_chroma(chunks: list[Document], db: Optional[Chroma] = None,
+                  on_commit: Optional[Callable[[List[str]], None]] = None) -> WriteReport:
     """
-   Adds document chunks to the Chroma database.
+   Adds document chunks to the Chroma database, in batches of INGEST_EMBED_BATCH_SIZE chunks, see `EmbeddingWriter`.
 
    Args:
        chunks (List[Document]): A list of document chunks.
+       db (Chroma): The database, opened here when not given.
+       on_commit (Callable): Called with the chunk IDs of every written batch.
 
    Returns:
-       None
+       WriteReport: The amount of chunks written and skipped, and the time it took.
    """
     try:
         # Load the existing database.
-        db = Chroma(
-            persist_directory=CHROMA_PATH, embedding_function=get_embedding_function()
-        )
+        if db is None:
+            db = Chroma(
+                persist_directory=CHROMA_PATH, embedding_function=get_embedding_function()
+            )
 
         # Calculate Page IDs.
         chunks_with_ids = calculate_chunk_ids(chunks)
 
-        # Add or Update the documents.
-        existing_items = db.get(include=[])  # IDs are always included by default
-        existing_ids = set(existing_items["ids"])
-        logger.info(f"Number of existing documents in DB: {len(existing_ids)}")
+        # Only look up the IDs of these chunks, not every ID in the DB
+        existing_ids = set(db.get(ids=[chunk.metadata["id"] for chunk in chunks_with_ids], include=[])["ids"])
 
         # Only add documents that don't exist in the DB.
         new_chunks = []
@@ -181,10 +508,22 @@ def add_to_chroma(chunks: list[Document]) -> None:
 
         if len(new_chunks):
             logger.info(f"Adding new documents: {len(new_chunks)}")
-            new_chunk_ids = [chunk.metadata["id"] for chunk in new_chunks]
-            db.add_documents(new_chunks, ids=new_chunk_ids)
         else:
             logger.info("No new documents to add")
+
+        writer = EmbeddingWriter(
+            db, db.embeddings,
+            batch_size=INGEST_EMBED_BATCH_SIZE,
+            concurrency=INGEST_EMBED_CONCURRENCY,
+            rate_limiter=EMBED_RATE_LIMITER,
+            retries=INGEST_EMBED_RETRIES,
+            backoff=INGEST_EMBED_BACKOFF,
+        )
+        report = writer.write(chunks_with_ids, committed=existing_ids, on_commit=on_commit)
+        if report.chunks:
+            logger.info(f"Added {report.chunks} chunks in {report.seconds:.1f}s "
+                        f"({report.chunks_per_second:.1f} chunks/s, {report.retries} retries)")
+        return report
     except Exception as e:
         logger.error(f"Error adding documents to Chroma: {e}")
         raise
@@ -0,0 +1,132 @@
+import re
+from typing import List, Optional, Tuple
+
+from langchain.schema.document import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from .prompt_builder import estimate_tokens
+
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+HEADING_MAX_LENGTH = 60
+HEADING_MAX_WORDS = 8
+
+
+def is_heading(line: str) -> bool:
+    """
+    Returns whether a line looks like a heading of a rulebook: a markdown heading, a line in capitals, or a short line
+    starting with a capital or a number without closing punctuation ("Free Parking", "3. Buying Property").
+    """
+    line = line.strip()
+    if not line or len(line) > HEADING_MAX_LENGTH:
+        return False
+    if line.startswith("#"):
+        return True
+    letters = [char for char in line if char.isalpha()]
+    if len(letters) >= 3 and all(char.isupper() for char in letters):
+        return True
+    return (len(line.split()) <= HEADING_MAX_WORDS and (line[0].isupper() or line[0].isdigit())
+            and line[-1] not in ".,;!?")
+
+
+def split_sections(text: str) -> List[Tuple[Optional[str], str]]:
+    """
+    Splits a text into (heading, body) sections, the text before the first heading has no heading.
+    """
+    sections: List[Tuple[Optional[str], str]] = []
+    heading: Optional[str] = None
+    body: List[str] = []
+    for line in text.splitlines():
+        if is_heading(line):
+            if heading is not None or "".join(body).strip():
+                sections.append((heading, "\n".join(body)))
+            heading, body = line.strip().lstrip("#").strip(), []
+        else:
+            body.append(line)
+    if heading is not None or "".join(body).strip():
+        sections.append((heading, "\n".join(body)))
+    return sections
+
+
+class StructureAwareChunker:
+    """
+    Splits documents into chunks of at most `max_tokens` estimated tokens that follow the structure of the rulebook:
+    - The text is split into sections at its headings. Every chunk starts with the heading of its section, so a chunk
+      about "Free Parking" says so.
+    - Consecutive sections that fit in a chunk together are packed into one chunk, each with its heading.
+    - A larger section is split into chunks of whole paragraphs, only a paragraph larger than a chunk is split at
+      lines, sentences and words, with `overlap_tokens` of overlap.
+    """
+
+    def __init__(self, max_tokens: int, overlap_tokens: int):
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+
+
+    def split_documents(self, documents: List[Document]) -> List[Document]:
+        chunks = []
+        for document in documents:
+            # Chunks of small sections, packed until the next one does not fit
+            packed: List[Tuple[Optional[str], str]] = []
+
+            def flush() -> None:
+                if packed:
+                    chunks.append(self._chunk(document, packed[0][0], "\n\n".join(text for _, text in packed)))
+                    packed.clear()
+
+            for heading, body in split_sections(document.page_content):
+                texts = self.split_section(heading, body)
+                if len(texts) != 1:
+                    flush()
+                    chunks.extend(self._chunk(document, heading, text) for text in texts)
+                    continue
+                if packed and estimate_tokens("\n\n".join([text for _, text in packed] + texts)) > self.max_tokens:
+                    flush()
+                packed.append((heading, texts[0]))
+            flush()
+        return chunks
+
+
+    @staticmethod
+    def _chunk(document: Document, heading: Optional[str], text: str) -> Document:
+        metadata = dict(document.metadata)
+        if heading:
+            metadata["section"] = heading
+        return Document(page_content=text, metadata=metadata)
+
+
+    def split_section(self, heading: Optional[str], body: str) -> List[str]:
+        prefix = f"{heading}\n" if heading else ""
+        budget = max(self.max_tokens - estimate_tokens(prefix), 1)
+
+        paragraphs = []
+        for paragraph in PARAGRAPH_BREAK.split(body):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            if estimate_tokens(paragraph) > budget:
+                paragraphs.extend(part.strip() for part in self._split_paragraph(paragraph, budget) if part.strip())
+            else:
+                paragraphs.append(paragraph)
+
+        if not paragraphs:
+            # A heading without text says nothing on its own
+            return []
+
+        chunks, current = [], []
+        for paragraph in paragraphs:
+            if current and estimate_tokens("\n\n".join(current + [paragraph])) > budget:
+                chunks.append(prefix + "\n\n".join(current))
+                current = []
+            current.append(paragraph)
+        chunks.append(prefix + "\n\n".join(current))
+        return chunks
+
+
+    def _split_paragraph(self, paragraph: str, budget: int) -> List[str]:
+        return RecursiveCharacterTextSplitter(
+            chunk_size=budget,
+            chunk_overlap=min(self.overlap_tokens, budget // 2),
+            length_function=estimate_tokens,
+            separators=["\n", ". ", "; ", ", ", " ", ""],
+            keep_separator="end",
+        ).split_text(paragraph)
@@ -1,10 +1,99 @@
+from langchain_core.embeddings import Embeddings
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from config import GEMINI_KEY, GEMINI_EMBED_MODEL
+from config import (GEMINI_KEY, GEMINI_EMBED_MODEL, EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_PATH,
+                    EMBEDDING_CACHE_MAX_QUERY_ROWS, EMBEDDING_CACHE_MAX_DOCUMENT_ROWS, EMBEDDING_BACKEND,
+                    LOCAL_EMBED_MODEL, LOCAL_EMBED_RUNTIME, LOCAL_EMBED_ONNX_FILE, LOCAL_EMBED_BATCH_SIZE,
+                    LOCAL_EMBED_DEVICE)
+from typing import Optional
 import logging
+import threading
+
+from .embedding_cache import CachedEmbeddings
+from .local_embedding import LocalEmbeddings
 
 logger = logging.getLogger("app")
 
-def get_embedding_function() -> GoogleGenerativeAIEmbeddings:
+EMBEDDING_BACKENDS = ("gemini", "local")
+
+_embedding_function: Optional[CachedEmbeddings] = None
+_lock = threading.Lock()
+
+
+def embedding_model_id(backend: str = EMBEDDING_BACKEND) -> str:
+    """
+    Returns an identifier of the embedding model of a backend. Vectors of different identifiers are not comparable,
+    the identifier keys the embedding cache and marks the embedding model the Chroma database was built with.
+    """
+    if backend == "local":
+        model_id = f"local:{LOCAL_EMBED_MODEL}:{LOCAL_EMBED_RUNTIME}"
+        return f"{model_id}:{LOCAL_EMBED_ONNX_FILE}" if LOCAL_EMBED_ONNX_FILE else model_id
+    return f"{backend}:{GEMINI_EMBED_MODEL}"
+
+
+def get_embedding_function() -> CachedEmbeddings:
+    """
+    Return the embedding function of the process, created on the first call.
+
+    The embedding model of the EMBEDDING_BACKEND is wrapped in a CachedEmbeddings cache, so repeated questions and
+    unchanged documents are not embedded again. Every caller shares the same cache.
+
+    Returns:
+    CachedEmbeddings: The cached embedding model of the configured backend.
+    """
+    global _embedding_function
+    with _lock:
+        if _embedding_function is None:
+            _embedding_function = CachedEmbeddings(
+                create_embedding_function(),
+                model_name=embedding_model_id(),
+                max_size=EMBEDDING_CACHE_SIZE,
+                store_path=EMBEDDING_CACHE_PATH or None,
+                max_query_rows=EMBEDDING_CACHE_MAX_QUERY_ROWS,
+                max_document_rows=EMBEDDING_CACHE_MAX_DOCUMENT_ROWS,
+            )
+        return _embedding_function
+
+
+def create_embedding_function(backend: str = EMBEDDING_BACKEND) -> Embeddings:
+    """
+    Create and return the embedding model of a backend.
+
+    Args:
+    backend (str): `gemini` for the remote GoogleGenerativeAIEmbeddings, `local` for a sentence-transformers model.
+
+    Returns:
+    Embeddings: The embedding model of the backend.
+    """
+    if backend == "gemini":
+        return create_gemini_embedding_function()
+    if backend == "local":
+        return create_local_embedding_function()
+
+    logger.error(f"Configuration error: unsupported EMBEDDING_BACKEND {backend}, expected one of {EMBEDDING_BACKENDS}")
+    raise ValueError(f"Unsupported embedding backend: {backend}")
+
+
+def create_local_embedding_function() -> LocalEmbeddings:
+    """
+    Create and return an embedding function that embeds on the host with a sentence-transformers model.
+
+    Returns:
+    LocalEmbeddings: An instance of LocalEmbeddings configured with the LOCAL_EMBED_* settings.
+
+    Raises:
+    ValueError: If LOCAL_EMBED_RUNTIME is not supported.
+    ImportError: If the package LOCAL_EMBED_RUNTIME needs is not installed.
+    """
+    return LocalEmbeddings(
+        model_name=LOCAL_EMBED_MODEL,
+        runtime=LOCAL_EMBED_RUNTIME,
+        onnx_file=LOCAL_EMBED_ONNX_FILE or None,
+        batch_size=LOCAL_EMBED_BATCH_SIZE,
+        device=LOCAL_EMBED_DEVICE,
+    )
+
+
+def create_gemini_embedding_function() -> GoogleGenerativeAIEmbeddings:
     """
     Create and return an embedding function using the GoogleGenerativeAIEmbeddings model.
 
@@ -20,18 +109,18 @@ def get_embedding_function() -> GoogleGenerativeAIEmbeddings:
             raise ValueError("GEMINI_KEY is not set. Please configure the Google API key.")
         if not GEMINI_EMBED_MODEL:
             raise ValueError("GEMINI_EMBED_MODEL is not set. Please configure the embedding model.")
-    
-    
+
+
         embedding_function = GoogleGenerativeAIEmbeddings(
             google_api_key=GEMINI_KEY,
             model=GEMINI_EMBED_MODEL,
         )
         return embedding_function
-    
+
     except ValueError as ve:
         logger.error(f"Configuration error: {ve}")
         raise
 
     except Exception as e:
         logger.error(f"Unexpected error while initializing embedding function: {e}")
-        raise
\ No newline at end of file
+        raise
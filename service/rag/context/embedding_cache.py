@@ -0,0 +1,322 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from service.executors import run_in_rag_executor
+
+logger = logging.getLogger("app")
+
+
+QUERY_KIND = "query"
+DOCUMENT_KIND = "document"
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes a question for the cache key: unicode normalization, case folding and collapsed whitespace,
+    so "What happens on  Free Parking?" and "what happens on free parking?" share a cache entry.
+    """
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+
+def embedding_cache_key(model_name: str, kind: str, text: str) -> str:
+    """
+    Returns the cache key of a text. Query and document embeddings are kept apart since embedding models
+    may embed them differently. Queries are keyed on their normalized form, documents on their exact text, since the
+    case and layout of a chunk are part of what is embedded.
+    """
+    if kind == QUERY_KIND:
+        text = normalize_text(text)
+    return hashlib.sha256(f"{model_name}\0{kind}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    A persistent SQLite store of embeddings keyed by cache key, shared by every worker on the host.
+    Vectors are stored as float32 blobs.
+
+    Query and document embeddings are bounded separately by `max_rows`, so ingesting the corpus does not evict the
+    cached questions. Every kind is pruned to its least recently used embeddings when the store is opened and every
+    time a tenth of its limit has been written since, so it may briefly hold slightly more rows.
+    """
+
+    def __init__(self, path: str, max_rows: Optional[Dict[str, int]] = None):
+        """
+        Args:
+            path (str): Path of the SQLite file.
+            max_rows (Dict[str, int]): Maximum amount of embeddings per kind (QUERY_KIND, DOCUMENT_KIND),
+                a missing kind or 0 keeps all of them.
+        """
+        self.path = path
+        self.max_rows = max_rows or {}
+        self._written_since_prune: Dict[str, int] = {}
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL, created_at REAL NOT NULL)"
+        )
+        columns = {row[1] for row in self._connection.execute("PRAGMA table_info(embeddings)")}
+        if "kind" not in columns:
+            # Stores written before the kinds were kept apart, their rows are pruned as documents
+            self._connection.execute(f"ALTER TABLE embeddings ADD COLUMN kind TEXT NOT NULL DEFAULT '{DOCUMENT_KIND}'")
+        if "last_used" not in columns:
+            self._connection.execute("ALTER TABLE embeddings ADD COLUMN last_used REAL")
+            self._connection.execute("UPDATE embeddings SET last_used = created_at")
+        self._connection.execute("DROP INDEX IF EXISTS embeddings_created_at")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS embeddings_kind_last_used ON embeddings (kind, last_used)")
+        self._connection.commit()
+        with self._lock:
+            for kind in self.max_rows:
+                self._prune(kind)
+
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        """
+        Returns the stored vectors by key, and marks them as used so they are pruned last.
+        """
+        found = {}
+        now = time.time()
+        with self._lock:
+            # SQLite limits the amount of query parameters
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                found.update((key, np.frombuffer(vector, dtype=np.float32).tolist()) for key, vector in rows)
+                if rows:
+                    self._connection.execute(
+                        f"UPDATE embeddings SET last_used = ? WHERE key IN ({','.join('?' * len(rows))})",
+                        [now] + [key for key, _ in rows],
+                    )
+            self._connection.commit()
+        return found
+
+
+    def put_many(self, model_name: str, kind: str, entries: Dict[str, List[float]]) -> None:
+        now = time.time()
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, created_at, kind, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(key, model_name, np.asarray(vector, dtype=np.float32).tobytes(), now, kind, now)
+                 for key, vector in entries.items()],
+            )
+            self._connection.commit()
+
+            self._written_since_prune[kind] = self._written_since_prune.get(kind, 0) + len(entries)
+            max_rows = self.max_rows.get(kind, 0)
+            if max_rows > 0 and self._written_since_prune[kind] >= max(max_rows // 10, 1):
+                self._prune(kind)
+
+
+    def _prune(self, kind: str) -> None:
+        """
+        Deletes the least recently used embeddings of a kind beyond its limit. Must be called while holding the lock.
+        """
+        self._written_since_prune[kind] = 0
+        max_rows = self.max_rows.get(kind, 0)
+        if max_rows <= 0:
+            return
+        deleted = self._connection.execute(
+            "DELETE FROM embeddings WHERE key IN ("
+            "SELECT key FROM embeddings WHERE kind = ? ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (kind, max_rows),
+        ).rowcount
+        self._connection.commit()
+        if deleted:
+            logger.info(f"Pruned {deleted} {kind} embeddings from the embedding cache, "
+                        f"keeping the {max_rows} most recently used")
+
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embedding model with a two-tier cache, so repeated texts skip the call to the (remote) model:
+    - An in-memory LRU of query embeddings.
+    - A persistent SQLite store of query and document embeddings that survives restarts.
+
+    Texts are keyed on the model name and their text, questions on their normalized form, see `embedding_cache_key`.
+    Document embeddings skip the in-memory tier, so ingesting the corpus does not evict the cached questions.
+    The async methods read and write the SQLite store in the RAG thread pool and embed with the async API of the model.
+    """
+
+    def __init__(self, embeddings: Embeddings, model_name: str, max_size: int, store_path: Optional[str] = None,
+                 max_query_rows: int = 0, max_document_rows: int = 0):
+        """
+        Args:
+            embeddings (Embeddings): The wrapped embedding model.
+            model_name (str): The name of the wrapped model, part of every cache key.
+            max_size (int): Maximum amount of query embeddings kept in memory, 0 disables the in-memory tier.
+            store_path (str): Path of the SQLite store, None disables the persistent tier.
+            max_query_rows (int): Maximum amount of query embeddings kept in the SQLite store, 0 keeps all of them.
+            max_document_rows (int): Maximum amount of document embeddings kept in the SQLite store, 0 keeps all of
+                them.
+        """
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.max_size = max_size
+
+        self.store: Optional[EmbeddingStore] = None
+        if store_path:
+            try:
+                self.store = EmbeddingStore(store_path, {QUERY_KIND: max_query_rows, DOCUMENT_KIND: max_document_rows})
+            except sqlite3.Error as e:
+                logger.error(f"Failed to open the embedding cache at {store_path}, using the in-memory cache only: {e}")
+
+        self._entries: OrderedDict[str, List[float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+
+    def embed_query(self, text: str) -> List[float]:
+        key = embedding_cache_key(self.model_name, QUERY_KIND, text)
+
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return vector
+
+        vector = self._get_from_store([key]).get(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self._put_in_store(QUERY_KIND, {key: vector})
+            self._count(misses=1)
+        else:
+            self._count(disk_hits=1)
+
+        self._remember(key, vector)
+        return vector
+
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = embedding_cache_key(self.model_name, QUERY_KIND, text)
+
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return vector
+
+        vector = (await run_in_rag_executor(self._get_from_store, [key])).get(key)
+        if vector is None:
+            vector = await self.embeddings.aembed_query(text)
+            await run_in_rag_executor(self._put_in_store, QUERY_KIND, {key: vector})
+            self._count(misses=1)
+        else:
+            self._count(disk_hits=1)
+
+        self._remember(key, vector)
+        return vector
+
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [embedding_cache_key(self.model_name, DOCUMENT_KIND, text) for text in texts]
+        vectors = self._get_from_store(list(set(keys)))
+
+        missing = self._missing(keys, texts, vectors)
+        if missing:
+            computed = dict(zip(missing.keys(), self.embeddings.embed_documents(list(missing.values()))))
+            self._put_in_store(DOCUMENT_KIND, computed)
+            vectors.update(computed)
+
+        return [vectors[key] for key in keys]
+
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [embedding_cache_key(self.model_name, DOCUMENT_KIND, text) for text in texts]
+        vectors = await run_in_rag_executor(self._get_from_store, list(set(keys)))
+
+        missing = self._missing(keys, texts, vectors)
+        if missing:
+            computed = dict(zip(missing.keys(), await self.embeddings.aembed_documents(list(missing.values()))))
+            await run_in_rag_executor(self._put_in_store, DOCUMENT_KIND, computed)
+            vectors.update(computed)
+
+        return [vectors[key] for key in keys]
+
+
+    def _missing(self, keys: List[str], texts: List[str], vectors: Dict[str, List[float]]) -> Dict[str, str]:
+        """
+        Returns the texts without a cached vector by key, every text once, and counts the hits and misses.
+        """
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        self._count(disk_hits=len(keys) - len(missing), misses=len(missing))
+        return missing
+
+
+    def _count(self, disk_hits: int = 0, misses: int = 0) -> None:
+        with self._lock:
+            self.disk_hits += disk_hits
+            self.misses += misses
+
+
+    def _remember(self, key: str, vector: List[float]) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+    def _get_from_store(self, keys: List[str]) -> Dict[str, List[float]]:
+        if self.store is None:
+            return {}
+        try:
+            return self.store.get_many(keys)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to read from the embedding cache: {e}")
+            return {}
+
+
+    def _put_in_store(self, kind: str, entries: Dict[str, List[float]]) -> None:
+        if self.store is None:
+            return
+        try:
+            self.store.put_many(self.model_name, kind, entries)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to write to the embedding cache: {e}")
+
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "model": self.model_name,
+            "memory_size": len(self._entries),
+            "max_size": self.max_size,
+            "disk_entries": len(self.store) if self.store is not None else None,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,240 @@
+import hashlib
+import logging
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from langchain.schema.document import Document
+from langchain_chroma import Chroma
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger("app")
+
+# Chroma limits the size of a `$in` filter less than SQLite limits query parameters, look up hashes in slices
+HASH_LOOKUP_SIZE = 500
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket: `rate` tokens are added per second, up to `capacity`.
+    A rate of 0 or less disables the limit.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+
+    def acquire(self, tokens: float = 1.0) -> None:
+        """
+        Blocks until `tokens` tokens are available and takes them.
+        """
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+@dataclass
+class WriteReport:
+    chunks: int = 0
+    skipped: int = 0
+    batches: int = 0
+    retries: int = 0
+    # Texts sent to the embedding model, and chunks that reused the embedding of an identical text
+    embedded: int = 0
+    reused: int = 0
+    seconds: float = 0.0
+
+    @property
+    def chunks_per_second(self) -> float:
+        return self.chunks / self.seconds if self.seconds > 0 else 0.0
+
+    def add(self, other: "WriteReport") -> None:
+        self.chunks += other.chunks
+        self.skipped += other.skipped
+        self.batches += other.batches
+        self.retries += other.retries
+        self.embedded += other.embedded
+        self.reused += other.reused
+        self.seconds += other.seconds
+
+
+class EmbeddingWriter:
+    """
+    Embeds chunks and writes them to Chroma in batches, so a large upload stays within the rate limits of the
+    embedding API and a failure only loses the batches in flight.
+
+    - Chunks are embedded in batches of `batch_size`, at most `concurrency` batches at the same time.
+    - Every batch takes a token of the `rate_limiter` before it calls the embedding model.
+    - A failed batch is retried up to `retries` times with exponential backoff and jitter, starting at `backoff` seconds.
+    - Every written batch is reported to `on_commit`, e.g. to checkpoint the chunk IDs. Chunks whose ID is in
+      `committed` are skipped, so a restarted ingestion resumes after the last committed batch.
+    - Every text is embedded once: chunks store the SHA-256 of their text as `content_hash`, a chunk reuses the
+      embedding of a chunk with the same hash in the database, e.g. a rule shared by the classic and belgium
+      rulebooks, or of another chunk in the same write.
+
+    Batches are upserted with their precomputed embeddings, writing a batch twice is harmless.
+    """
+
+    def __init__(self, db: Chroma, embeddings: Embeddings, batch_size: int, concurrency: int,
+                 rate_limiter: TokenBucket, retries: int, backoff: float):
+        self.db = db
+        self.embeddings = embeddings
+        self.batch_size = max(batch_size, 1)
+        self.concurrency = max(concurrency, 1)
+        self.rate_limiter = rate_limiter
+        self.retries = retries
+        self.backoff = backoff
+
+
+    def write(self, chunks: List[Document], committed: Optional[Set[str]] = None,
+              on_commit: Optional[Callable[[List[str]], None]] = None) -> WriteReport:
+        """
+        Embeds and writes the chunks that are not committed yet.
+
+        Raises:
+            Exception: The error of a batch that still failed after all retries. Batches written before are committed.
+        """
+        start = time.perf_counter()
+        committed = committed or set()
+        pending = [chunk for chunk in chunks if chunk.metadata["id"] not in committed]
+        for chunk in pending:
+            chunk.metadata["content_hash"] = content_hash(chunk.page_content)
+        batches = [pending[i:i + self.batch_size] for i in range(0, len(pending), self.batch_size)]
+        report = WriteReport(skipped=len(chunks) - len(pending), batches=len(batches))
+        commit_lock = threading.Lock()
+
+        # Content hash -> embedding, resolved by the first batch with the text
+        vectors: Dict[str, Future] = {}
+        for text_hash, vector in self._stored_vectors({chunk.metadata["content_hash"] for chunk in pending}).items():
+            vectors[text_hash] = Future()
+            vectors[text_hash].set_result(vector)
+        claims_lock = threading.Lock()
+
+        def write_batch(batch: List[Document]) -> int:
+            # Claim the texts no other batch embeds, so every text is embedded once
+            claimed: Dict[str, str] = {}
+            with claims_lock:
+                for chunk in batch:
+                    text_hash = chunk.metadata["content_hash"]
+                    if text_hash not in vectors:
+                        vectors[text_hash] = Future()
+                        claimed[text_hash] = chunk.page_content
+            with commit_lock:
+                report.embedded += len(claimed)
+                report.reused += len(batch) - len(claimed)
+
+            retries = self._write_batch(batch, claimed, vectors)
+            if on_commit is not None:
+                with commit_lock:
+                    on_commit([chunk.metadata["id"] for chunk in batch])
+            return retries
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="embed") as pool:
+            futures = {pool.submit(write_batch, batch): batch for batch in batches}
+            try:
+                for future in as_completed(futures):
+                    report.retries += future.result()
+                    report.chunks += len(futures[future])
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+            finally:
+                report.seconds = time.perf_counter() - start
+
+        return report
+
+
+    def _write_batch(self, batch: List[Document], claimed: Dict[str, str], vectors: Dict[str, Future]) -> int:
+        """
+        Embeds the claimed texts of one batch and upserts the batch, both retried with backoff.
+        The other texts are embedded by other batches or were already in the database.
+
+        Returns:
+            int: The amount of retries it took.
+        """
+        retries = 0
+        if claimed:
+            try:
+                embedded, retries = self._with_retries(self._embed, list(claimed.values()))
+            except Exception as e:
+                # Batches waiting for these texts fail as well
+                for text_hash in claimed:
+                    vectors[text_hash].set_exception(e)
+                raise
+            for text_hash, vector in zip(claimed, embedded):
+                vectors[text_hash].set_result(vector)
+
+        batch_vectors = [vectors[chunk.metadata["content_hash"]].result() for chunk in batch]
+        _, upsert_retries = self._with_retries(self._upsert, batch, batch_vectors)
+        return retries + upsert_retries
+
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        self.rate_limiter.acquire()
+        return self.embeddings.embed_documents(texts)
+
+
+    def _upsert(self, batch: List[Document], batch_vectors: List[List[float]]) -> None:
+        # langchain_chroma has no public call to add precomputed embeddings
+        self.db._collection.upsert(
+            ids=[chunk.metadata["id"] for chunk in batch],
+            embeddings=batch_vectors,
+            metadatas=[chunk.metadata for chunk in batch],
+            documents=[chunk.page_content for chunk in batch],
+        )
+
+
+    def _with_retries(self, function: Callable, *args) -> Tuple[Any, int]:
+        """
+        Calls the function, retried up to `retries` times with exponential backoff and jitter.
+
+        Returns:
+            Tuple[Any, int]: The result of the function and the amount of retries it took.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return function(*args), attempt
+            except Exception as e:
+                if attempt == self.retries:
+                    logger.error(f"Embedding batch failed after {attempt + 1} attempts: {e}")
+                    raise
+                delay = self.backoff * 2 ** attempt * (0.5 + random.random())
+                logger.warning(f"Embedding batch failed, retrying in {delay:.1f}s: {e}")
+                time.sleep(delay)
+
+
+    def _stored_vectors(self, hashes: Set[str]) -> Dict[str, List[float]]:
+        """
+        Returns the embeddings of the chunks in the database with one of the content hashes.
+        """
+        hashes = sorted(hashes)
+        found: Dict[str, List[float]] = {}
+        for start in range(0, len(hashes), HASH_LOOKUP_SIZE):
+            items = self.db._collection.get(
+                where={"content_hash": {"$in": hashes[start:start + HASH_LOOKUP_SIZE]}},
+                include=["embeddings", "metadatas"],
+            )
+            for metadata, vector in zip(items["metadatas"], items["embeddings"]):
+                found[metadata["content_hash"]] = list(vector)
+        return found
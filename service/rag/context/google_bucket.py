@@ -1,14 +1,22 @@
 from google.cloud import storage
 
-from config import GOOGLE_SERVICE_ACCOUNT_CRED_B64, GCS_BUCKET_NAME, GCS_DOCS_PATH, DOCS_PATH
+from config import GOOGLE_SERVICE_ACCOUNT_CRED_B64, GCS_BUCKET_NAME, GCS_DOCS_PATH, DOCS_PATH, GCS_SYNC_WORKERS
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+import hashlib
 import logging
 import os
 import json
-from base64 import b64decode
+import tempfile
+from base64 import b64decode, b64encode
 
 
 logger = logging.getLogger("app")
 
+# File in DOCS_PATH with the generation and MD5 of the blob every local document was downloaded from
+SYNC_MANIFEST_FILE = ".gcs_manifest.json"
+
 
 def validate_config():
     """Validates required configurations."""
@@ -62,33 +70,147 @@ def ensure_local_directory():
         raise
 
 
-def download_blob(blob: storage.Blob, gcs_docs_path: str) -> None:
-    """Downloads a single blob, flattening folder structure."""
+def local_file_name(blob_name: str, gcs_folder_path: str) -> str:
+    """Returns the local file name of a blob, flattening the folder structure."""
+    file_name = os.path.basename(blob_name)
+    if '/' in blob_name[len(gcs_folder_path):]:
+        subfolder_name = blob_name[len(gcs_folder_path):].split('/')[0]
+        file_name = f"{subfolder_name}_{file_name}"
+    return file_name
+
+
+def local_md5(path: str) -> Optional[str]:
+    """Returns the base64 MD5 of a local file in the format of `Blob.md5_hash`, None if the file does not exist."""
     try:
-        # Skip folder objects (blobs that represent folders end with '/')
-        if blob.name.endswith('/'):
-            logger.debug(f"Skipping folder: {blob.name}")
-            return
+        digest = hashlib.md5()
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(block)
+        return b64encode(digest.digest()).decode("ascii")
+    except FileNotFoundError:
+        return None
+
 
-        # Extract the file name and handle subfolder structure
-        file_name = os.path.basename(blob.name)
-        if '/' in blob.name[len(gcs_docs_path):]:
-            subfolder_name = blob.name[len(gcs_docs_path):].split('/')[0]
-            file_name = f"{subfolder_name}_{file_name}"
+def download_blob(blob: storage.Blob, local_file_path: str) -> None:
+    """
+    Downloads a single blob to a temporary file next to the destination, which then replaces the destination at once.
+    A failed download leaves the previous version of the file in place.
+    """
+    directory, file_name = os.path.split(local_file_path)
+    descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{file_name}.", suffix=".tmp")
+    os.close(descriptor)
+    try:
+        blob.download_to_filename(temp_path)
+        os.replace(temp_path, local_file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
 
-        # Define the local file path
-        local_file_path = os.path.join(DOCS_PATH, file_name)
 
-        # Download the file
-        blob.download_to_filename(local_file_path)
-        logger.info(f"Downloaded {file_name} to {local_file_path}")
-    except Exception as e:
-        logger.error(f"Failed to download blob {blob.name}: {e}")
+@dataclass
+class SyncResult:
+    downloaded: List[str] = field(default_factory=list)
+    unchanged: List[str] = field(default_factory=list)
+    deleted: List[str] = field(default_factory=list)
+    failed: List[str] = field(default_factory=list)
+
+
+def read_sync_manifest(local_dir: str) -> Dict[str, Dict[str, Any]]:
+    try:
+        with open(os.path.join(local_dir, SYNC_MANIFEST_FILE), "r", encoding="utf-8") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+    except json.JSONDecodeError as e:
+        logger.error(f"GCS sync manifest is corrupt, every document is compared by its MD5: {e}")
+        return {}
+
+
+def write_sync_manifest(local_dir: str, manifest: Dict[str, Dict[str, Any]]) -> None:
+    path = os.path.join(local_dir, SYNC_MANIFEST_FILE)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(f"{path}.tmp", path)
+
+
+def sync_bucket(bucket: Any, prefix: str, local_dir: str, max_workers: int = GCS_SYNC_WORKERS) -> SyncResult:
+    """
+    Brings a local directory in line with the blobs under a prefix of a bucket:
+    - Blobs whose generation and MD5 match the sync manifest, and whose local file still exists, are skipped.
+      Without a manifest entry a local file with the same MD5 as the blob is kept as well.
+    - The other blobs are downloaded concurrently by at most `max_workers` threads, see `download_blob`.
+    - Local files of blobs that no longer exist are deleted. Files that were not synced from the bucket are left alone.
+
+    The bucket is duck-typed: `list_blobs(prefix=...)` has to return objects with a `name`, `generation`, `md5_hash`
+    and `download_to_filename(path)`, like `google.cloud.storage.Bucket`, so a local fake bucket works as well.
+
+    Returns:
+        SyncResult: The local file names per outcome.
+    """
+    folder_path = prefix if prefix.endswith('/') else prefix + '/'
+    manifest = read_sync_manifest(local_dir)
+    result = SyncResult()
+
+    blobs: Dict[str, Any] = {}
+    for blob in bucket.list_blobs(prefix=prefix):
+        # Skip folder objects (blobs that represent folders end with '/')
+        if blob.name.endswith('/'):
+            logger.debug(f"Skipping folder: {blob.name}")
+            continue
+        blobs[local_file_name(blob.name, folder_path)] = blob
+
+    to_download = []
+    for file_name, blob in blobs.items():
+        path = os.path.join(local_dir, file_name)
+        entry = manifest.get(file_name)
+        if entry is not None:
+            unchanged = (entry.get("generation") == blob.generation and entry.get("md5") == blob.md5_hash
+                         and os.path.exists(path))
+        else:
+            unchanged = blob.md5_hash is not None and local_md5(path) == blob.md5_hash
+        if unchanged:
+            result.unchanged.append(file_name)
+            manifest[file_name] = {"blob": blob.name, "generation": blob.generation, "md5": blob.md5_hash}
+        else:
+            to_download.append(file_name)
+
+    def download(file_name: str) -> bool:
+        try:
+            download_blob(blobs[file_name], os.path.join(local_dir, file_name))
+            logger.info(f"Downloaded {blobs[file_name].name} to {file_name}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to download blob {blobs[file_name].name}: {e}")
+            return False
+
+    if to_download:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(to_download))), thread_name_prefix="gcs") as pool:
+            for file_name, downloaded in zip(to_download, pool.map(download, to_download)):
+                if downloaded:
+                    blob = blobs[file_name]
+                    manifest[file_name] = {"blob": blob.name, "generation": blob.generation, "md5": blob.md5_hash}
+                    result.downloaded.append(file_name)
+                else:
+                    result.failed.append(file_name)
+
+    for file_name in [file_name for file_name in manifest if file_name not in blobs]:
+        try:
+            os.remove(os.path.join(local_dir, file_name))
+        except FileNotFoundError:
+            pass
+        del manifest[file_name]
+        result.deleted.append(file_name)
+        logger.info(f"Deleted {file_name}, its blob was removed from the bucket")
+
+    write_sync_manifest(local_dir, manifest)
+    return result
 
 
 def download_files_from_gcs() -> None:
     """
-    Downloads files from a GCS folder to a local directory, flattening the folder structure.
+    Syncs the files of a GCS folder to a local directory, flattening the folder structure.
+    Only new and changed files are downloaded, see `sync_bucket`.
     """
     # Step 1: Validate configuration
     validate_config()
@@ -100,11 +222,10 @@ def download_files_from_gcs() -> None:
     # Step 3: Ensure local directory exists
     ensure_local_directory()
 
-    # Step 4: List and download files
-    blobs = bucket.list_blobs(prefix=GCS_DOCS_PATH)
-    gcs_folder_path = GCS_DOCS_PATH if GCS_DOCS_PATH.endswith('/') else GCS_DOCS_PATH + '/'
-
-    for blob in blobs:
-        download_blob(blob, gcs_folder_path)
+    # Step 4: Sync the files
+    result = sync_bucket(bucket, GCS_DOCS_PATH, DOCS_PATH)
 
-    logger.info("Completed fetching files from GCS bucket.")
\ No newline at end of file
+    logger.info(
+        f"Completed fetching files from GCS bucket: {len(result.downloaded)} downloaded, {len(result.unchanged)} unchanged, "
+        f"{len(result.deleted)} deleted, {len(result.failed)} failed."
+    )
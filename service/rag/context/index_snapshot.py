@@ -0,0 +1,294 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import stat
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain.schema.document import Document
+from langchain_chroma import Chroma
+
+from .lexical_index import LexicalIndex
+from .vector_index import IndexPartition, VectorIndex
+
+logger = logging.getLogger("app")
+
+
+ACTIVE_VERSION_FILE = "ACTIVE"
+MANIFEST_FILE = "manifest.json"
+VECTORS_FILE = "vectors.npy"
+SQUARED_NORMS_FILE = "squared_norms.npy"
+METADATA_FILE = "metadata.json"
+LEXICAL_INDEX_FILE = "lexical_index.json"
+SNAPSHOT_FORMAT = 1
+
+
+@dataclass(frozen=True)
+class IndexSnapshot:
+    """
+    One immutable version of the RAG index, built offline by `build_index.py`:
+
+    ```
+    artifacts/rag_index/
+    ├── ACTIVE                  # name of the served version, e.g. v2
+    └── v2/
+        ├── manifest.json       # corpus version, embedding model, chunk count, checksums
+        ├── vectors.npy         # one float row per chunk, grouped by (game_mode, language)
+        ├── squared_norms.npy
+        ├── metadata.json       # IDs, texts and metadata of the chunks, row ranges of the partitions
+        └── lexical_index.json  # BM25 index, see LexicalIndex
+    ```
+
+    The vectors are memory-mapped read-only, so opening a snapshot only reads the chunk texts and the partitions of
+    the index are views on the mapped file, shared through the page cache by every worker on the host.
+    """
+    version: str
+    path: str
+    manifest: Dict[str, Any]
+    vector_index: VectorIndex
+    lexical_index: Optional[LexicalIndex]
+
+    @property
+    def corpus_version(self) -> str:
+        return self.manifest["corpus_version"]
+
+
+    @classmethod
+    def load(cls, root_path: str, version: Optional[str] = None, mmap_mode: Optional[str] = "r",
+             embedding_model: Optional[str] = None) -> "IndexSnapshot":
+        """
+        Opens a snapshot.
+
+        Args:
+            root_path (str): The snapshot folder.
+            version (str): The version to open, by default the version in the ACTIVE file, else the newest.
+            mmap_mode (str): `numpy.load` memory-map mode of the vectors, None reads them into memory.
+            embedding_model (str): The embedding model the questions are embedded with, see `embedding_model_id`.
+
+        Raises:
+            FileNotFoundError: If there is no such snapshot.
+            ValueError: If the snapshot was built with another embedding model or format, or a file of the snapshot does
+                not match its checksum in the manifest.
+        """
+        start = time.perf_counter()
+        version = version or read_active_version(root_path)
+        path = version_path(root_path, version)
+
+        with open(os.path.join(path, MANIFEST_FILE), "r", encoding="utf-8") as file:
+            manifest = json.load(file)
+        if manifest.get("format") != SNAPSHOT_FORMAT:
+            raise ValueError(f"RAG index {version} has format {manifest.get('format')}, expected {SNAPSHOT_FORMAT}")
+        if embedding_model is not None and manifest["embedding_model"] != embedding_model:
+            # Questions embedded by another model can not be compared with the vectors of the snapshot
+            raise ValueError(f"RAG index {version} was built with embedding model {manifest['embedding_model']}, "
+                             f"the questions are embedded with {embedding_model}")
+        for name, checksum in manifest.get("files", {}).items():
+            # A truncated or altered file would otherwise be served, memory-mapped rows are only read when searched
+            if file_sha256(os.path.join(path, name)) != checksum:
+                raise ValueError(f"RAG index {version} file {name} does not match its checksum in the manifest")
+
+        vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode=mmap_mode)
+        squared_norms = np.load(os.path.join(path, SQUARED_NORMS_FILE), mmap_mode=mmap_mode)
+        if vectors.shape[0] != manifest["chunks"]:
+            raise ValueError(f"RAG index {version} has {vectors.shape[0]} vectors, its manifest lists {manifest['chunks']}")
+
+        with open(os.path.join(path, METADATA_FILE), "r", encoding="utf-8") as file:
+            metadata = json.load(file)
+
+        partitions = {}
+        for partition in metadata["partitions"]:
+            rows = slice(partition["start"], partition["end"])
+            partitions[(partition["game_mode"], partition["language"])] = IndexPartition(
+                documents=[Document(page_content=text, metadata=chunk_metadata) for text, chunk_metadata
+                           in zip(metadata["documents"][rows], metadata["metadatas"][rows])],
+                # Views on the mapped file, contiguous since the rows are grouped by partition
+                matrix=vectors[rows],
+                squared_norms=squared_norms[rows],
+            )
+        vector_index = VectorIndex(partitions, manifest["corpus_version"])
+
+        lexical_index = LexicalIndex.load(os.path.join(path, LEXICAL_INDEX_FILE))
+        if lexical_index is not None:
+            lexical_index.version = manifest["corpus_version"]
+
+        logger.info(
+            f"Opened RAG index {version} of {manifest['chunks']} chunks in {len(partitions)} partitions "
+            f"in {(time.perf_counter() - start) * 1000:.1f} ms (mmap {mmap_mode})"
+        )
+        return cls(version, path, manifest, vector_index, lexical_index)
+
+
+def list_versions(root_path: str) -> List[str]:
+    """
+    Returns the available versions in natural sort order, e.g. v2 before v10.
+    """
+    if not os.path.isdir(root_path):
+        return []
+    versions = [entry.name for entry in os.scandir(root_path)
+                if entry.is_dir() and os.path.isfile(os.path.join(entry.path, MANIFEST_FILE))]
+    return sorted(versions, key=lambda v: [int(p) if p.isdigit() else p for p in re.split(r"(\d+)", v)])
+
+
+def version_path(root_path: str, version: str) -> str:
+    if not version or os.sep in version or (os.altsep and os.altsep in version) or version.startswith("."):
+        raise ValueError(f"Invalid RAG index version: {version}")
+    return os.path.join(root_path, version)
+
+
+def next_version(root_path: str) -> str:
+    numbers = [int(v[1:]) for v in list_versions(root_path) if re.fullmatch(r"v\d+", v)]
+    return f"v{max(numbers, default=0) + 1}"
+
+
+def read_active_version(root_path: str) -> str:
+    """
+    Returns the version named in the ACTIVE file, or the newest available version when there is no ACTIVE file.
+    """
+    active_file = os.path.join(root_path, ACTIVE_VERSION_FILE)
+    if os.path.isfile(active_file):
+        with open(active_file, "r", encoding="utf-8") as file:
+            version = file.read().strip()
+        if version:
+            return version
+
+    versions = list_versions(root_path)
+    if not versions:
+        raise FileNotFoundError(f"No RAG index versions found in {root_path}")
+    return versions[-1]
+
+
+def write_active_version(root_path: str, version: str) -> None:
+    """
+    Atomically points the ACTIVE file to the version.
+    """
+    if version not in list_versions(root_path):
+        raise ValueError(f"Unknown RAG index version: {version}")
+
+    fd, tmp_path = tempfile.mkstemp(dir=root_path, prefix=f".{ACTIVE_VERSION_FILE}.")
+    with os.fdopen(fd, "w", encoding="utf-8") as file:
+        file.write(f"{version}\n")
+    os.replace(tmp_path, os.path.join(root_path, ACTIVE_VERSION_FILE))
+
+
+def find_version(root_path: str, corpus_version: str, embedding_model: str,
+                 documents: Optional[Dict[str, str]] = None) -> Optional[str]:
+    """
+    Returns the newest version with the same chunks and embedding model, None when there is none.
+
+    Args:
+        root_path (str): The snapshot folder.
+        corpus_version (str): The fingerprint of the chunks, see `corpus_fingerprint`.
+        embedding_model (str): The embedding model of the vectors, see `embedding_model_id`.
+        documents (Dict[str, str]): The SHA-256 of every ingested document by file name, when given a version must
+            also have been built from the same documents.
+    """
+    for version in reversed(list_versions(root_path)):
+        with open(os.path.join(root_path, version, MANIFEST_FILE), "r", encoding="utf-8") as file:
+            manifest = json.load(file)
+        if (manifest.get("corpus_version") == corpus_version and manifest.get("embedding_model") == embedding_model
+                and (documents is None or manifest.get("documents") == documents)):
+            return version
+    return None
+
+
+def write_snapshot(db: Chroma, lexical_index: Optional[LexicalIndex], root_path: str, version: str,
+                   corpus_version: str, embedding_model: str, dtype: str = "float32",
+                   extra: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Writes the chunks of the Chroma database as a new snapshot version. The snapshot is written to a temporary folder
+    and renamed into place, its files are made read-only. An existing version is never overwritten.
+
+    Args:
+        db (Chroma): The database to snapshot.
+        lexical_index (LexicalIndex): The BM25 index of the same chunks, left out when None.
+        root_path (str): The snapshot folder.
+        version (str): The name of the new version.
+        corpus_version (str): The fingerprint of the chunks, see `corpus_fingerprint`.
+        embedding_model (str): The embedding model of the vectors, see `embedding_model_id`.
+        dtype (str): `float32`, or `float16` to halve the size of the vectors.
+        extra (Dict): Additional fields for the manifest, e.g. the ingested documents.
+
+    Returns:
+        str: The folder of the new version.
+
+    Raises:
+        FileExistsError: If the version already exists.
+    """
+    path = version_path(root_path, version)
+    if os.path.exists(path):
+        raise FileExistsError(f"RAG index version {version} already exists in {root_path}")
+
+    items = db.get(include=["embeddings", "documents", "metadatas"])
+    # Rows grouped by partition, then by ID, so every partition is one contiguous block of the vectors
+    order = sorted(range(len(items["ids"])), key=lambda i: (
+        str(items["metadatas"][i].get("game_mode")), str(items["metadatas"][i].get("language")), items["ids"][i]
+    ))
+
+    partitions: List[Dict[str, Any]] = []
+    for row, i in enumerate(order):
+        key: Tuple[Any, Any] = (items["metadatas"][i].get("game_mode"), items["metadatas"][i].get("language"))
+        if not partitions or (partitions[-1]["game_mode"], partitions[-1]["language"]) != key:
+            partitions.append({"game_mode": key[0], "language": key[1], "start": row, "end": row})
+        partitions[-1]["end"] = row + 1
+
+    vectors = np.asarray([items["embeddings"][i] for i in order], dtype=np.float32)
+    if vectors.ndim != 2:
+        vectors = vectors.reshape(len(order), 0)
+    squared_norms = np.einsum("ij,ij->i", vectors, vectors)
+
+    os.makedirs(root_path, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(dir=root_path, prefix=f".{version}.")
+    try:
+        np.save(os.path.join(tmp_path, VECTORS_FILE), vectors.astype(dtype))
+        np.save(os.path.join(tmp_path, SQUARED_NORMS_FILE), squared_norms)
+        with open(os.path.join(tmp_path, METADATA_FILE), "w", encoding="utf-8") as file:
+            json.dump({
+                "ids": [items["ids"][i] for i in order],
+                "documents": [items["documents"][i] for i in order],
+                "metadatas": [items["metadatas"][i] for i in order],
+                "partitions": partitions,
+            }, file)
+        if lexical_index is not None:
+            lexical_index.save(os.path.join(tmp_path, LEXICAL_INDEX_FILE))
+
+        manifest = {
+            "format": SNAPSHOT_FORMAT,
+            "version": version,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "corpus_version": corpus_version,
+            "embedding_model": embedding_model,
+            "chunks": len(order),
+            "dimensions": int(vectors.shape[1]),
+            "dtype": dtype,
+            "partitions": {f"{p['game_mode']}_{p['language']}": p["end"] - p["start"] for p in partitions},
+            "files": {name: file_sha256(os.path.join(tmp_path, name))
+                      for name in sorted(os.listdir(tmp_path))},
+            **(extra or {}),
+        }
+        with open(os.path.join(tmp_path, MANIFEST_FILE), "w", encoding="utf-8") as file:
+            json.dump(manifest, file, indent=2, sort_keys=True)
+
+        for name in os.listdir(tmp_path):
+            os.chmod(os.path.join(tmp_path, name), stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.chmod(tmp_path, 0o755)
+        os.rename(tmp_path, path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    return path
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
@@ -0,0 +1,214 @@
+import json
+import logging
+import math
+import os
+import re
+import time
+import unicodedata
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from langchain.schema.document import Document
+from langchain_chroma import Chroma
+
+logger = logging.getLogger("app")
+
+# Words that say nothing about the rule a question is about, in the supported languages
+STOPWORDS = frozenset("""
+    a an and are as at be by can do does for from how i if in is it its me my of on or so that the their then there
+    this to was what when where which who why will with you your
+    aan als bij dan dat de die dit doe doen een en er het hoe ik in is je kan kun mag me met mijn na naar niet of om
+    op te tot van voor wanneer wat welke wie waar waarom wordt zijn
+""".split())
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits a text into lowercase terms without accents, stopwords or a plural `s`, so `Hotels` matches `hotel`.
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    terms = []
+    for term in TOKEN_PATTERN.findall(text):
+        if term in STOPWORDS:
+            continue
+        if len(term) > 4 and term.endswith("s") and not term.endswith("ss"):
+            term = term[:-1]
+        terms.append(term)
+    return terms
+
+
+@dataclass
+class LexicalPartition:
+    documents: List[Document]
+    lengths: List[int]
+    # Term -> [(document index, term frequency)]
+    postings: Dict[str, List[Tuple[int, int]]]
+
+    @property
+    def average_length(self) -> float:
+        return sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+
+    def idf(self, term: str) -> float:
+        frequency = len(self.postings.get(term, ()))
+        return math.log(1 + (len(self.documents) - frequency + 0.5) / (frequency + 0.5))
+
+
+@dataclass
+class LexicalResults:
+    # (Document, BM25 score) from best to worst match
+    results: List[Tuple[Document, float]]
+    # Share of the question terms, weighted by their IDF, found in the best match
+    confidence: float
+
+
+class LexicalIndex:
+    """
+    A BM25 inverted index of the chunks in the Chroma database, with one partition per (game_mode, language).
+
+    It is built at ingestion and stored next to the Chroma database, see `build_lexical_index`, so exact terms of a
+    question ("Free Parking", "Vrij Parkeren", "hypotheek") can be matched without embedding the question.
+    """
+
+    def __init__(self, partitions: Dict[Tuple[str, str], LexicalPartition], version: Optional[str] = None,
+                 k1: float = 1.5, b: float = 0.75):
+        self.partitions = partitions
+        self.version = version
+        self.k1 = k1
+        self.b = b
+
+
+    @classmethod
+    def from_documents(cls, documents: List[Document], version: Optional[str] = None) -> "LexicalIndex":
+        partitions: Dict[Tuple[str, str], LexicalPartition] = {}
+        for doc in documents:
+            key = (doc.metadata.get("game_mode"), doc.metadata.get("language"))
+            partition = partitions.setdefault(key, LexicalPartition(documents=[], lengths=[], postings={}))
+            terms = tokenize(doc.page_content)
+            index = len(partition.documents)
+            partition.documents.append(doc)
+            partition.lengths.append(len(terms))
+            for term, frequency in Counter(terms).items():
+                partition.postings.setdefault(term, []).append((index, frequency))
+        return cls(partitions, version)
+
+
+    @classmethod
+    def from_chroma(cls, db: Chroma, version: Optional[str] = None) -> "LexicalIndex":
+        """
+        Indexes every chunk in the Chroma database.
+        """
+        start = time.perf_counter()
+        items = db.get(include=["documents", "metadatas"])
+        documents = [Document(page_content=text, metadata=metadata)
+                     for text, metadata in zip(items["documents"], items["metadatas"])]
+        index = cls.from_documents(documents, version)
+        logger.info(f"Built lexical index of {len(documents)} chunks in {len(index.partitions)} partitions "
+                    f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+        return index
+
+
+    def search(self, question: str, game_mode: str, language: str, k: int = 5) -> LexicalResults:
+        """
+        Returns the k chunks of the partition with the highest BM25 score for the question.
+        """
+        partition = self.partitions.get((game_mode, language))
+        terms = set(tokenize(question))
+        if partition is None or not terms or k <= 0:
+            return LexicalResults(results=[], confidence=0.0)
+
+        average_length = partition.average_length or 1.0
+        scores: Dict[int, float] = {}
+        matched: Dict[int, float] = {}
+        total = 0.0
+        for term in terms:
+            idf = partition.idf(term)
+            total += idf
+            for index, frequency in partition.postings.get(term, ()):
+                length_norm = 1 - self.b + self.b * partition.lengths[index] / average_length
+                scores[index] = scores.get(index, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+                matched[index] = matched.get(index, 0.0) + idf
+
+        best = sorted(scores, key=scores.get, reverse=True)[:k]
+        return LexicalResults(
+            results=[(partition.documents[index], scores[index]) for index in best],
+            confidence=matched[best[0]] / total if best and total > 0 else 0.0,
+        )
+
+
+    def __len__(self) -> int:
+        return sum(len(partition.documents) for partition in self.partitions.values())
+
+
+    def save(self, path: str) -> None:
+        """
+        Writes the index as JSON, replacing the previous file at once.
+        """
+        data = {
+            "version": self.version,
+            "partitions": [
+                {
+                    "game_mode": game_mode,
+                    "language": language,
+                    "documents": [{"text": doc.page_content, "metadata": doc.metadata} for doc in partition.documents],
+                    "lengths": partition.lengths,
+                    "postings": partition.postings,
+                }
+                for (game_mode, language), partition in self.partitions.items()
+            ],
+        }
+        with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+            json.dump(data, file)
+        os.replace(f"{path}.tmp", path)
+
+
+    @classmethod
+    def load(cls, path: str) -> Optional["LexicalIndex"]:
+        """
+        Reads an index written by `save`, None when there is none or it is corrupt.
+        """
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return None
+        except json.JSONDecodeError as e:
+            logger.error(f"Lexical index is corrupt, it is rebuilt: {e}")
+            return None
+
+        partitions = {}
+        for partition in data["partitions"]:
+            partitions[(partition["game_mode"], partition["language"])] = LexicalPartition(
+                documents=[Document(page_content=doc["text"], metadata=doc["metadata"]) for doc in partition["documents"]],
+                lengths=partition["lengths"],
+                postings={term: [tuple(posting) for posting in postings]
+                          for term, postings in partition["postings"].items()},
+            )
+        return cls(partitions, data.get("version"))
+
+
+def reciprocal_rank_fusion(vector_results: List[Tuple[Document, float]], lexical_results: List[Tuple[Document, float]],
+                           k: int = 60, limit: int = 5) -> List[Tuple[Document, Optional[float]]]:
+    """
+    Merges the vector and lexical results by the sum of `1 / (k + rank)` of every chunk in both lists.
+
+    Returns:
+        List[Tuple[Document, Optional[float]]]: The best `limit` chunks with their vector distance,
+        None for chunks only found by the lexical search.
+    """
+    scores: Dict[str, float] = {}
+    fused: Dict[str, Tuple[Document, Optional[float]]] = {}
+    for rank, (doc, distance) in enumerate(vector_results):
+        chunk_id = doc.metadata.get("id")
+        scores[chunk_id] = scores.get(chunk_id, 0.0) + 1 / (k + rank + 1)
+        fused[chunk_id] = (doc, distance)
+    for rank, (doc, _score) in enumerate(lexical_results):
+        chunk_id = doc.metadata.get("id")
+        scores[chunk_id] = scores.get(chunk_id, 0.0) + 1 / (k + rank + 1)
+        fused.setdefault(chunk_id, (doc, None))
+
+    best = sorted(scores, key=scores.get, reverse=True)[:limit]
+    return [fused[chunk_id] for chunk_id in best]
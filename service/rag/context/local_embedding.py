@@ -0,0 +1,101 @@
+import importlib.util
+import logging
+import threading
+from typing import List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger("app")
+
+# Module each runtime of sentence-transformers needs, with the package that provides it
+RUNTIME_REQUIREMENTS = {
+    "torch": ("torch", "torch"),
+    "onnx": ("optimum.onnxruntime", "sentence-transformers[onnx]"),
+    "openvino": ("optimum.intel.openvino", "sentence-transformers[openvino]"),
+}
+
+
+class LocalEmbeddings(Embeddings):
+    """
+    Embeds texts on the host with a sentence-transformers model, so neither ingestion nor retrieval waits on a remote API.
+
+    The model is loaded on the first call. Documents are embedded in batches of `batch_size`, every vector is
+    normalized to unit length so the L2 distance used by Chroma ranks chunks like the cosine similarity.
+    """
+
+    def __init__(self, model_name: str, runtime: str = "torch", onnx_file: Optional[str] = None,
+                 batch_size: int = 64, device: str = "cpu"):
+        """
+        Args:
+            model_name (str): Name of the model on the Hugging Face hub, or a local path.
+            runtime (str): Runtime of sentence-transformers: `torch`, `onnx` or `openvino`.
+            onnx_file (str): Optional model file for the `onnx` runtime, e.g. a quantized `onnx/model_qint8_avx512.onnx`.
+            batch_size (int): Amount of texts embedded at once.
+            device (str): Device to embed on.
+
+        Raises:
+            ValueError: If the runtime is not supported.
+            ImportError: If the package the runtime needs is not installed.
+        """
+        if runtime not in RUNTIME_REQUIREMENTS:
+            logger.error(f"Configuration error: unsupported local embedding runtime {runtime}")
+            raise ValueError(f"Unsupported local embedding runtime: {runtime}, expected one of {tuple(RUNTIME_REQUIREMENTS)}")
+        module, package = RUNTIME_REQUIREMENTS[runtime]
+        if not _module_available(module):
+            # Checked here, otherwise the first embedding call of a request or an ingestion would fail
+            logger.error(f"Configuration error: the {runtime} runtime of the local embedding model needs {package}")
+            raise ImportError(f"The {runtime} runtime of the local embedding model needs {package}, "
+                              f"install it with: pip install \"{package}\"")
+
+        self.model_name = model_name
+        self.runtime = runtime
+        self.onnx_file = onnx_file
+        self.batch_size = batch_size
+        self.device = device
+
+        self._model = None
+        self._lock = threading.Lock()
+
+
+    @property
+    def model(self):
+        with self._lock:
+            if self._model is None:
+                # Imported here, torch is only loaded when the local backend is used
+                from sentence_transformers import SentenceTransformer
+
+                model_kwargs = {"file_name": self.onnx_file} if self.onnx_file else None
+                logger.info(f"Loading local embedding model {self.model_name} (runtime={self.runtime}, file={self.onnx_file})")
+                self._model = SentenceTransformer(
+                    self.model_name, device=self.device, backend=self.runtime, model_kwargs=model_kwargs
+                )
+            return self._model
+
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        if len(texts) == 0:
+            return []
+        vectors = self.model.encode(
+            texts,
+            batch_size=self.batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+        return vectors.tolist()
+
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts)
+
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text])[0]
+
+
+def _module_available(module: str) -> bool:
+    try:
+        return importlib.util.find_spec(module) is not None
+    except ModuleNotFoundError:
+        # A parent package of the module is not installed
+        return False
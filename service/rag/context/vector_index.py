@@ -0,0 +1,99 @@
+import logging
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain.schema.document import Document
+from langchain_chroma import Chroma
+
+logger = logging.getLogger("app")
+
+
+@dataclass
+class IndexPartition:
+    documents: List[Document]
+    # One row per chunk, contiguous so a query is a single matrix-vector product
+    matrix: np.ndarray
+    squared_norms: np.ndarray
+
+
+class VectorIndex:
+    """
+    An in-memory index of the chunk embeddings in the Chroma database, with one matrix per (game_mode, language).
+
+    A query only scans the matrix of its partition: the squared L2 distance to every chunk is computed from the
+    precomputed squared norms and one matrix-vector product, the k closest chunks are selected with `argpartition`.
+    Results have the same shape and distances as the Chroma search, `(Document, distance)` from closest to furthest.
+
+    Matrices are stored as float32, or float16 to halve the memory. Distances are always accumulated in float32.
+    """
+
+    def __init__(self, partitions: Dict[Tuple[str, str], IndexPartition], version: Optional[str] = None):
+        self.partitions = partitions
+        self.version = version
+
+
+    @classmethod
+    def from_chroma(cls, db: Chroma, dtype: str = "float32", version: Optional[str] = None) -> "VectorIndex":
+        """
+        Loads every chunk with its embedding from the Chroma database.
+
+        Args:
+            db (Chroma): The Chroma database.
+            dtype (str): `float32` or `float16`.
+            version (str): The corpus version of the database, see `RAGPromptService.corpus_version`.
+        """
+        start = time.perf_counter()
+        items = db.get(include=["embeddings", "documents", "metadatas"])
+
+        grouped: Dict[Tuple[str, str], List[int]] = {}
+        for i, metadata in enumerate(items["metadatas"]):
+            key = (metadata.get("game_mode"), metadata.get("language"))
+            grouped.setdefault(key, []).append(i)
+
+        embeddings = items["embeddings"]
+        partitions = {}
+        for key, rows in grouped.items():
+            matrix = np.ascontiguousarray(np.asarray([embeddings[i] for i in rows], dtype=np.float32))
+            partitions[key] = IndexPartition(
+                documents=[Document(page_content=items["documents"][i], metadata=items["metadatas"][i]) for i in rows],
+                matrix=matrix.astype(dtype),
+                squared_norms=np.einsum("ij,ij->i", matrix, matrix),
+            )
+
+        index = cls(partitions, version)
+        logger.info(
+            f"Loaded vector index of {len(items['ids'])} chunks in {len(partitions)} partitions "
+            f"in {(time.perf_counter() - start) * 1000:.1f} ms ({dtype}, {index.nbytes() / 1024 / 1024:.1f} MiB)"
+        )
+        return index
+
+
+    def search(self, embedding: List[float], game_mode: str, language: str, k: int = 5) -> List[Tuple[Document, float]]:
+        """
+        Returns the k chunks of the partition closest to the embedding, with their squared L2 distance.
+        """
+        partition = self.partitions.get((game_mode, language))
+        if partition is None or k <= 0:
+            return []
+
+        query = np.asarray(embedding, dtype=np.float32)
+        # A float16 matrix is promoted to float32 by the product
+        distances = partition.squared_norms - 2 * (partition.matrix @ query)
+        distances += query @ query
+
+        if k < len(distances):
+            closest = np.argpartition(distances, k)[:k]
+            closest = closest[np.argsort(distances[closest])]
+        else:
+            closest = np.argsort(distances)
+        return [(partition.documents[i], float(max(distances[i], 0.0))) for i in closest]
+
+
+    def __len__(self) -> int:
+        return sum(len(partition.documents) for partition in self.partitions.values())
+
+
+    def nbytes(self) -> int:
+        return sum(partition.matrix.nbytes + partition.squared_norms.nbytes for partition in self.partitions.values())
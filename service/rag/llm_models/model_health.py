@@ -0,0 +1,115 @@
+import threading
+import time
+from typing import Any, Dict, Optional
+
+
+class ModelHealth:
+    """
+    Tracks the recent latency and error rate of a model as exponentially weighted moving averages,
+    together with a circuit breaker.
+
+    After `breaker_failures` consecutive failures the circuit opens and the model is skipped for `breaker_cooldown`
+    seconds. Then a single trial call is let through (half-open): a success closes the circuit, a failure opens it
+    again for another cooldown.
+    """
+
+    def __init__(self, name: str, alpha: float, breaker_failures: int, breaker_cooldown: float):
+        self.name = name
+        self.alpha = alpha
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown = breaker_cooldown
+
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+        self.successes = 0
+        self.failures = 0
+
+
+    def _average(self, average: Optional[float], value: float) -> float:
+        return value if average is None else self.alpha * value + (1 - self.alpha) * average
+
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.breaker_cooldown:
+            return "open"
+        return "half-open"
+
+
+    def try_acquire(self) -> bool:
+        """
+        Returns whether the model may be called. In the half-open state only one trial call is let through at a time.
+        """
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+
+    def record_success(self, latency: Optional[float]) -> None:
+        """
+        Records a successful call. Without a latency, e.g. for a stream, only the error rate is updated.
+        """
+        with self._lock:
+            if latency is not None:
+                self.latency = self._average(self.latency, latency)
+            self.error_rate = self._average(self.error_rate, 0.0)
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self._trial_running = False
+            self.successes += 1
+
+
+    def record_failure(self, latency: Optional[float]) -> None:
+        with self._lock:
+            # A failure took at least this long, timeouts push the latency of a hanging model up
+            if latency is not None:
+                self.latency = self._average(self.latency, latency)
+            self.error_rate = self._average(self.error_rate, 1.0)
+            self.consecutive_failures += 1
+            self._trial_running = False
+            self.failures += 1
+            if self.opened_at is not None or self.consecutive_failures >= self.breaker_failures:
+                self.opened_at = time.monotonic()
+
+
+    def release(self) -> None:
+        """
+        Ends a call without an outcome, e.g. a hedged call that was cancelled because another model answered first.
+        """
+        with self._lock:
+            self._trial_running = False
+
+
+    def expected_latency(self, failure_cost: float) -> float:
+        """
+        Returns the expected time to a successful answer: the average latency plus the error rate times the cost of a
+        failure, since a failed call still has to be answered by another model. A model without calls yet is expected
+        to take `failure_cost` seconds.
+        """
+        if self.latency is None:
+            return failure_cost
+        return self.latency + self.error_rate * failure_cost
+
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "model": self.name,
+            "state": self.state,
+            "latency_ewma": self.latency,
+            "error_rate_ewma": self.error_rate,
+            "consecutive_failures": self.consecutive_failures,
+            "successes": self.successes,
+            "failures": self.failures,
+        }
@@ -1,35 +1,212 @@
+import asyncio
 import logging
-from typing import Optional
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
+from langchain_core.language_models import BaseChatModel
+
+from config import LLM_MODEL_DEADLINE, LLM_HEDGE_DELAY, LLM_EWMA_ALPHA, LLM_BREAKER_FAILURES, LLM_BREAKER_COOLDOWN
+from .model_health import ModelHealth
 from .model_registry import get_models_by_priority
 
 logger = logging.getLogger("app")
 
 
+def model_name(model: BaseChatModel) -> str:
+    return getattr(model, "model", None) or type(model).__name__
+
+
 class ModelQueryService:
-    def __init__(self):
+    def __init__(self, models: Optional[List[BaseChatModel]] = None):
         """
         Initialize the service. Fetch models from the registry in priority order.
+        Every model gets a ModelHealth that tracks its latency, error rate and circuit breaker.
+        """
+        self.models = get_models_by_priority() if models is None else models
+        self.health = [
+            ModelHealth(model_name(model), LLM_EWMA_ALPHA, LLM_BREAKER_FAILURES, LLM_BREAKER_COOLDOWN)
+            for model in self.models
+        ]
+
+    def ranked_models(self) -> List[Tuple[BaseChatModel, ModelHealth]]:
+        """
+        Returns the models ordered by their expected time to a successful answer, see `ModelHealth.expected_latency`,
+        with a failure costing LLM_MODEL_DEADLINE. Models with an open circuit come last, ties keep the priority of
+        the registry.
         """
-        self.models = get_models_by_priority()
+        order = sorted(
+            range(len(self.models)),
+            key=lambda i: (self.health[i].state == "open", self.health[i].expected_latency(LLM_MODEL_DEADLINE), i),
+        )
+        return [(self.models[i], self.health[i]) for i in order]
 
     def query(self, prompt: str) -> Optional[str]:
         """
-        Query the models in order of priority. 
+        Query the models one after another, in the order of `ranked_models`, skipping models with an open circuit.
         Returns the first successful response or None if all models fail.
         """
-        for model in self.models:
+        for model, health in self.ranked_models():
+            if not health.try_acquire():
+                logger.info(f"Skipping model {health.name}, its circuit breaker is open.")
+                continue
+
+            start = time.perf_counter()
             try:
-                logger.info(f"Querying model: {model}")
+                logger.info(f"Querying model: {health.name}")
                 response = model.invoke(prompt)  # Use LangChain's `invoke` method
-                if response and hasattr(response, "content"):
-                    logger.info("Model responded successfully.")
-                    return response.content
-                else:
-                    logger.warning("Model returned an invalid or empty response.")
             except Exception as e:
+                health.record_failure(time.perf_counter() - start)
                 logger.error(f"Model failed with error: {e}")
                 continue  # Proceed to the next model if one fails
 
+            if response and hasattr(response, "content"):
+                health.record_success(time.perf_counter() - start)
+                logger.info("Model responded successfully.")
+                return response.content
+
+            health.record_failure(time.perf_counter() - start)
+            logger.warning("Model returned an invalid or empty response.")
+
         logger.error("All models failed to respond.")
-        return None
\ No newline at end of file
+        return None
+
+    async def aquery(self, prompt: str) -> Optional[str]:
+        """
+        Query the models with LangChain's `ainvoke`, in the order of `ranked_models`, with hedging:
+        - Every call has a deadline of LLM_MODEL_DEADLINE seconds.
+        - When a model has not answered after LLM_HEDGE_DELAY seconds, the next model is called as well. The first
+          answer wins and the other call is cancelled. A delay of 0 or less disables hedging.
+        - A failed call is replaced by a call to the next model right away.
+        Returns the first successful response or None if all models fail.
+        """
+        candidates = iter(self.ranked_models())
+        running: Dict[asyncio.Task, ModelHealth] = {}
+
+        def start_next() -> bool:
+            for model, health in candidates:
+                if health.try_acquire():
+                    running[asyncio.create_task(self._ainvoke(model, health, prompt))] = health
+                    return True
+                logger.info(f"Skipping model {health.name}, its circuit breaker is open.")
+            return False
+
+        can_hedge = start_next() and LLM_HEDGE_DELAY > 0
+        try:
+            while running:
+                # At most one hedged call is in flight
+                hedge = can_hedge and len(running) == 1
+                done, _ = await asyncio.wait(
+                    running, timeout=LLM_HEDGE_DELAY if hedge else None, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    logger.info(f"No answer after {LLM_HEDGE_DELAY}s, hedging with the next model.")
+                    can_hedge = start_next()
+                    continue
+
+                for task in done:
+                    running.pop(task)
+                    response = task.result()
+                    if response is not None:
+                        return response
+                    can_hedge = start_next() and can_hedge
+
+            logger.error("All models failed to respond.")
+            return None
+
+        finally:
+            # Cancel the calls that lost the race
+            for task in running:
+                task.cancel()
+
+    async def _ainvoke(self, model: BaseChatModel, health: ModelHealth, prompt: str) -> Optional[str]:
+        """
+        Calls a model within its deadline and records the outcome. Returns None when the call failed.
+        """
+        start = time.perf_counter()
+        try:
+            logger.info(f"Querying model: {health.name}")
+            response = await asyncio.wait_for(model.ainvoke(prompt), LLM_MODEL_DEADLINE)
+        except asyncio.CancelledError:
+            health.release()
+            raise
+        except asyncio.TimeoutError:
+            health.record_failure(time.perf_counter() - start)
+            logger.error(f"Model {health.name} did not respond within {LLM_MODEL_DEADLINE}s.")
+            return None
+        except Exception as e:
+            health.record_failure(time.perf_counter() - start)
+            logger.error(f"Model failed with error: {e}")
+            return None
+
+        if response and hasattr(response, "content"):
+            health.record_success(time.perf_counter() - start)
+            logger.info(f"Model {health.name} responded successfully.")
+            return response.content
+
+        health.record_failure(time.perf_counter() - start)
+        logger.warning("Model returned an invalid or empty response.")
+        return None
+
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        """
+        Streams the response of the first model that produces a token, in the order of `ranked_models`.
+        A model that fails or misses the LLM_MODEL_DEADLINE before its first token is skipped for the next one.
+        Once tokens have been yielded the response can not be restarted, an error of the model is raised instead.
+        Streams are not hedged, and only update the error rates and circuit breakers of the models.
+
+        Raises:
+            RuntimeError: If all models fail before their first token.
+        """
+        for model, health in self.ranked_models():
+            if not health.try_acquire():
+                logger.info(f"Skipping model {health.name}, its circuit breaker is open.")
+                continue
+
+            chunks = model.astream(prompt)
+            try:
+                logger.info(f"Streaming model: {health.name}")
+                first_token = await asyncio.wait_for(_first_token(chunks), LLM_MODEL_DEADLINE)
+            except asyncio.CancelledError:
+                health.release()
+                raise
+            except Exception as e:
+                health.record_failure(None)
+                logger.error(f"Model failed with error: {e!r}")
+                await chunks.aclose()
+                continue  # Proceed to the next model if one fails
+
+            if first_token is None:
+                health.record_failure(None)
+                logger.warning("Model returned an invalid or empty response.")
+                continue
+
+            health.record_success(None)
+            yield first_token
+            try:
+                async for chunk in chunks:
+                    if isinstance(chunk.content, str) and chunk.content:
+                        yield chunk.content
+            except Exception:
+                health.record_failure(None)
+                raise
+            logger.info("Model streamed successfully.")
+            return
+
+        logger.error("All models failed to respond.")
+        raise RuntimeError("All models failed to respond.")
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """
+        Returns the health of every model, in the order the next query tries them.
+        """
+        return [health.stats() for _, health in self.ranked_models()]
+
+
+async def _first_token(chunks: AsyncIterator) -> Optional[str]:
+    """
+    Returns the content of the first chunk with text, None when the stream ends without text.
+    """
+    async for chunk in chunks:
+        if isinstance(chunk.content, str) and chunk.content:
+            return chunk.content
+    return None
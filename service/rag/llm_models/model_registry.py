@@ -2,7 +2,7 @@ from langchain_core.language_models import BaseChatModel
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_mistralai import ChatMistralAI
 
-from config import GEMINI_KEY, GEMINI_LLM_MODEL, MISTRAL_KEY, MISTRAL_LLM_MODEL
+from config import GEMINI_KEY, GEMINI_LLM_MODEL, GEMINI_TIMEOUT, MISTRAL_KEY, MISTRAL_LLM_MODEL
 from typing import List, Tuple, Optional
 import logging
 
@@ -34,7 +34,7 @@ def get_gemini_model() -> Optional[BaseChatModel]:
             google_api_key=GEMINI_KEY,
             model=GEMINI_LLM_MODEL,
             temperature=0,
-            timeout=None,
+            timeout=GEMINI_TIMEOUT,
             max_retries=2,
         )
     except Exception as e:
@@ -1,9 +1,16 @@
 import logging
+from typing import AsyncIterator, Dict, Any, List, Optional, Tuple
+
+from langchain.schema.document import Document
 
 from repository import save_chat_history
-from schema import LLMQueryDTO, LLMResponseDTO, SupportedLanguage
+from config import ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_SIMILARITY_THRESHOLD
+from schema import ChatHistory, LLMQueryDTO, LLMResponseDTO, SupportedLanguage
+from service.executors import run_in_rag_executor
+from .answer_cache import SemanticAnswerCache
 from .llm_models import ModelQueryService
 from .context import RAGPromptService
+from .context.embedding import get_embedding_function
 from repository import save_chat_history, get_chat_history
 
 
@@ -13,12 +20,18 @@ class RAGModelQueryService:
     def __init__(self):
         """
         Initialize the RAGModelQueryService with model names and the necessary services.
-        """       
+        """
 
         # Initialize the RAGPromptService and ModelQueryService
         self.rag_prompt_service = RAGPromptService()
         self.model_query_service = ModelQueryService()
 
+        self.answer_cache = SemanticAnswerCache(
+            max_size=ANSWER_CACHE_SIZE,
+            ttl_seconds=ANSWER_CACHE_TTL,
+            threshold=ANSWER_CACHE_SIMILARITY_THRESHOLD,
+        )
+
 
     def query(self, request: LLMQueryDTO) -> LLMResponseDTO:
         """
@@ -28,25 +41,27 @@ class RAGModelQueryService:
         :return: LLMResponseDTO with the model's response or error.
         """
         try:
-            
+
             history = get_chat_history(request.session_id)
-            
-            
+
+            # Embed the question once, for the answer cache and the context search, unless its keywords suffice
+            results, embedding = self.rag_prompt_service.retrieve_context(request)
+
+            use_answer_cache = self._uses_answer_cache(history, results, embedding)
+            if use_answer_cache:
+                self.answer_cache.check_corpus_version(self.rag_prompt_service.corpus_version())
+                cached_response = self._cached_response(request, embedding, results)
+                if cached_response is not None:
+                    save_chat_history(request.session_id, request.question, cached_response.llm_response)
+                    return cached_response
+
             # Use the RAG service to create the prompt
-            prompt = self.rag_prompt_service.create_prompt(request, history)
+            prompt = self.rag_prompt_service.create_prompt(request, history, results)
             logger.info(f"Prompt: \n{prompt}")
-            
+
             if prompt is None:
-                return LLMResponseDTO(
-                    session_id=request.session_id,
-                    successful=False,
-                    llm_response=( 
-                        "Helaas beschik ik niet over de nodige informatie om op je vraag te antwoorden. Contacteer de developers van de game."
-                        if request.language == SupportedLanguage.nl else
-                        "Unfortunately I don't posses the necessary information to answer your question. Please contact the devs."
-                    )
-                )
-            
+                return self._no_context_response(request)
+
             # Use the ModelQueryService to query the model with the prompt
             response = self.model_query_service.query(prompt)
 
@@ -54,6 +69,8 @@ class RAGModelQueryService:
                 raise RuntimeError("All models failed to respond.")
 
             save_chat_history(request.session_id, request.question, response)
+            if use_answer_cache:
+                self._cache_response(request, embedding, results, response)
 
             return LLMResponseDTO(
                 session_id=request.session_id,
@@ -63,8 +80,174 @@ class RAGModelQueryService:
 
         except Exception as e:
             logger.error(f"Error processing query: {e}")
+            return self._error_response(request)
+
+
+    async def aquery(self, request: LLMQueryDTO) -> LLMResponseDTO:
+        """
+        Same as `query`, but without holding a thread while waiting: the question is embedded and the models are
+        called with the async LangChain APIs, the chat history and Chroma calls run in the RAG thread pool.
+
+        :param request: The query request containing the question and other metadata.
+        :return: LLMResponseDTO with the model's response or error.
+        """
+        try:
+            history = await run_in_rag_executor(get_chat_history, request.session_id)
+
+            # Embed the question once, for the answer cache and the context search, unless its keywords suffice
+            results, embedding = await self.rag_prompt_service.aretrieve_context(request)
+
+            use_answer_cache = self._uses_answer_cache(history, results, embedding)
+            if use_answer_cache:
+                self.answer_cache.check_corpus_version(await self.rag_prompt_service.acorpus_version())
+                cached_response = self._cached_response(request, embedding, results)
+                if cached_response is not None:
+                    await run_in_rag_executor(save_chat_history, request.session_id, request.question, cached_response.llm_response)
+                    return cached_response
+
+            prompt = await self.rag_prompt_service.acreate_prompt(request, history, results)
+            logger.info(f"Prompt: \n{prompt}")
+
+            if prompt is None:
+                return self._no_context_response(request)
+
+            response = await self.model_query_service.aquery(prompt)
+
+            if response is None:
+                raise RuntimeError("All models failed to respond.")
+
+            await run_in_rag_executor(save_chat_history, request.session_id, request.question, response)
+            if use_answer_cache:
+                self._cache_response(request, embedding, results, response)
+
             return LLMResponseDTO(
                 session_id=request.session_id,
-                successful=False,
-                llm_response=("An unexpected error occurred." if request.language == "en" else "Er is iets misgegaan. Contacteer de developers.")
-            )
\ No newline at end of file
+                successful=True,
+                llm_response=response
+            )
+
+        except Exception as e:
+            logger.error(f"Error processing query: {e}")
+            return self._error_response(request)
+
+
+    async def astream(self, request: LLMQueryDTO) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Same as `aquery`, but the answer is streamed while the model generates it.
+
+        Yields `("token", text)` for every piece of the answer, followed by one `("done", LLMResponseDTO)` with the
+        complete answer, or with the error message when the query failed. A cached answer is yielded as a single token.
+        The chat history is saved once the answer is complete, not when the client disconnects during the stream.
+        """
+        try:
+            history = await run_in_rag_executor(get_chat_history, request.session_id)
+
+            results, embedding = await self.rag_prompt_service.aretrieve_context(request)
+
+            use_answer_cache = self._uses_answer_cache(history, results, embedding)
+            if use_answer_cache:
+                self.answer_cache.check_corpus_version(await self.rag_prompt_service.acorpus_version())
+                cached_response = self._cached_response(request, embedding, results)
+                if cached_response is not None:
+                    yield "token", cached_response.llm_response
+                    await run_in_rag_executor(save_chat_history, request.session_id, request.question, cached_response.llm_response)
+                    yield "done", cached_response
+                    return
+
+            prompt = await self.rag_prompt_service.acreate_prompt(request, history, results)
+            logger.info(f"Prompt: \n{prompt}")
+
+            if prompt is None:
+                response = self._no_context_response(request)
+                yield "token", response.llm_response
+                yield "done", response
+                return
+
+            tokens = []
+            async for token in self.model_query_service.astream(prompt):
+                tokens.append(token)
+                yield "token", token
+            response = "".join(tokens)
+
+            await run_in_rag_executor(save_chat_history, request.session_id, request.question, response)
+            if use_answer_cache:
+                self._cache_response(request, embedding, results, response)
+
+            yield "done", LLMResponseDTO(
+                session_id=request.session_id,
+                successful=True,
+                llm_response=response
+            )
+
+        except Exception as e:
+            logger.error(f"Error processing query: {e}")
+            yield "done", self._error_response(request)
+
+
+    def _uses_answer_cache(self, history: List[ChatHistory], results: List[Tuple[Document, Optional[float]]],
+                           embedding: Optional[List[float]]) -> bool:
+        # Answers to follow-up questions depend on the history, only standalone questions use the answer cache.
+        # Questions answered from the lexical fast path are not embedded, so they can not be compared.
+        return self.answer_cache.enabled and len(history) == 0 and len(results) > 0 and embedding is not None
+
+
+    @staticmethod
+    def _answer_cache_key(request: LLMQueryDTO, results: List[Tuple[Document, Optional[float]]]) -> Tuple[tuple, List[str]]:
+        partition = (request.game_mode, request.language)
+        chunk_ids = [doc.metadata.get("id") for doc, _score in results]
+        return partition, chunk_ids
+
+
+    def _cached_response(self, request: LLMQueryDTO, embedding: List[float],
+                         results: List[Tuple[Document, Optional[float]]]) -> Optional[LLMResponseDTO]:
+        partition, chunk_ids = self._answer_cache_key(request, results)
+        cached_response = self.answer_cache.get(partition, embedding, chunk_ids)
+        if cached_response is None:
+            return None
+
+        logger.info(f"Query_ID: {request.session_id} - Answered from the answer cache")
+        return LLMResponseDTO(
+            session_id=request.session_id,
+            successful=True,
+            llm_response=cached_response,
+            cached=True,
+        )
+
+
+    def _cache_response(self, request: LLMQueryDTO, embedding: List[float],
+                        results: List[Tuple[Document, Optional[float]]], response: str) -> None:
+        partition, chunk_ids = self._answer_cache_key(request, results)
+        self.answer_cache.put(partition, embedding, chunk_ids, response)
+
+
+    @staticmethod
+    def _no_context_response(request: LLMQueryDTO) -> LLMResponseDTO:
+        return LLMResponseDTO(
+            session_id=request.session_id,
+            successful=False,
+            llm_response=(
+                "Helaas beschik ik niet over de nodige informatie om op je vraag te antwoorden. Contacteer de developers van de game."
+                if request.language == SupportedLanguage.nl else
+                "Unfortunately I don't posses the necessary information to answer your question. Please contact the devs."
+            )
+        )
+
+
+    @staticmethod
+    def _error_response(request: LLMQueryDTO) -> LLMResponseDTO:
+        return LLMResponseDTO(
+            session_id=request.session_id,
+            successful=False,
+            llm_response=("An unexpected error occurred." if request.language == "en" else "Er is iets misgegaan. Contacteer de developers.")
+        )
+
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """
+        Returns the hit rates of the chatbot caches and the tokens saved by the prompt builder.
+        """
+        return {
+            "embeddings": get_embedding_function().stats(),
+            "answers": self.answer_cache.stats(),
+            "prompts": self.rag_prompt_service.prompt_builder.stats(),
+        }